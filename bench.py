@@ -0,0 +1,306 @@
+"""Offline benchmarks for BetBot's hot paths
+
+Imports "bet bot.py" without connecting to Discord and drives the command
+handlers directly with a fake context, fake guilds and a stubbed
+bot.fetch_user. Each workload runs against synthetic state in a throwaway
+directory, so the real data files are never touched.
+
+    python bench.py                      # full sizes (up to 1M tickets)
+    python bench.py --quick              # small sizes, a few seconds
+    python bench.py --only draw_lottery save_data_sync --tickets 1000000
+    python bench.py --output bench_output.txt
+
+Each row reports operations, throughput and per-call p50/p99 latency.
+"""
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+import tickets
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# Fakes
+class FakeMessage:
+    id = 1
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def edit(self, **kwargs):
+        pass
+
+    async def delete(self):
+        pass
+
+    async def clear_reactions(self):
+        pass
+
+
+class FakeContext:
+    """Just enough of commands.Context for the handlers; send() only counts"""
+
+    def __init__(self, user_id, guild_id=1, channel_id=1):
+        self.author = types.SimpleNamespace(id=user_id, mention=f"<@{user_id}>", name=f"user{user_id}",
+                                            display_name=f"user{user_id}", roles=[], bot=False)
+        self.guild = types.SimpleNamespace(id=guild_id)
+        self.channel = types.SimpleNamespace(id=channel_id)
+        self.prefix = '$'
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return FakeMessage()
+
+
+def fake_guild(guild_id, members, per_channel=25):
+    """A guild whose voice channels hold the given member ids"""
+    channels = []
+    for start in range(0, len(members), per_channel):
+        channels.append(types.SimpleNamespace(
+            name=f"Voice {start // per_channel}",
+            members=[types.SimpleNamespace(id=member_id, bot=False, display_name=f"user{member_id}",
+                                           voice=types.SimpleNamespace(self_deaf=False))
+                     for member_id in members[start:start + per_channel]]
+        ))
+    return types.SimpleNamespace(id=guild_id, voice_channels=channels)
+
+
+def load_bot():
+    """Import the bot module (it only connects under __main__)"""
+    sys.path.insert(0, ROOT)
+    spec = importlib.util.spec_from_file_location('betbot', os.path.join(ROOT, 'bet bot.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['betbot'] = module
+    logging.disable(logging.INFO)  # The per-event info lines would dominate the timings
+    spec.loader.exec_module(module)
+
+    async def fetch_user(user_id):
+        return types.SimpleNamespace(id=user_id, name=f"user{user_id}", mention=f"<@{user_id}>")
+
+    async def wait_for(*args, **kwargs):
+        return None  # Every confirmation is accepted at once
+
+    module.bot.fetch_user = fetch_user
+    module.bot.wait_for = wait_for
+    module.bot.get_channel = lambda channel_id: None
+    return module
+
+
+# Measurement
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Result:
+    def __init__(self, name, size, unit, ops, elapsed, latencies):
+        self.name = name
+        self.size = size
+        self.unit = unit
+        self.ops = ops
+        self.elapsed = elapsed
+        self.latencies = latencies
+
+    def row(self):
+        return (f"{self.name:<18}{self.size:>14}{self.ops:>12,}{self.ops / self.elapsed:>14,.0f} {self.unit + '/s':<10}"
+                f"{percentile(self.latencies, 0.5) * 1000:>10.2f}{percentile(self.latencies, 0.99) * 1000:>10.2f}")
+
+
+HEADER = f"{'benchmark':<18}{'size':>14}{'ops':>12}{'throughput':>14} {'':<10}{'p50 ms':>10}{'p99 ms':>10}"
+
+
+async def timed_calls(calls, setup=None):
+    """Await each call, returns (total seconds, per-call latencies)"""
+    latencies = []
+    for call in calls:
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - start)
+    return sum(latencies), latencies
+
+
+# Synthetic state
+def seed_users(bot, count):
+    bot.user_points.clear()
+    bot.user_points.update((str(user_id), random.randint(0, 50000)) for user_id in range(1, count + 1))
+    bot.rankings.rebuild(bot.user_points)
+
+
+def seed_tickets(bot, count, users):
+    history = bot.lottery_history
+    history.clear()
+    batch = 1000
+    for start in range(0, count, batch):
+        masks, pbs = bot.random_tickets(min(batch, count - start), bot.MAIN_NUMBER_RANGE, bot.POWERBALL_RANGE)
+        history.extend(random.randint(1, users), masks, pbs, time.time())
+
+
+def seed_bet(bot, bet_id, bettors, options=4):
+    names = [f"Option {n}" for n in range(1, options + 1)]
+    bet = {
+        'name': f"Bench {bet_id}",
+        'options': names,
+        'bets': {option: {} for option in names},
+        'totals': {option: 0 for option in names},
+        'counts': {option: 0 for option in names},
+        'end_time': (datetime.now() + timedelta(minutes=5)).isoformat(),
+        'creator': 1,
+        'channel': 1,
+        'resolved': False
+    }
+    for user_id in range(1, bettors + 1):
+        option = random.choice(names)
+        amount = random.randint(1, 500)
+        bet['bets'][option][str(user_id)] = amount
+        bet['totals'][option] += amount
+        bet['counts'][option] += 1
+    bot.active_bets[bet_id] = bet
+
+
+# Workloads
+async def bench_quick_pick(bot, args):
+    results = []
+    for total in args.tickets:
+        per_call = 100
+        calls = max(1, total // per_call)
+        bot.lottery_history.clear()
+        await bot.ensure_user('1')
+        bot.ledger.set_balance('1', bot.LOTTERY_COST * per_call * calls)
+        ctx = FakeContext(1)
+        elapsed, latencies = await timed_calls(lambda: bot.quick_pick.callback(ctx, per_call) for _ in range(calls))
+        results.append(Result('quick_pick', f"{total:,} tix", 'tickets', calls * per_call, elapsed, latencies))
+    return results
+
+
+async def bench_draw_lottery(bot, args):
+    results = []
+    seed_users(bot, args.users)
+    for total in args.tickets:
+        ctx = FakeContext(1)
+        elapsed, latencies = await timed_calls(
+            (lambda: bot.draw_lottery.callback(ctx) for _ in range(args.repeat)),
+            setup=lambda: seed_tickets(bot, total, args.users)
+        )
+        results.append(Result('draw_lottery', f"{total:,} tix", 'tickets', total * args.repeat, elapsed, latencies))
+    return results
+
+
+async def bench_resolve_bet(bot, args):
+    ctx = FakeContext(1)
+    bettors = min(args.users, 100000)
+    seed_users(bot, args.users)
+    bet_ids = [f"bench{n}" for n in range(args.repeat)]
+    for bet_id in bet_ids:
+        seed_bet(bot, bet_id, bettors)
+    bot.bet_deadlines.clear()
+    elapsed, latencies = await timed_calls(lambda bet_id=bet_id: bot.resolve_bet.callback(ctx, bet_id, 1) for bet_id in bet_ids)
+    return [Result('resolve_bet', f"{bettors:,} stakes", 'stakes', bettors * len(bet_ids), elapsed, latencies)]
+
+
+async def bench_show_leaderboard(bot, args):
+    seed_users(bot, args.users)
+    ctx = FakeContext(random.randint(1, args.users))
+    pages = bot.rankings.pages(bot.LEADERBOARD_PAGE_SIZE)
+    calls = args.repeat * 20
+    elapsed, latencies = await timed_calls(
+        lambda: bot.show_leaderboard.callback(ctx, random.randint(1, pages)) for _ in range(calls)
+    )
+    return [Result('show_leaderboard', f"{args.users:,} users", 'pages', calls, elapsed, latencies)]
+
+
+async def bench_check_voice_time(bot, args):
+    members = list(range(1, args.voice_members + 1))
+    bot.bot._connection._guilds = {1: fake_guild(1, members)}
+    bot.voice_payouts.clear()
+    try:
+        elapsed, latencies = await timed_calls(bot.check_voice_time for _ in range(args.repeat))
+    finally:
+        bot.bot._connection._guilds = {}
+        bot.voice_payouts.clear()
+    return [Result('check_voice_time', f"{args.voice_members:,} members", 'members',
+                   args.voice_members * args.repeat, elapsed, latencies)]
+
+
+async def bench_save_data_sync(bot, args):
+    results = []
+    seed_users(bot, args.users)
+    for total in args.tickets:
+        seed_tickets(bot, total, args.users)
+        state = bot.guild_state()
+        latencies = []
+        written = 0
+        for _ in range(args.repeat):
+            before = state.store.bytes_written
+            start = time.perf_counter()
+            bot.save_data_sync()
+            latencies.append(time.perf_counter() - start)
+            written += state.store.bytes_written - before
+        results.append(Result('save_data_sync', f"{total:,} tix", 'KB', written // 1024,
+                              sum(latencies), latencies))
+    return results
+
+
+BENCHMARKS = {
+    'quick_pick': bench_quick_pick,
+    'draw_lottery': bench_draw_lottery,
+    'resolve_bet': bench_resolve_bet,
+    'show_leaderboard': bench_show_leaderboard,
+    'check_voice_time': bench_check_voice_time,
+    'save_data_sync': bench_save_data_sync,
+}
+
+
+async def run(args):
+    bot = load_bot()
+    bot.load_data()
+    lines = [f"BetBot benchmarks {datetime.now():%Y-%m-%d %H:%M} • Python {sys.version.split()[0]}"
+             f" • NumPy {'yes' if tickets.np is not None else 'no'}", HEADER]
+    print("\n".join(lines), flush=True)
+    for name in args.only or BENCHMARKS:
+        for result in await BENCHMARKS[name](bot, args):
+            lines.append(result.row())
+            print(lines[-1], flush=True)
+    # Let debounced saves finish before the temp directory goes away
+    await bot.save_scheduler.flush_now()
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument('--tickets', nargs='+', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--voice-members', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5, help="calls per measurement")
+    parser.add_argument('--quick', action='store_true', help="small sizes for a smoke run")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help="also append the results to this file")
+    args = parser.parse_args()
+    if args.quick:
+        args.tickets, args.users, args.voice_members, args.repeat = [10000], 10000, 500, 3
+    random.seed(args.seed)
+
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory(prefix='betbot-bench-') as workdir:
+        os.chdir(workdir)
+        lines = asyncio.run(run(args))
+        os.chdir(ROOT)
+    if output:
+        with open(output, 'a', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from discord.ext import commands, tasks
 import json
 import random
 from datetime import datetime, time, timedelta
+from time import time as epoch_time, perf_counter
 import asyncio
 import aiohttp
 from dotenv import load_dotenv
@@ -10,12 +11,29 @@ import os
 import pytz
 from collections import defaultdict
 import uuid
+import heapq
+import copy
+import csv
+import io
 import sys
 import platform
 import logging
-import threading
-from concurrent.futures import ThreadPoolExecutor
-from aiohttp import ClientSession
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from storage import open_store, open_archive, migrate_voice_tracking, SaveScheduler
+from tickets import TicketStore, random_tickets, mask_to_numbers, settle_draw, lottery_frequencies
+from scheduler import DeadlineScheduler
+from names import NameResolver
+from ranking import RankIndex
+from ledger import Ledger, InsufficientFunds, SharedStateBusy
+from payouts import parimutuel_payouts
+from odds import tier_odds, format_odds, ticket_value
+from partitions import PartitionManager
+from shared_state import open_shared_balances
+from metrics import MetricsRegistry, LoopLagProbe, serve_prometheus, BYTES_BUCKETS, DEPTH_BUCKETS
+from loop_watchdog import LoopWatchdog
 
 # Windows event loop policy fix
 if platform.system() == 'Windows':
@@ -36,23 +54,20 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Data storage
-user_points = {}
-active_bets = {}
-last_daily = {}
-last_message_time = {}
-voice_time_tracking = {}
-voice_start_times = {}
-voice_channel_points = defaultdict(int)
-next_voice_payout = {}
-lottery_pot = 0
-lottery_history = []
-lottery_winners = []
-
 # Thread safety for data operations
-_save_lock = threading.Lock()
 _executor = ThreadPoolExecutor(max_workers=2)
 
+# Performance metrics, read with $perf (and served at /metrics when METRICS_PORT is set)
+metrics = MetricsRegistry(prefix='betbot')
+command_seconds = metrics.histogram('command_seconds', 'Command latency from invoke to completion', label='command')
+save_seconds = metrics.histogram('save_seconds', 'Duration of a store write', label='kind')
+save_bytes = metrics.histogram('save_bytes', 'Bytes written by a store write', BYTES_BUCKETS, label='kind')
+loop_lag_seconds = metrics.histogram('loop_lag_seconds', 'How late the event loop woke a sleeping task')
+executor_queue_depth = metrics.histogram('executor_queue_depth', 'Jobs waiting for a save executor thread', DEPTH_BUCKETS)
+voice_check_seconds = metrics.histogram('voice_check_seconds', 'Duration of a full voice reconciliation')
+loop_stall_seconds = metrics.histogram('loop_stall_seconds', 'Event loop stalls by the command or task that caused them',
+                                       label='source')
+
 # Configuration
 OWNER_ROLE_NAME = "Bot Owner"
 ADMIN_ROLE_NAME = "Bot Admin"
@@ -61,6 +76,57 @@ DAILY_RESET_HOUR = 0  # 12 AM
 DAILY_RESET_MINUTE = 0
 MAX_BET_DURATION = 1440  # 24 hours in minutes
 MIN_BET_DURATION = 1     # 1 minute minimum
+MAX_BET_OPTIONS = 10     # One keycap emoji per option
+OPTION_EMOJIS = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣', '🔟']
+LEADERBOARD_PAGE_SIZE = 10
+SAVE_DEBOUNCE_SECONDS = 2.0  # Coalesce saves into at most one flush per window
+SNAPSHOT_GENERATIONS = 3     # Previous data.json snapshots kept for recovery
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')  # 'json' or 'sqlite'
+
+# Sharding: SHARD_COUNT/SHARD_IDS split the gateway across processes
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or None
+SHARD_IDS = [int(i) for i in os.getenv('SHARD_IDS', '').split(',') if i.strip()] or None
+SHARDED = os.getenv('SHARDED', '0') == '1' or SHARD_COUNT is not None
+# Separate balances/bets/lottery per guild, stored under guilds/<guild_id>/
+PARTITION_BY_GUILD = os.getenv('PARTITION_BY_GUILD', '1' if SHARDED else '0') == '1'
+# Guild that inherits the existing unpartitioned data the first time partitioning is turned on;
+# without it the bot refuses to start partitioned rather than leave that data behind
+LEGACY_GUILD_ID = os.getenv('LEGACY_GUILD_ID')
+
+# Multi-process: every process points at one shared balance database (or 'local' stand-in)
+STATE_SERVICE = os.getenv('STATE_SERVICE')
+SHARED_REFRESH_SECONDS = 30   # How often balances changed by other processes are pulled in
+DATA_DIR = os.getenv('DATA_DIR', '')  # Give each process its own when running several
+
+# Metrics endpoint (off unless METRICS_PORT is set; binds to localhost by default)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0')) or None
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+LOOP_LAG_INTERVAL = 0.5  # Seconds between event loop lag samples
+
+# Blocking detector: logs the stack of anything holding the loop longer than the threshold
+LOOP_WATCHDOG = os.getenv('LOOP_WATCHDOG', '0') == '1'
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv('LOOP_WATCHDOG_THRESHOLD', '0.25'))  # Seconds
+
+# CPU-heavy lottery work (draw settlement, stats) runs in worker processes; 0 keeps it inline
+CPU_WORKERS = int(os.getenv('CPU_WORKERS', '2'))
+CPU_OFFLOAD_MIN_TICKETS = 20000  # Smaller jobs are cheaper inline than the pickling round trip
+
+# Data storage: each name resolves to the current guild's partition (see partitions.py)
+partitions = PartitionManager(enabled=PARTITION_BY_GUILD)
+user_points = partitions.proxy('user_points')
+active_bets = partitions.proxy('active_bets')
+last_daily = partitions.proxy('last_daily')
+last_message_time = partitions.proxy('last_message_time')
+voice_time_tracking = partitions.proxy('voice_time_tracking')
+voice_start_times = partitions.proxy('voice_start_times')
+voice_channel_points = partitions.proxy('voice_channel_points')
+next_voice_payout = partitions.proxy('next_voice_payout')
+pending_message_points = partitions.proxy('pending_message_points')  # Earned but not yet credited
+lottery_history = partitions.proxy('lottery_history')
+lottery_winners = partitions.proxy('lottery_winners')
+store = partitions.proxy('store')
+archive = partitions.proxy('archive')  # Finished bets live here instead of in active_bets
+rankings = partitions.proxy('rankings')  # Leaderboard order, kept current by the ledger
 
 # Lottery settings
 INITIAL_POT = 200000
@@ -72,6 +138,7 @@ MATCH4_PERCENT = 0.05
 MAIN_NUMBER_RANGE = range(1, 19)
 POWERBALL_RANGE = range(1, 11)
 DAILY_JACKPOT_INCREASE = 2000 
+TICKET_ATTACHMENT_THRESHOLD = 45  # Larger quick picks arrive as one CSV file instead of many messages
 
 # Voice points settings
 VOICE_INTERVAL = 1800  # 30 minutes in seconds
@@ -80,16 +147,27 @@ MIN_VOICE_POINTS = 3
 VOICE_SCALE_DOWN = 3  # Points reduced per hour
 VOICE_MINIMUM_SECONDS = 300  # 5 minutes minimum to earn points
 
-TICKET_RULES = f"""
-🎟 **Lottery Rules (1-18 Main Numbers):**
+# Message activity settings
+MESSAGE_POINTS = 1           # Points per rewarded message
+MESSAGE_COOLDOWN = 60        # Seconds between rewarded messages per user
+MESSAGE_FLUSH_INTERVAL = 30  # Seconds between batched credits of message points
+
+def number_span(numbers):
+    return f"{numbers[0]}-{numbers[-1]}"
+
+def ticket_rules():
+    """Lottery rules with the odds worked out for the configured ranges"""
+    odds = tier_odds(MAIN_NUMBER_RANGE, POWERBALL_RANGE)
+    return f"""
+🎟 **Lottery Rules ({number_span(MAIN_NUMBER_RANGE)} Main Numbers):**
 - Starting Pot: {INITIAL_POT} points
 - Cost: {LOTTERY_COST} points per ticket
-- Pick 5 main numbers (1-18) + 1 Powerball (1-10)
+- Pick 5 main numbers ({number_span(MAIN_NUMBER_RANGE)}) + 1 Powerball ({number_span(POWERBALL_RANGE)})
 - Prize Structure:
-  🏆 JACKPOT (5+PB): 80% of pot • Odds: 1 in 85,680
-  💎 Match 5 (5 main): 10% of pot • Odds: 1 in 9,520
-  🔥 Match 4 (4 main): 5% of pot • Odds: 1 in 132
-  🎯 Powerball Only: {POWERBALL_BONUS} points • Odds: 1 in 19.5
+  🏆 JACKPOT (5+PB): {JACKPOT_PERCENT:.0%} of pot • Odds: {format_odds(odds['jackpot'])}
+  💎 Match 5 (5 main): {MATCH5_PERCENT:.0%} of pot • Odds: {format_odds(odds['match5'])}
+  🔥 Match 4 (4 main): {MATCH4_PERCENT:.0%} of pot • Odds: {format_odds(odds['match4'])}
+  🎯 Powerball: {POWERBALL_BONUS} points • Odds: {format_odds(odds['powerball'])}
 """
 
 def get_example(command_name):
@@ -99,10 +177,11 @@ def get_example(command_name):
         "daily": "",
         "voicepoints": "",
         "voicestatus": "",
-        "leaderboard": "",
-        "createbet": "WillItRain? Yes No 60",
+        "leaderboard": "2",
+        "createbet": "WillItRain? Yes No Maybe duration=60",
         "placebet": "abc123 1 50",
         "activebets": "",
+        "betarchive": "abc123",
         "lotteryrules": "",
         "quickticket": "3",
         "buyticket": "1 2 3 4 5 6",
@@ -114,102 +193,346 @@ def get_example(command_name):
         "givepoints": "@User 100", 
         "mytickets": "",
         "resetvoicetracking": "@User",
+        "perf": "",
     }
     return examples.get(command_name, "")
 
+# Internally all voice/daily timestamps are epoch seconds (floats); they are
+# only turned into datetimes for display
+def to_eastern(ts):
+    """Epoch seconds -> Eastern datetime for display"""
+    return datetime.fromtimestamp(ts, EASTERN)
+
+def to_timestamp(value):
+    """Normalize a legacy ISO string or datetime to epoch seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+def guild_state():
+    """The current guild's partition (scalars like lottery_pot live on it directly)"""
+    return partitions.current()
+
+def scoped(key):
+    """Scheduler/lock key for an id within the current partition"""
+    return (partitions.current_key(), key)
+
+def partition_folder(key):
+    """Where a partition's files live: the classic top-level files, or guilds/<id>/
+
+    When partitioned, the keyless partition (DMs) gets guilds/direct/ so any
+    top-level files are unambiguously pre-partitioning data.
+    """
+    if not PARTITION_BY_GUILD:
+        return DATA_DIR
+    return os.path.join(DATA_DIR, 'guilds', 'direct' if key is None else str(key))
+
+def is_legacy_file(name):
+    return (name in ('data.json', 'data.wal', 'data.db', 'bet_archive.jsonl')
+            or name.startswith(('data.json.', 'data.db-')))
+
+def adopt_legacy_state():
+    """Move unpartitioned data files into LEGACY_GUILD_ID's partition folder
+
+    Runs before any store is opened. With partitioning on and top-level data
+    present, the data goes to the configured guild (only if that guild has
+    no data of its own yet); without LEGACY_GUILD_ID startup is refused, as
+    every guild would otherwise start from empty balances.
+    """
+    if not PARTITION_BY_GUILD:
+        return
+    legacy = sorted(name for name in os.listdir(DATA_DIR or '.') if is_legacy_file(name))
+    if not legacy:
+        return
+    if not LEGACY_GUILD_ID:
+        raise RuntimeError(
+            f"Unpartitioned data ({', '.join(legacy)}) exists but PARTITION_BY_GUILD is on; "
+            "set LEGACY_GUILD_ID to the guild that should keep it, or move the files away"
+        )
+    folder = partition_folder(int(LEGACY_GUILD_ID))
+    if os.path.isdir(folder) and any(is_legacy_file(name) for name in os.listdir(folder)):
+        raise RuntimeError(f"Guild {LEGACY_GUILD_ID} already has data in {folder}; not overwriting it with {', '.join(legacy)}")
+    os.makedirs(folder, exist_ok=True)
+    for name in legacy:
+        os.replace(os.path.join(DATA_DIR, name), os.path.join(folder, name))
+    logger.info(f"📦 Moved unpartitioned data ({', '.join(legacy)}) to guild {LEGACY_GUILD_ID}")
+
+def open_partition_store(key):
+    """Store and bet archive for a partition (see partition_folder)"""
+    folder = partition_folder(key)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    if STORAGE_BACKEND == 'sqlite':
+        partition_store = open_store('sqlite', db_path=os.path.join(folder, 'data.db'))
+    else:
+        partition_store = open_store('json', snapshot_path=os.path.join(folder, 'data.json'),
+                                     wal_path=os.path.join(folder, 'data.wal'),
+                                     generations=SNAPSHOT_GENERATIONS)
+    return partition_store, open_archive(partition_store, path=os.path.join(folder, 'bet_archive.jsonl'))
+
+def log_change(name, key):
+    """Record the current value of a keyed entry (or its removal) in the WAL"""
+    state = guild_state()
+    table = getattr(state, name)
+    if key in table:
+        state.store.record_set(name, key, table[key])
+    else:
+        state.store.record_delete(name, key)
+
+def log_value(name):
+    """Record the whole value of a state entry (scalars and cleared collections)"""
+    state = guild_state()
+    value = getattr(state, name)
+    # Copy so later in-place changes can't leak into the record before it is flushed
+    state.store.record_value(name, dict(value) if isinstance(value, defaultdict) else copy.copy(value))
+
+def log_append(name, item):
+    """Record an item appended to a list in the state"""
+    store.record_append(name, item)
+
+def balance_changed(user_id, balance):
+    """Ledger hook: keep the rank index and the WAL in step with each change"""
+    rankings.update(user_id, balance)
+    log_change('user_points', user_id)
+
+async def run_shared(fn, *args):
+    """Run a shared-service call in the executor, scoped to the current partition"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_executor, contextvars.copy_context().run, fn, *args)
+
+# All balance changes go through the ledger (user_points is rebound on load)
+# With STATE_SERVICE set the ledger charges balances atomically in the shared service,
+# off the event loop (commands use the ledger's *_async methods)
+ledger = Ledger(lambda: user_points, balance_changed,
+                shared=open_shared_balances(STATE_SERVICE, scope=partitions.current_key), run=run_shared)
+SHARED_BUSY_MESSAGE = "⏳ The points database is busy, please try again in a moment"
+
+def adopt_shared_balances(state):
+    """Take a partition's balances from the shared service, seeding it on first use"""
+    if ledger.shared is None:
+        return
+    seeded = ledger.shared.seed(state.user_points)
+    state.user_points = ledger.shared.load()
+    if seeded:
+        logger.info(f"🔗 Seeded {seeded} balances from {state} into the shared service")
+
+async def refresh_shared_balances():
+    """Pull other processes' balance changes for the current partition without blocking the loop"""
+    if ledger.shared is not None:
+        await ledger.refresh_async()
+
+def init_bet_pool(bet):
+    """Add per-option stake totals and bettor counts to a bet saved without them"""
+    if 'totals' not in bet:
+        bet['totals'] = {option: sum(bet['bets'][option].values()) for option in bet['options']}
+        bet['counts'] = {option: len(bet['bets'][option]) for option in bet['options']}
+    return bet
+
+def format_options(bet):
+    """Numbered option list, e.g. '1) Yes | 2) No'"""
+    return " | ".join(f"{i}) {option}" for i, option in enumerate(bet['options'], 1))
+
+def format_pool(bet, option):
+    """Stake total, bettor count and current parimutuel payout for one option"""
+    staked = bet['totals'][option]
+    if not staked:
+        return f"{option}: no bets yet"
+    pool = sum(bet['totals'].values())
+    return f"{option}: {staked} pts from {bet['counts'][option]} • pays x{pool / staked:.2f}"
+
+def snapshot_state(state):
+    """Copy a partition's persisted state so it can be serialized off the event loop"""
+    return {
+        'user_points': dict(state.user_points),
+        'active_bets': copy.deepcopy(state.active_bets),
+        'last_daily': dict(state.last_daily),
+        'last_message_time': dict(state.last_message_time),
+        'voice_time_tracking': dict(state.voice_time_tracking),
+        'voice_channel_points': dict(state.voice_channel_points),
+        'next_voice_payout': dict(state.next_voice_payout),
+        'lottery_pot': state.lottery_pot,
+        'lottery_history': state.lottery_history.copy(),
+        'lottery_winners': list(state.lottery_winners)
+    }
+
+def measured_write(kind, target, fn, *args):
+    """Run a blocking store write, recording its duration and bytes written"""
+    before = target.bytes_written
+    with save_seconds.time(kind):
+        result = fn(*args)
+    if target.bytes_written > before:
+        save_bytes.observe(target.bytes_written - before, kind)
+    return result
+
+def executor_backlog():
+    """Jobs queued on the save executors and not yet picked up by a thread"""
+    executors = {id(e): e for e in [_executor] + [s.store.executor for s in partitions.loaded()] if e is not None}
+    return sum(e._work_queue.qsize() for e in executors.values())
+
+_cpu_pool = None
+
+def cpu_pool():
+    """The worker pool, started on first use
+
+    Workers come from a forkserver (spawn where that's unavailable), never a
+    plain fork: this process runs executor, SQLite and watchdog threads, and
+    a forked child could inherit one of their locks held forever.
+    """
+    global _cpu_pool
+    if _cpu_pool is None:
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _cpu_pool
+
+async def run_cpu(fn, *args, size=None):
+    """Run a pure function in the process pool, or inline when the job is small
+
+    fn and its arguments must pickle (module-level functions over plain
+    columns), so workers never see the bot's live state. If the pool breaks
+    (a worker was killed) the job is retried once on a fresh pool; a second
+    failure is raised rather than run on the event loop.
+    """
+    global _cpu_pool
+    if CPU_WORKERS <= 0 or (size is not None and size < CPU_OFFLOAD_MIN_TICKETS):
+        return fn(*args)
+    loop = asyncio.get_event_loop()
+    try:
+        return await loop.run_in_executor(cpu_pool(), fn, *args)
+    except BrokenProcessPool:
+        logger.error(f"⚠️ CPU worker pool broke running {fn.__name__}, retrying on a fresh pool")
+        _cpu_pool = None
+    try:
+        return await loop.run_in_executor(cpu_pool(), fn, *args)
+    except BrokenProcessPool:
+        _cpu_pool = None
+        raise
+
 def save_data_sync():
-    """Synchronous version of save_data for thread safety"""
-    with _save_lock:
+    """Write a full snapshot and compact the WAL of every loaded partition"""
+    for state in partitions.loaded():
         try:
-            with open('data.json', 'w') as f:
-                json.dump({
-                    'user_points': user_points,
-                    'active_bets': active_bets,
-                    'last_daily': last_daily,
-                    'last_message_time': last_message_time,
-                    'voice_time_tracking': voice_time_tracking,
-                    'voice_channel_points': dict(voice_channel_points),
-                    'next_voice_payout': next_voice_payout,
-                    'lottery_pot': lottery_pot,
-                    'lottery_history': lottery_history,
-                    'lottery_winners': lottery_winners
-                }, f, indent=4)
+            measured_write('compact', state.store, state.store.compact,
+                           snapshot_state(state), state.store.begin_snapshot())
         except Exception as e:
-            logger.error(f"Error saving data: {e}")
+            logger.error(f"Error saving data for {state}: {e}")
 
-async def save_data_async():
-    """Non-blocking async save"""
+async def compact_data_async(state):
+    """Snapshot on the event loop, serialize in the executor"""
+    snapshot_seq = state.store.begin_snapshot()
+    snapshot = snapshot_state(state)
     loop = asyncio.get_event_loop()
     try:
-        await loop.run_in_executor(_executor, save_data_sync)
+        await loop.run_in_executor(state.store.executor or _executor, measured_write,
+                                   'compact', state.store, state.store.compact, snapshot, snapshot_seq)
     except Exception as e:
-        logger.error(f"Error in async save: {e}")
+        logger.error(f"Error compacting data for {state}: {e}")
+
+async def save_data_async():
+    """Non-blocking async save: append pending changes to each partition's WAL"""
+    loop = asyncio.get_event_loop()
+    for state in partitions.loaded():
+        if not state.store.pending:
+            continue
+        try:
+            await loop.run_in_executor(state.store.executor or _executor, measured_write,
+                                       'flush', state.store, state.store.flush)
+        except Exception as e:
+            logger.error(f"Error in async save for {state}: {e}")
+        if state.store.needs_compaction:
+            await compact_data_async(state)
+
+save_scheduler = SaveScheduler(save_data_async, SAVE_DEBOUNCE_SECONDS)
 
 def save_data():
     """Legacy sync save for compatibility"""
     save_data_sync()
 
-def load_data():
-    """Load all bot data with automatic legacy format migration"""
-    global user_points, active_bets, last_daily, last_message_time
-    global voice_time_tracking, voice_start_times, voice_channel_points
-    global next_voice_payout, lottery_pot, lottery_history, lottery_winners
+def load_partition(state):
+    """Load one partition's data with automatic legacy format migration"""
+    state.store, state.archive = open_partition_store(state.key)
+    state.rankings = RankIndex()
+    state.pending_message_points = defaultdict(int)
+    state.drawing = False  # Set while a lottery draw is being settled
 
     try:
-        with open('data.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-            # Load basic data
-            user_points = data.get('user_points', {})
-            active_bets = data.get('active_bets', {})
-            last_daily = data.get('last_daily', {})
-            last_message_time = data.get('last_message_time', {})
-            voice_start_times = data.get('voice_start_times', {})
-            voice_channel_points = defaultdict(int, data.get('voice_channel_points', {}))
-            next_voice_payout = data.get('next_voice_payout', {})
-            lottery_pot = data.get('lottery_pot', INITIAL_POT)
-            lottery_history = data.get('lottery_history', [])
-            lottery_winners = data.get('lottery_winners', [])
-
-            # Migrate voice_time_tracking to new format
-            voice_time_tracking = {}
-            legacy_data = data.get('voice_time_tracking', {})
-            
-            for user_id, time_data in legacy_data.items():
-                if isinstance(time_data, dict):
-                    voice_time_tracking[user_id] = time_data
-                else:
-                    voice_time_tracking[user_id] = {
-                        'total_time': float(time_data),
-                        'last_payout': datetime.now(EASTERN).isoformat()
-                    }
-            
-            logger.info(f"✅ Loaded data (migrated {len(legacy_data) - len(voice_time_tracking)} voice records)")
-
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Initialize fresh data if file doesn't exist or is corrupted
-        user_points = {}
-        active_bets = {}
-        last_daily = {}
-        last_message_time = {}
-        voice_time_tracking = {}
-        voice_start_times = {}
-        voice_channel_points = defaultdict(int)
-        next_voice_payout = {}
-        lottery_pot = INITIAL_POT
-        lottery_history = []
-        lottery_winners = []
-        save_data()
-        logger.info("🆕 Created new data file")
+        data = state.store.load()
+
+        # Load basic data
+        state.user_points = data.get('user_points', {})
+        state.active_bets = data.get('active_bets', {})
+        state.voice_channel_points = defaultdict(int, data.get('voice_channel_points', {}))
+        state.lottery_pot = data.get('lottery_pot', INITIAL_POT)
+        state.lottery_history = TicketStore.from_json(data.get('lottery_history', []))
+        state.lottery_winners = data.get('lottery_winners', [])
+        for bet in state.active_bets.values():
+            init_bet_pool(bet)
+        
+        # Move bets finished before the archive existed out of the hot state
+        for bet_id in [b for b, bet in state.active_bets.items() if bet.get('resolved')]:
+            bet = state.active_bets.pop(bet_id)
+            bet.setdefault('status', 'resolved')
+            state.archive.append(bet_id, bet)
+            log_change('active_bets', bet_id)
+
+        # Migrate voice_time_tracking to new format
+        state.voice_time_tracking, migrated = migrate_voice_tracking(
+            data.get('voice_time_tracking', {}),
+            epoch_time()
+        )
+        
+        # Migrate ISO timestamp strings to epoch seconds
+        state.voice_start_times = {k: to_timestamp(v) for k, v in data.get('voice_start_times', {}).items()}
+        state.next_voice_payout = {k: to_timestamp(v) for k, v in data.get('next_voice_payout', {}).items()}
+        state.last_daily = {k: to_timestamp(v) for k, v in data.get('last_daily', {}).items()}
+        state.last_message_time = {k: to_timestamp(v) for k, v in data.get('last_message_time', {}).items()}
+        for record in state.voice_time_tracking.values():
+            if isinstance(record, dict) and 'last_payout' in record:
+                record['last_payout'] = to_timestamp(record['last_payout'])
+        
+        adopt_shared_balances(state)
+        state.rankings.rebuild(state.user_points)
+        schedule_bet_deadlines()
+        logger.info(f"✅ Loaded data for {state} (migrated {migrated} voice records)")
+
+    except FileNotFoundError:
+        # Initialize fresh data only if there is no saved state at all;
+        # corrupt snapshots raise below instead of wiping every balance
+        state.user_points = {}
+        state.active_bets = {}
+        state.last_daily = {}
+        state.last_message_time = {}
+        state.voice_time_tracking = {}
+        state.voice_start_times = {}
+        state.voice_channel_points = defaultdict(int)
+        state.next_voice_payout = {}
+        state.lottery_pot = INITIAL_POT
+        state.lottery_history = TicketStore()
+        state.lottery_winners = []
+        adopt_shared_balances(state)
+        state.rankings.rebuild(state.user_points)
+        state.store.compact(snapshot_state(state), state.store.begin_snapshot())
+        logger.info(f"🆕 Created new data file for {state}")
         
     except Exception as e:
-        logger.error(f"❌ Error loading data: {e}")
+        logger.error(f"❌ Error loading data for {state}: {e}")
         raise
 
-def ensure_user(user_id):
+partitions.loader = load_partition
+
+def load_data():
+    """Load the unpartitioned state; guild partitions load on first use"""
+    partitions.clear()
+    voice_payouts.clear()
+    bet_deadlines.clear()
+    adopt_legacy_state()
+    partitions.get(None)
+
+async def ensure_user(user_id):
     if str(user_id) not in user_points:
-        user_points[str(user_id)] = 100
-        asyncio.create_task(save_data_async())
+        await ledger.open_account_async(str(user_id), 100)
+        save_scheduler.request()
     return user_points[str(user_id)]
 
 def is_admin(member):
@@ -237,8 +560,24 @@ def owner_required():
         return True
     return commands.check(predicate)
 
-class RobustBot(commands.Bot):
+def for_each_partition(fn):
+    """Run fn() once with each loaded partition selected"""
+    for state in partitions.loaded():
+        with partitions.use(state.key):
+            fn()
+
+async def for_each_partition_async(fn):
+    """Await fn() once with each loaded partition selected"""
+    for state in partitions.loaded():
+        with partitions.use(state.key):
+            await fn()
+
+class RobustBot(commands.AutoShardedBot if SHARDED else commands.Bot):
     def __init__(self, *args, **kwargs):
+        if SHARD_COUNT is not None:
+            kwargs.setdefault('shard_count', SHARD_COUNT)
+        if SHARD_IDS is not None:
+            kwargs.setdefault('shard_ids', SHARD_IDS)
         super().__init__(*args, **kwargs)
         self._shutdown_lock = asyncio.Lock()
         self._tasks_initialized = False
@@ -246,74 +585,104 @@ class RobustBot(commands.Bot):
 
     def _init_tasks(self):
         """Initialize all background tasks with enhanced reliability"""
-        @tasks.loop(seconds=600)
-        async def voice_points_update():
-            try:
-                logger.debug(f"🔍 Voice check running (Next: {self.voice_points_update.next_iteration})")
-                await check_voice_time()
-            except Exception as e:
-                logger.error(f"Voice check crashed: {e}")
-                await asyncio.sleep(10)
-                self.voice_points_update.restart()
-
         @tasks.loop(time=time(DAILY_RESET_HOUR, DAILY_RESET_MINUTE, tzinfo=EASTERN))
         async def daily_reset():
-            try:
-                global last_daily
+            def reset():
                 last_daily.clear()
-                await save_data_async()
+                log_value('last_daily')
+            try:
+                for_each_partition(reset)
+                save_scheduler.request()
                 logger.info("🔄 Daily rewards reset")
             except Exception as e:
                 logger.error(f"Daily reset failed: {e}")
 
         @tasks.loop(time=time(0, 0, tzinfo=EASTERN))
         async def voice_scaling_reset():
-            try:
-                global voice_time_tracking
+            def reset():
                 voice_time_tracking.clear()
+                log_value('voice_time_tracking')
+            try:
+                for_each_partition(reset)
                 logger.info("♻️ Voice scaling reset")
             except Exception as e:
                 logger.error(f"Scaling reset failed: {e}")
 
         @tasks.loop(time=time(0, 0, tzinfo=EASTERN))
         async def daily_jackpot_increase():
+            def increase():
+                guild_state().lottery_pot += DAILY_JACKPOT_INCREASE
+                log_value('lottery_pot')
             try:
-                global lottery_pot
-                lottery_pot += DAILY_JACKPOT_INCREASE
-                await save_data_async()
-                logger.info(f"🎯 Jackpot increased by {DAILY_JACKPOT_INCREASE} to {lottery_pot}")
+                for_each_partition(increase)
+                save_scheduler.request()
+                logger.info(f"🎯 Jackpot increased by {DAILY_JACKPOT_INCREASE} in {len(partitions)} partition(s)")
             except Exception as e:
                 logger.error(f"Daily jackpot increase failed: {e}")
 
-        self.voice_points_update = voice_points_update
+        @tasks.loop(minutes=10)
+        async def snapshot_compaction():
+            try:
+                for state in partitions.loaded():
+                    if state.store.wal_records or state.store.needs_compaction:
+                        await compact_data_async(state)
+            except Exception as e:
+                logger.error(f"Snapshot compaction failed: {e}")
+
+        @tasks.loop(seconds=MESSAGE_FLUSH_INTERVAL)
+        async def message_points_flush():
+            try:
+                await for_each_partition_async(flush_message_points)
+            except Exception as e:
+                logger.error(f"Message points flush failed: {e}")
+
+        @tasks.loop(seconds=SHARED_REFRESH_SECONDS)
+        async def shared_balance_refresh():
+            try:
+                for state in partitions.loaded():
+                    with partitions.use(state.key):
+                        await refresh_shared_balances()
+            except Exception as e:
+                logger.error(f"Shared balance refresh failed: {e}")
+
         self.daily_reset = daily_reset
         self.voice_scaling_reset = voice_scaling_reset
         self.daily_jackpot_increase = daily_jackpot_increase
-
-        # Error handlers
-        @self.voice_points_update.error
-        async def voice_error(error):
-            logger.error(f"Voice task error: {error}")
-            await asyncio.sleep(10)
-            self.voice_points_update.restart()
+        self.snapshot_compaction = snapshot_compaction
+        self.message_points_flush = message_points_flush
+        self.shared_balance_refresh = shared_balance_refresh
 
         self._tasks_initialized = True
         logger.info("✅ Background tasks initialized")
 
     async def on_ready(self):
         """Handle startup with data migration and task verification"""
-        # 1. Data migration
+        # Watch from the start so slow startup work is caught too
+        if LOOP_WATCHDOG and not watchdog.is_running():
+            watchdog.start()
+            logger.info(f"▶️ Loop watchdog started ({LOOP_WATCHDOG_THRESHOLD * 1000:.0f}ms threshold)")
+        
+        # 1. Load each served guild's partition, then data migration
+        for guild in self.guilds:
+            partitions.get(partitions.key_for(guild.id))
         await self._migrate_voice_data()
         
         # 2. Start tasks only after bot is ready
-        if not self.voice_points_update.is_running():
+        if not voice_payouts.is_running():
+            voice_payouts.start()
+            logger.info("▶️ Voice payout scheduler started")
+        if not bet_deadlines.is_running():
+            bet_deadlines.start()
+            logger.info("▶️ Bet expiry scheduler started")
+        if not loop_probe.is_running():
+            loop_probe.start()
+        if METRICS_PORT and getattr(self, '_metrics_runner', None) is None:
             try:
-                self.voice_points_update.start()
-                logger.info("▶️ Voice points task started")
-            except RuntimeError as e:
-                logger.error(f"Failed to start voice task: {e}")
-                await asyncio.sleep(5)
-                self.voice_points_update.start()
+                self._metrics_runner = await serve_prometheus(metrics, METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                logger.error(f"Failed to start metrics endpoint: {e}")
+        # Seed timers for members who were already in voice before we connected
+        await check_voice_time()
 
         if not self.daily_reset.is_running():
             try:
@@ -336,21 +705,46 @@ class RobustBot(commands.Bot):
             except RuntimeError as e:
                 logger.error(f"Failed to start jackpot increase task: {e}")
 
+        if not self.snapshot_compaction.is_running():
+            try:
+                self.snapshot_compaction.start()
+                logger.info("▶️ Snapshot compaction task started")
+            except RuntimeError as e:
+                logger.error(f"Failed to start snapshot compaction task: {e}")
+
+        if ledger.shared is not None and not self.shared_balance_refresh.is_running():
+            try:
+                self.shared_balance_refresh.start()
+                logger.info("▶️ Shared balance refresh task started")
+            except RuntimeError as e:
+                logger.error(f"Failed to start shared balance refresh task: {e}")
+
+        if not self.message_points_flush.is_running():
+            try:
+                self.message_points_flush.start()
+                logger.info("▶️ Message points flush task started")
+            except RuntimeError as e:
+                logger.error(f"Failed to start message points flush task: {e}")
+
         # 3. Debug info
-        logger.info(f"🔧 Voice task status: {self.voice_points_update.is_running()}")
-        if self.voice_points_update.is_running():
-            logger.info(f"⏱ Next voice check: {self.voice_points_update.next_iteration}")
+        logger.info(f"🔧 Voice scheduler status: {voice_payouts.is_running()} ({len(voice_payouts)} timers)")
+        if voice_payouts.next_due() is not None:
+            logger.info(f"⏱ Next voice payout: {datetime.fromtimestamp(voice_payouts.next_due(), EASTERN)}")
 
     async def _migrate_voice_data(self):
         """Convert legacy voice tracking format"""
         migration_count = 0
-        for user_id in list(voice_time_tracking.keys()):
-            if not isinstance(voice_time_tracking[user_id], dict):
-                voice_time_tracking[user_id] = {
-                    'total_time': float(voice_time_tracking[user_id]),
-                    'last_payout': datetime.now(EASTERN).isoformat()
-                }
-                migration_count += 1
+        def migrate():
+            nonlocal migration_count
+            for user_id in list(voice_time_tracking.keys()):
+                if not isinstance(voice_time_tracking[user_id], dict):
+                    voice_time_tracking[user_id] = {
+                        'total_time': float(voice_time_tracking[user_id]),
+                        'last_payout': epoch_time()
+                    }
+                    log_change('voice_time_tracking', user_id)
+                    migration_count += 1
+        for_each_partition(migrate)
         
         if migration_count > 0:
             save_data_sync()
@@ -364,27 +758,45 @@ class RobustBot(commands.Bot):
         # Cancel tasks
             tasks = [
                 t for t in [
-                    getattr(self, 'voice_points_update', None),
                     getattr(self, 'daily_reset', None),
                     getattr(self, 'voice_scaling_reset', None),
-                    getattr(self, 'daily_jackpot_increase', None)  # ADD THIS LINE
+                    getattr(self, 'daily_jackpot_increase', None),  # ADD THIS LINE
+                    getattr(self, 'snapshot_compaction', None),
+                    getattr(self, 'message_points_flush', None),
+                    getattr(self, 'shared_balance_refresh', None)
                 ] if t is not None and t.is_running()
             ]
         
         for task in tasks:
             task.cancel()
+        voice_payouts.stop()
+        bet_deadlines.stop()
+        loop_probe.stop()
+        watchdog.stop()
+        if getattr(self, '_metrics_runner', None) is not None:
+            await self._metrics_runner.cleanup()
         
         # Close client session if exists
         if hasattr(self, 'session') and isinstance(self.session, aiohttp.ClientSession):
             await self.session.close()
         
         # Final save
+        try:
+            await for_each_partition_async(flush_message_points)
+        except SharedStateBusy as e:
+            logger.error(f"Message points not credited before shutdown: {e}")
+        await save_scheduler.flush_now()
         save_data_sync()
+        if ledger.shared is not None:
+            ledger.shared.close()
+        if _cpu_pool is not None:
+            _cpu_pool.shutdown(cancel_futures=True)
+        logger.info(f"💾 Saves requested: {save_scheduler.requested}, performed: {save_scheduler.performed}")
         logger.info("✅ Shutdown completed")
 
     async def force_voice_check(self):
         """Manual voice check trigger"""
-        if self.voice_points_update.is_running():
+        if voice_payouts.is_running():
             await check_voice_time()
             return True
         return False
@@ -423,7 +835,7 @@ class CustomHelpCommand(commands.HelpCommand):
         betting_commands = [
             f"`{cmd.name}` - {cmd.help.split(']')[-1].strip() if ']' in cmd.help else cmd.help}"
             for cmd in ctx.bot.commands 
-            if cmd.name in ['createbet', 'placebet', 'activebets']
+            if cmd.name in ['createbet', 'placebet', 'activebets', 'betarchive']
             and not cmd.hidden
         ]
         embed.add_field(
@@ -463,7 +875,7 @@ class CustomHelpCommand(commands.HelpCommand):
         owner_commands = [
             f"`{cmd.name}` - {cmd.help.split(']')[-1].strip() if ']' in cmd.help else cmd.help}"
             for cmd in ctx.bot.commands 
-            if cmd.name in ['givepoints']
+            if cmd.name in ['givepoints', 'perf']
             and not cmd.hidden
         ]
         if owner_commands:
@@ -511,44 +923,218 @@ bot = RobustBot(
     help_command=CustomHelpCommand()
 )
 
-async def check_voice_time():
-    now = datetime.now(EASTERN)
-    logger.info(f"⏰ Voice check at {now.strftime('%H:%M:%S')}")
+# Cached user lookups (gateway cache -> TTL cache -> batched fetch_user)
+names = NameResolver(bot)
+
+@bot.before_invoke
+async def select_partition(ctx):
+    """Scope the command to its guild's state (DMs use the unpartitioned state)"""
+    partitions.activate(ctx.guild.id if ctx.guild else None)
+    watchdog.label(asyncio.current_task(), ctx.command.qualified_name)
+    ctx.perf_started = perf_counter()
+
+@bot.after_invoke
+async def record_command_latency(ctx):
+    """Runs after every command, including ones that raised"""
+    watchdog.unlabel(asyncio.current_task())
+    started = getattr(ctx, 'perf_started', None)
+    if started is not None:
+        command_seconds.observe(perf_counter() - started, ctx.command.qualified_name)
+
+# Samples loop lag (and the save executor backlog) twice a second
+loop_probe = LoopLagProbe(loop_lag_seconds, LOOP_LAG_INTERVAL,
+                          on_tick=lambda: executor_queue_depth.observe(executor_backlog()))
+def report_stall(stall):
+    """Called from the watchdog thread for every loop stall"""
+    loop_stall_seconds.observe(stall.duration, stall.label)
+    if stall.new:
+        logger.warning(f"🐢 Event loop blocked {stall.duration * 1000:.0f}ms by {stall.label}:\n{stall.stack}")
+    else:
+        logger.warning(f"🐢 Event loop blocked {stall.duration * 1000:.0f}ms by {stall.label} (same stack as before)")
+
+# Watches the loop from a thread when LOOP_WATCHDOG=1 (commands label their task above)
+watchdog = LoopWatchdog(threshold=LOOP_WATCHDOG_THRESHOLD, on_stall=report_stall)
+metrics.gauge('executor_backlog', 'Jobs waiting for a save executor thread', executor_backlog)
+metrics.gauge('partitions_loaded', 'Guild state partitions in memory', lambda: len(partitions))
+
+async def voice_payout_due(key):
+    """Pay a user whose voice payout timer has fired and re-arm the timer"""
+    guild_key, user_id = key
+    with partitions.use(guild_key):
+        await pay_voice_interval(user_id)
+
+async def pay_voice_interval(user_id):
+    # Leave/deafen events cancel the timer; this guards against races with them
+    if user_id not in voice_start_times:
+        return
+    
+    now = epoch_time()
+    points = BASE_VOICE_POINTS
+    # Re-arm first so a failed credit only skips this interval, not every later one
+    next_payout = now + VOICE_INTERVAL
+    next_voice_payout[user_id] = next_payout
+    voice_start_times[user_id] = now
+    voice_payouts.schedule(scoped(user_id), next_payout)
+    log_change('next_voice_payout', user_id)
+    save_scheduler.request()
+    
+    try:
+        await ensure_user(user_id)
+        await ledger.credit_async(user_id, points)
+    except SharedStateBusy as e:
+        logger.error(f"Voice points for {user_id} not awarded this interval: {e}")
+        return
+    voice_channel_points[user_id] += points
+    log_change('voice_channel_points', user_id)
+    save_scheduler.request()
+    
+    logger.info(f"💰 Awarded {points} to user {user_id}. Next: {to_eastern(next_payout)}")
+
+# Payouts fire from a deadline heap fed by voice state events
+voice_payouts = DeadlineScheduler(voice_payout_due, name='voice payouts')
+
+@bot.listen('on_message')
+async def reward_message(message):
+    """Chat activity reward: O(1) cooldown check, points credited in batches"""
+    if message.author.bot or message.guild is None:
+        return
+    if message.content.startswith(bot.command_prefix):
+        return
+    # Hot path: use the partition's dicts directly instead of the proxies
+    state = partitions.activate(message.guild.id)
+    
+    user_id = str(message.author.id)
+    now = epoch_time()
+    last = state.last_message_time.get(user_id)
+    if last is not None and now - last < MESSAGE_COOLDOWN:
+        return
+    state.last_message_time[user_id] = now
+    state.pending_message_points[user_id] += MESSAGE_POINTS
+
+async def flush_message_points():
+    """Credit accumulated message points in one ledger batch and one save request"""
+    if not pending_message_points:
+        return 0
+    batch = dict(pending_message_points)
+    pending_message_points.clear()
+    
+    try:
+        for user_id in batch:
+            await ensure_user(user_id)
+        await ledger.credit_many_async(batch.items())
+    except SharedStateBusy:
+        # Keep the points for the next flush
+        for user_id, points in batch.items():
+            pending_message_points[user_id] += points
+        raise
+    for user_id in batch:
+        log_change('last_message_time', user_id)
+    save_scheduler.request()
+    logger.debug(f"💬 Credited message points to {len(batch)} users")
+    return len(batch)
+
+async def bet_closed(key):
+    """Betting window is over: ping the creator to resolve the bet"""
+    guild_key, bet_id = key
+    with partitions.use(guild_key):
+        await notify_bet_closed(bet_id)
+
+async def notify_bet_closed(bet_id):
+    bet = active_bets.get(bet_id)
+    if bet is None or bet.get('notified'):
+        return
+    bet['notified'] = True
+    log_change('active_bets', bet_id)
+    save_scheduler.request()
+    
+    channel = bot.get_channel(bet['channel']) if bet.get('channel') else None
+    if channel is None:
+        logger.info(f"⏰ Bet {bet_id} closed (no channel to notify)")
+        return
+    await channel.send(
+        f"⏰ Betting on **{bet['name']}** (`{bet_id}`) has closed. "
+        f"<@{bet['creator']}>, resolve it with `{bot.command_prefix}resolvebet {bet_id} <1-{len(bet['options'])}>`"
+    )
+    logger.info(f"⏰ Bet {bet_id} closed, creator notified")
+
+# One timer per live bet, fires at its end_time
+bet_deadlines = DeadlineScheduler(bet_closed, name='bet expiry')
+
+def schedule_bet_deadlines():
+    """Arm the expiry timer of every live bet (in this partition) whose creator hasn't been pinged"""
+    for bet_id, bet in active_bets.items():
+        if not bet.get('notified'):
+            bet_deadlines.schedule(scoped(bet_id), to_timestamp(bet['end_time']))
+
+def bet_is_open(bet_id):
+    """Whether a bet still takes stakes (its expiry timer hasn't passed)"""
+    deadline = bet_deadlines.deadline(scoped(bet_id))
+    return deadline is not None and deadline > epoch_time()
+
+async def archive_bet(bet_id, status):
+    """Move a finished bet out of active_bets into the cold archive
+
+    The bet leaves active_bets only once the archive holds it. If the append
+    fails it stays there marked finished, and load_partition archives it
+    again on the next start.
+    """
+    bet = active_bets[bet_id]
+    bet_deadlines.cancel(scoped(bet_id))
+    bet['status'] = status
+    bet['closed_at'] = epoch_time()
+    # Persist the finished state first so a crash mid-append can't pay out twice
+    log_change('active_bets', bet_id)
+    save_scheduler.request()
     
-    for guild in bot.guilds:
-        for voice_channel in guild.voice_channels:
-            # Skip AFK channels
-            if "afk" in voice_channel.name.lower():
+    loop = asyncio.get_event_loop()
+    try:
+        await loop.run_in_executor(archive.executor or _executor, archive.append, bet_id, bet)
+    except Exception as e:
+        logger.error(f"Error archiving bet {bet_id}, keeping it in active bets: {e}")
+        return
+    active_bets.pop(bet_id, None)
+    log_change('active_bets', bet_id)
+    save_scheduler.request()
+
+async def check_voice_time():
+    """Reconcile payout timers with who is actually in voice
+
+    Runs once on startup (members already in voice never sent a join event)
+    and via $debugvoice. Regular payouts are fired by voice_payouts.
+    """
+    now = epoch_time()
+    logger.info(f"⏰ Voice check at {to_eastern(now).strftime('%H:%M:%S')}")
+    
+    with voice_check_seconds.time():
+        for guild in bot.guilds:
+            with partitions.use(partitions.key_for(guild.id)):
+                reconcile_guild_voice(guild, now)
+    
+    save_scheduler.request()
+
+def reconcile_guild_voice(guild, now):
+    """Start payout timers for the members of one guild who are in voice"""
+    for voice_channel in guild.voice_channels:
+        # Skip AFK channels
+        if "afk" in voice_channel.name.lower():
+            continue
+            
+        for member in voice_channel.members:
+            # Skip bots and deafened members (they aren't tracked)
+            if member.bot or (member.voice and member.voice.self_deaf):
                 continue
                 
-            for member in voice_channel.members:
-                # Skip bots
-                if member.bot:
-                    continue
-                    
-                user_id = str(member.id)
-                
-                if user_id not in next_voice_payout:
-                    next_payout = now + timedelta(seconds=VOICE_INTERVAL)
-                    next_voice_payout[user_id] = next_payout.isoformat()
-                    logger.info(f"⏱ Initialized payout for {member.display_name} at {next_payout}")
-                    continue
+            user_id = str(member.id)
+            voice_start_times.setdefault(user_id, now)
+            
+            if user_id not in next_voice_payout:
+                next_payout = now + VOICE_INTERVAL
+                next_voice_payout[user_id] = next_payout
+                log_change('next_voice_payout', user_id)
+                logger.info(f"⏱ Initialized payout for {member.display_name} at {to_eastern(next_payout)}")
 
-                payout_time = datetime.fromisoformat(next_voice_payout[user_id]).astimezone(EASTERN)
-                
-                if now >= payout_time:
-                    points = BASE_VOICE_POINTS
-                    ensure_user(user_id)
-                    user_points[user_id] += points
-                    voice_channel_points[user_id] += points
-                    
-                    next_payout = now + timedelta(seconds=VOICE_INTERVAL)
-                    next_voice_payout[user_id] = next_payout.isoformat()
-                    voice_start_times[user_id] = now
-                    
-                    logger.info(f"💰 Awarded {points} to {member.display_name}. Next: {next_payout}")
-    
-    await save_data_async()
+            # Overdue timers fire immediately
+            voice_payouts.schedule(scoped(user_id), next_voice_payout[user_id])
 
 async def handle_voice_state_change(member, before, after):
     """Updated voice state handler with bot and AFK channel checks"""
@@ -556,8 +1142,9 @@ async def handle_voice_state_change(member, before, after):
     if member.bot:
         return
 
+    partitions.activate(member.guild.id)
     user_id = str(member.id)
-    now = datetime.now(EASTERN)
+    now = epoch_time()
     
     try:
         # Debug logging
@@ -578,15 +1165,15 @@ async def handle_voice_state_change(member, before, after):
                 
             # Initialize or update tracking
             voice_start_times[user_id] = now
-            next_payout = now + timedelta(seconds=VOICE_INTERVAL)
-            next_voice_payout[user_id] = next_payout.isoformat()
+            next_payout = now + VOICE_INTERVAL
+            next_voice_payout[user_id] = next_payout
             
-            logger.info(f"🟢 {member.display_name} joined voice. Next payout at {next_payout}")
+            logger.info(f"🟢 {member.display_name} joined voice. Next payout at {to_eastern(next_payout)}")
             
             # Check if they're eligible for immediate payout
             if user_id in voice_time_tracking:
-                last_active = datetime.fromisoformat(voice_time_tracking[user_id]['last_payout']).astimezone(EASTERN)
-                if (now - last_active).total_seconds() >= VOICE_INTERVAL:
+                last_active = voice_time_tracking[user_id]['last_payout']
+                if now - last_active >= VOICE_INTERVAL:
                     await award_voice_points(user_id, now)
         
         # Case 2: User left or was disconnected
@@ -598,10 +1185,10 @@ async def handle_voice_state_change(member, before, after):
                 
             if user_id in voice_start_times:
                 # Calculate time spent and store
-                time_spent = (now - voice_start_times[user_id]).total_seconds()
+                time_spent = now - voice_start_times[user_id]
                 voice_time_tracking[user_id] = {
                     'total_time': voice_time_tracking.get(user_id, {}).get('total_time', 0) + time_spent,
-                    'last_payout': now.isoformat()
+                    'last_payout': now
                 }
                 del voice_start_times[user_id]
                 logger.info(f"🔴 {member.display_name} left after {time_spent:.1f}s")
@@ -609,6 +1196,8 @@ async def handle_voice_state_change(member, before, after):
                 # Award final points if they met the interval
                 if time_spent >= VOICE_INTERVAL:
                     await award_voice_points(user_id, now)
+                    # award_voice_points restarts the session; they have left
+                    voice_start_times.pop(user_id, None)
         
         # Case 3: User moved between channels
         elif before.channel and after.channel and before.channel != after.channel:
@@ -617,10 +1206,10 @@ async def handle_voice_state_change(member, before, after):
                 logger.info(f"⏭️ {member.display_name} moved to AFK channel, stopping tracking")
                 if user_id in voice_start_times:
                     # Track time in previous channel before stopping
-                    time_spent = (now - voice_start_times[user_id]).total_seconds()
+                    time_spent = now - voice_start_times[user_id]
                     voice_time_tracking[user_id] = {
                         'total_time': voice_time_tracking.get(user_id, {}).get('total_time', 0) + time_spent,
-                        'last_payout': now.isoformat()
+                        'last_payout': now
                     }
                     del voice_start_times[user_id]
                 return
@@ -629,21 +1218,21 @@ async def handle_voice_state_change(member, before, after):
             if is_afk_channel(before.channel):
                 logger.info(f"⏭️ {member.display_name} moved from AFK channel, starting fresh tracking")
                 voice_start_times[user_id] = now
-                next_voice_payout[user_id] = (now + timedelta(seconds=VOICE_INTERVAL)).isoformat()
+                next_voice_payout[user_id] = now + VOICE_INTERVAL
                 return
                 
             if user_id in voice_start_times:
                 # Track time in previous channel
-                time_spent = (now - voice_start_times[user_id]).total_seconds()
+                time_spent = now - voice_start_times[user_id]
                 voice_time_tracking[user_id] = {
                     'total_time': voice_time_tracking.get(user_id, {}).get('total_time', 0) + time_spent,
-                    'last_payout': now.isoformat()
+                    'last_payout': now
                 }
                 logger.info(f"🔀 {member.display_name} moved after {time_spent:.1f}s")
             
             # Reset timer for new channel
             voice_start_times[user_id] = now
-            next_voice_payout[user_id] = (now + timedelta(seconds=VOICE_INTERVAL)).isoformat()
+            next_voice_payout[user_id] = now + VOICE_INTERVAL
         
         # Case 4: User deafened/undeafened
         elif before.self_deaf != after.self_deaf:
@@ -654,16 +1243,16 @@ async def handle_voice_state_change(member, before, after):
                 
             if after.self_deaf:  # User deafened
                 if user_id in voice_start_times:
-                    time_spent = (now - voice_start_times[user_id]).total_seconds()
+                    time_spent = now - voice_start_times[user_id]
                     voice_time_tracking[user_id] = {
                         'total_time': voice_time_tracking.get(user_id, {}).get('total_time', 0) + time_spent,
-                        'last_payout': now.isoformat()
+                        'last_payout': now
                     }
                     del voice_start_times[user_id]
                     logger.info(f"🔇 {member.display_name} deafened after {time_spent:.1f}s")
             else:  # User undeafened
                 voice_start_times[user_id] = now
-                next_voice_payout[user_id] = (now + timedelta(seconds=VOICE_INTERVAL)).isoformat()
+                next_voice_payout[user_id] = now + VOICE_INTERVAL
                 logger.info(f"🔊 {member.display_name} undeafened")
     
     except Exception as e:
@@ -672,16 +1261,31 @@ async def handle_voice_state_change(member, before, after):
         voice_start_times.pop(user_id, None)
         next_voice_payout.pop(user_id, None)
     
-    await save_data_async()
+    finally:
+        # Keep the payout timer in step with whether the user is being tracked
+        if user_id in voice_start_times and user_id in next_voice_payout:
+            voice_payouts.schedule(scoped(user_id), next_voice_payout[user_id])
+        else:
+            voice_payouts.cancel(scoped(user_id))
+        
+        log_change('voice_time_tracking', user_id)
+        log_change('next_voice_payout', user_id)
+        save_scheduler.request()
                                 
 @bot.event
 async def on_voice_state_update(member, before, after):
     # Immediate return to prevent heartbeat blocking
     asyncio.create_task(handle_voice_state_change(member, before, after))
 
+async def refund(user_id, amount):
+    """Give back a charge whose purchase couldn't go ahead"""
+    try:
+        await ledger.credit_async(user_id, amount)
+    except SharedStateBusy as e:
+        logger.error(f"❌ Refund of {amount} points to {user_id} failed: {e}")
+
 async def award_voice_points(user_id, timestamp):
     """Helper function to award points immediately"""
-    ensure_user(user_id)
     points = BASE_VOICE_POINTS
     
     # Apply scaling if enabled
@@ -690,25 +1294,32 @@ async def award_voice_points(user_id, timestamp):
         points = max(MIN_VOICE_POINTS, BASE_VOICE_POINTS - (VOICE_SCALE_DOWN * int(total_hours)))
     
     # Award points
-    user_points[user_id] += points
+    try:
+        await ensure_user(user_id)
+        await ledger.credit_async(user_id, points)
+    except SharedStateBusy as e:
+        logger.error(f"Voice points for {user_id} not awarded: {e}")
+        return
     voice_channel_points[user_id] += points
     
     # Update tracking
     voice_start_times[user_id] = timestamp
-    next_voice_payout[user_id] = (timestamp + timedelta(seconds=VOICE_INTERVAL)).isoformat()
+    next_voice_payout[user_id] = timestamp + VOICE_INTERVAL
+    log_change('voice_channel_points', user_id)
+    log_change('next_voice_payout', user_id)
     
-    # Log the transaction
-    try:
-        user = await bot.fetch_user(int(user_id))
+    # Log the transaction (cache only, a log line isn't worth a REST call)
+    user = names.cached(user_id)
+    if user is not None:
         logger.info(f"💰 Awarded {points} points to {user.display_name}")
-    except:
+    else:
         logger.info(f"💰 Awarded {points} points to user {user_id}")
         
 @bot.command(name='voicestatus', help='💰 Check your voice points status and next payout time')
 async def voice_status(ctx):
     user_id = str(ctx.author.id)
     points = voice_channel_points.get(user_id, 0)
-    now = datetime.now(EASTERN)
+    now = epoch_time()
     
     status_msg = "🔴 Not currently in a voice channel"
     current_rate = BASE_VOICE_POINTS
@@ -716,11 +1327,10 @@ async def voice_status(ctx):
     
     if user_id in voice_start_times:
         start_time = voice_start_times[user_id]
-        elapsed = (now - start_time).total_seconds()
+        elapsed = now - start_time
         
         if user_id in next_voice_payout:
-            payout_time = datetime.fromisoformat(next_voice_payout[user_id]).astimezone(EASTERN)
-            time_left = max(0, (payout_time - now).total_seconds())
+            time_left = max(0, next_voice_payout[user_id] - now)
             minutes = int(time_left // 60)
             seconds = int(time_left % 60)
             time_left_msg = f"{minutes}m {seconds}s"
@@ -744,7 +1354,7 @@ async def voice_status(ctx):
     )
     embed.add_field(
         name="Debug Info",
-        value=f"Tracking: {len(voice_start_times)} users\nNext check: {now + timedelta(minutes=1)}",
+        value=f"Tracking: {len(voice_start_times)} users\nNext check: {to_eastern(now) + timedelta(minutes=1)}",
         inline=False
     )
     
@@ -762,8 +1372,11 @@ async def reset_voice_tracking(ctx, user: discord.Member):
         del voice_start_times[user_id]
     if user_id in next_voice_payout:
         del next_voice_payout[user_id]
+    voice_payouts.cancel(scoped(user_id))
     voice_time_tracking[user_id] = 0
-    await save_data_async()
+    log_change('next_voice_payout', user_id)
+    log_change('voice_time_tracking', user_id)
+    save_scheduler.request()
     await ctx.send(f"✅ Voice tracking reset for {user.mention}")
 
 # Points System Commands
@@ -772,7 +1385,10 @@ async def reset_voice_tracking(ctx, user: discord.Member):
     help='💰 Check your points balance'
 )
 async def check_points(ctx):
-    points = ensure_user(ctx.author.id)
+    try:
+        points = await ensure_user(ctx.author.id)
+    except SharedStateBusy:
+        return await ctx.send(SHARED_BUSY_MESSAGE)
     await ctx.send(f'{ctx.author.mention}, you have {points} points.')
 
 @bot.command(
@@ -781,19 +1397,29 @@ async def check_points(ctx):
 )
 async def daily_points(ctx):
     user_id = str(ctx.author.id)
-    now = datetime.now(EASTERN)
+    now = epoch_time()
     
     if user_id in last_daily:
-        last_claim_date = datetime.fromisoformat(last_daily[user_id]).astimezone(EASTERN).date()
-        if now.date() == last_claim_date:
+        last_claim_date = to_eastern(last_daily[user_id]).date()
+        if to_eastern(now).date() == last_claim_date:
             await ctx.send(f"{ctx.author.mention}, you've already claimed your daily today!")
             return
     
     reward = random.randint(100, 150)
-    ensure_user(ctx.author.id)
-    user_points[user_id] += reward
-    last_daily[user_id] = now.isoformat()
-    asyncio.create_task(save_data_async())
+    # Claimed before the credit is awaited so a second $daily can't slip in meanwhile
+    previous_claim = last_daily.get(user_id)
+    last_daily[user_id] = now
+    try:
+        await ensure_user(user_id)
+        await ledger.credit_async(user_id, reward)
+    except SharedStateBusy:
+        if previous_claim is None:
+            last_daily.pop(user_id, None)
+        else:
+            last_daily[user_id] = previous_claim
+        return await ctx.send(SHARED_BUSY_MESSAGE)
+    log_change('last_daily', user_id)
+    save_scheduler.request()
     
     embed = discord.Embed(
         title="🎉 Daily Reward Claimed",
@@ -814,40 +1440,69 @@ async def check_voice_points(ctx):
 
 @bot.command(
     name='leaderboard',
-    help='💰 Show top 10 users by points'
+    help='💰 Show top users by points (10 per page) and your rank',
+    usage="[page=1]"
 )
-async def show_leaderboard(ctx):
-    sorted_users = sorted(user_points.items(), key=lambda x: x[1], reverse=True)[:10]
+async def show_leaderboard(ctx, page: int = 1):
+    pages = rankings.pages(LEADERBOARD_PAGE_SIZE)
+    if page < 1 or page > pages:
+        return await ctx.send(f"❌ Page must be between 1 and {pages}.")
+    
+    start = (page - 1) * LEADERBOARD_PAGE_SIZE
+    page_users = rankings.page(page, LEADERBOARD_PAGE_SIZE)
     
     embed = discord.Embed(
-        title="🏆 Top 10 Users",
+        title="🏆 Top 10 Users" if page == 1 else f"🏆 Leaderboard (Page {page}/{pages})",
         color=discord.Color.blurple()
     )
     
-    for i, (user_id, points) in enumerate(sorted_users, 1):
-        try:
-            user = await bot.fetch_user(int(user_id))
+    users = await names.resolve_many(user_id for user_id, _ in page_users)
+    
+    for i, (user_id, points) in enumerate(page_users, start + 1):
+        user = users[int(user_id)]
+        if user is not None:
             embed.add_field(
                 name=f"{i}. {user.name}",
                 value=f"{points} points",
                 inline=False
             )
-        except:
+        else:
             embed.add_field(
                 name=f"{i}. Unknown User",
                 value=f"{points} points",
                 inline=False
             )
     
+    my_rank = rankings.rank(str(ctx.author.id))
+    if my_rank is not None:
+        embed.set_footer(text=f"Your rank: #{my_rank} of {len(rankings)} • Page {page}/{pages}")
+    else:
+        embed.set_footer(text=f"Page {page}/{pages}")
+    
     await ctx.send(embed=embed)
 
 # Betting System Commands
 @bot.command(
     name='createbet',
-    help='🎲 Create a new betting event',
-    usage="<name> <option1> <option2> [duration_minutes=5]"
+    help='🎲 Create a new betting event with 2-10 options',
+    usage="<name> <option1> <option2> [more options...] [duration=5]"
 )
-async def create_bet(ctx, name: str, option1: str, option2: str, duration_minutes: int = 5):
+async def create_bet(ctx, name: str, *args: str):
+    # The duration is only ever an explicit duration=<minutes>, so numeric options stay options
+    options = list(args)
+    duration_minutes = 5
+    if options and options[-1].lower().startswith('duration='):
+        value = options.pop()[len('duration='):]
+        if not value.isdigit():
+            return await ctx.send("❌ Duration must be a whole number of minutes, e.g. `duration=60`.")
+        duration_minutes = int(value)
+    
+    if len(options) < 2:
+        return await ctx.send("❌ A bet needs at least 2 options.")
+    if len(options) > MAX_BET_OPTIONS:
+        return await ctx.send(f"❌ A bet can have at most {MAX_BET_OPTIONS} options.")
+    if len(set(options)) != len(options):
+        return await ctx.send("❌ Options must all be different.")
     if duration_minutes < MIN_BET_DURATION:
         return await ctx.send(f"❌ Minimum bet duration is {MIN_BET_DURATION} minute.")
     if duration_minutes > MAX_BET_DURATION:
@@ -858,13 +1513,18 @@ async def create_bet(ctx, name: str, option1: str, option2: str, duration_minute
     
     active_bets[bet_id] = {
         'name': name,
-        'options': [option1, option2],
-        'bets': {option1: {}, option2: {}},
+        'options': options,
+        'bets': {option: {} for option in options},
+        'totals': {option: 0 for option in options},
+        'counts': {option: 0 for option in options},
         'end_time': end_time.isoformat(),
         'creator': ctx.author.id,
+        'channel': ctx.channel.id,
         'resolved': False
     }
-    asyncio.create_task(save_data_async())
+    bet_deadlines.schedule(scoped(bet_id), end_time.timestamp())
+    log_change('active_bets', bet_id)
+    save_scheduler.request()
     
     embed = discord.Embed(
         title=f"🎲 New Bet Created by {ctx.author.display_name}",
@@ -872,11 +1532,11 @@ async def create_bet(ctx, name: str, option1: str, option2: str, duration_minute
         color=discord.Color.blue(),
         timestamp=end_time
     )
-    embed.add_field(name="Option 1️⃣", value=option1, inline=True)
-    embed.add_field(name="Option 2️⃣", value=option2, inline=True)
+    for emoji, option in zip(OPTION_EMOJIS, options):
+        embed.add_field(name=f"Option {emoji}", value=option, inline=True)
     embed.add_field(
         name="How to Bet",
-        value=f"Use `{ctx.prefix}placebet {bet_id} <1 or 2> <amount>`",
+        value=f"Use `{ctx.prefix}placebet {bet_id} <1-{len(options)}> <amount>`",
         inline=False
     )
     embed.set_footer(text=f"Betting closes at")
@@ -890,36 +1550,63 @@ async def create_bet(ctx, name: str, option1: str, option2: str, duration_minute
 )
 async def place_bet(ctx, bet_id: str, option_number: int, amount: int):
     user_id = str(ctx.author.id)
-    ensure_user(user_id)
     
     if bet_id not in active_bets:
         return await ctx.send("❌ Invalid bet ID. Use `$createbet` to make a new one.")
     
     bet = active_bets[bet_id]
     
-    if datetime.fromisoformat(bet['end_time']) < datetime.now():
+    if not bet_is_open(bet_id):
         return await ctx.send("❌ Betting is closed for this event.")
     
-    if user_points[user_id] < amount:
-        return await ctx.send(f"❌ You only have {user_points[user_id]} points.")
+    if amount <= 0:
+        return await ctx.send("❌ Bet amount must be positive.")
+    
+    if not 1 <= option_number <= len(bet['options']):
+        return await ctx.send(f"❌ Please choose an option from 1 to {len(bet['options'])}.")
     
-    if option_number not in [1, 2]:
-        return await ctx.send("❌ Please choose option 1 or 2.")
+    try:
+        await ensure_user(user_id)
+        await ledger.debit_async(user_id, amount)
+    except InsufficientFunds as e:
+        return await ctx.send(f"❌ You only have {e.balance} points.")
+    except SharedStateBusy:
+        return await ctx.send(SHARED_BUSY_MESSAGE)
+    
+    # The debit may have awaited the shared service; the bet can have closed meanwhile
+    if active_bets.get(bet_id) is not bet or bet['resolved'] or not bet_is_open(bet_id):
+        await refund(user_id, amount)
+        return await ctx.send("❌ Betting closed while your bet was being placed; your points were returned.")
     
     selected_option = bet['options'][option_number - 1]
     
     previous_bet = bet['bets'][selected_option].get(user_id, 0)
     bet['bets'][selected_option][user_id] = previous_bet + amount
-    user_points[user_id] -= amount
-    asyncio.create_task(save_data_async())
-    
+    bet['totals'][selected_option] += amount
+    if not previous_bet:
+        bet['counts'][selected_option] += 1
+    log_change('active_bets', bet_id)
+    save_scheduler.request()
+    
+    pool = sum(bet['totals'].values())
+    stake = previous_bet + amount
     embed = discord.Embed(
         title="✅ Bet Placed",
         description=f"{ctx.author.mention} bet {amount} points on {selected_option}",
         color=discord.Color.green()
     )
-    embed.add_field(name="Total Bet", value=f"{previous_bet + amount} points on this option")
+    embed.add_field(name="Total Bet", value=f"{stake} points on this option")
     embed.add_field(name="Remaining Points", value=f"{user_points[user_id]} points")
+    embed.add_field(
+        name="Payout If It Wins",
+        value=f"{int(stake * pool / bet['totals'][selected_option])} points at current odds",
+        inline=False
+    )
+    embed.add_field(
+        name="Pool",
+        value="\n".join(format_pool(bet, option) for option in bet['options']),
+        inline=False
+    )
     await ctx.send(embed=embed)
 
 @bot.command(
@@ -935,32 +1622,41 @@ async def show_active_bets(ctx):
         color=discord.Color.blue()
     )
     
-    for bet_id, bet in active_bets.items():
-        if not bet['resolved'] and datetime.fromisoformat(bet['end_time']) > datetime.now():
-            try:
-                creator = await bot.fetch_user(bet['creator'])
-                time_left = datetime.fromisoformat(bet['end_time']) - datetime.now()
-                
-                embed.add_field(
-                    name=f"ID: {bet_id} - {bet['name']}",
-                    value=(
-                        f"Creator: {creator.mention}\n"
-                        f"Options: 1) {bet['options'][0]} | 2) {bet['options'][1]}\n"
-                        f"Time left: {str(time_left).split('.')[0]}\n"
-                        f"Cancel with: `{ctx.prefix}cancelbet {bet_id}`"
-                    ),
-                    inline=False
-                )
-            except:
-                embed.add_field(
-                    name=f"ID: {bet_id} - {bet['name']}",
-                    value=(
-                        f"Creator: Unknown User\n"
-                        f"Options: 1) {bet['options'][0]} | 2) {bet['options'][1]}\n"
-                        f"Cancel with: `{ctx.prefix}cancelbet {bet_id}`"
-                    ),
-                    inline=False
-                )
+    # active_bets only holds unresolved bets; open ones still have an expiry timer
+    now = epoch_time()
+    open_bets = [
+        (bet_id, bet, bet_deadlines.deadline(scoped(bet_id)) - now)
+        for bet_id, bet in active_bets.items() if bet_is_open(bet_id)
+    ]
+    creators = await names.resolve_many(bet['creator'] for _, bet, _ in open_bets)
+    
+    for bet_id, bet, seconds_left in open_bets:
+        creator = creators.get(int(bet['creator']))
+        if creator is not None:
+            time_left = timedelta(seconds=int(seconds_left))
+            
+            embed.add_field(
+                name=f"ID: {bet_id} - {bet['name']}",
+                value=(
+                    f"Creator: {creator.mention}\n"
+                    f"Options: {format_options(bet)}\n"
+                    f"Pool: {' | '.join(format_pool(bet, option) for option in bet['options'])}\n"
+                    f"Time left: {str(time_left).split('.')[0]}\n"
+                    f"Cancel with: `{ctx.prefix}cancelbet {bet_id}`"
+                ),
+                inline=False
+            )
+        else:
+            embed.add_field(
+                name=f"ID: {bet_id} - {bet['name']}",
+                value=(
+                    f"Creator: Unknown User\n"
+                    f"Options: {format_options(bet)}\n"
+                    f"Pool: {' | '.join(format_pool(bet, option) for option in bet['options'])}\n"
+                    f"Cancel with: `{ctx.prefix}cancelbet {bet_id}`"
+                ),
+                inline=False
+            )
     
     await ctx.send(embed=embed)
 
@@ -972,12 +1668,20 @@ async def show_active_bets(ctx):
 async def show_lottery_rules(ctx):
     embed = discord.Embed(
         title="🎰 Lottery Information",
-        description=TICKET_RULES,
+        description=ticket_rules(),
         color=0x00FF00
     )
+    pot = guild_state().lottery_pot
     embed.add_field(
         name="Current Pot", 
-        value=f"{lottery_pot} points ({len(lottery_history)} tickets sold)",
+        value=f"{pot} points ({len(lottery_history)} tickets sold)",
+        inline=False
+    )
+    value = ticket_value(pot, MAIN_NUMBER_RANGE, POWERBALL_RANGE, POWERBALL_BONUS,
+                         JACKPOT_PERCENT, MATCH5_PERCENT, MATCH4_PERCENT)
+    embed.add_field(
+        name="Ticket Value",
+        value=f"Up to {value:,.2f} points expected per {LOTTERY_COST}-point ticket (if no one shares your prize)",
         inline=False
     )
     embed.add_field(
@@ -987,6 +1691,15 @@ async def show_lottery_rules(ctx):
     )
     await ctx.send(embed=embed)
 
+def tickets_file(masks, pbs, filename):
+    """Render tickets into an in-memory CSV attachment"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['ticket', 'n1', 'n2', 'n3', 'n4', 'n5', 'powerball'])
+    for number, (mask, pb) in enumerate(zip(masks, pbs), 1):
+        writer.writerow([number, *mask_to_numbers(mask), pb])
+    return discord.File(io.BytesIO(buffer.getvalue().encode('utf-8')), filename=filename)
+
 @bot.command(
     name='quickticket',
     help='🎰 Generate AND buy random lottery tickets',
@@ -994,7 +1707,10 @@ async def show_lottery_rules(ctx):
 )
 async def quick_pick(ctx, amount: int = 1):
     user_id = str(ctx.author.id)
-    ensure_user(user_id)
+    try:
+        await ensure_user(user_id)
+    except SharedStateBusy:
+        return await ctx.send(SHARED_BUSY_MESSAGE)
     
     MAX_TICKETS = 1000  # 1000 ticket maximum
     
@@ -1002,74 +1718,89 @@ async def quick_pick(ctx, amount: int = 1):
         return await ctx.send("❌ Amount must be at least 1")
     if amount > MAX_TICKETS:
         return await ctx.send(f"❌ Max {MAX_TICKETS} tickets at once")
+    if guild_state().drawing:
+        return await ctx.send("⏳ A draw is in progress, try again in a moment")
     
     total_cost = LOTTERY_COST * amount
-    if user_points[user_id] < total_cost:
-        return await ctx.send(
-            f"❌ You need {total_cost} points for {amount} tickets "
-            f"(You have: {user_points[user_id]})"
-        )
-    
-    # Confirm large purchases
-    if amount > 100:
-        confirm_msg = await ctx.send(
-            f"⚠️ Are you sure you want to buy {amount} tickets for {total_cost} points? "
-            f"This will leave you with {user_points[user_id] - total_cost} points.\n"
-            f"React with ✅ to confirm within 30 seconds."
-        )
-        await confirm_msg.add_reaction('✅')
+    # Hold the user's lock across the confirmation so two purchases by the
+    # same user can't both pass the balance check
+    async with ledger.locked(scoped(user_id)):
+        if user_points[user_id] < total_cost:
+            return await ctx.send(
+                f"❌ You need {total_cost} points for {amount} tickets "
+                f"(You have: {user_points[user_id]})"
+            )
+        
+        # Confirm large purchases
+        if amount > 100:
+            confirm_msg = await ctx.send(
+                f"⚠️ Are you sure you want to buy {amount} tickets for {total_cost} points? "
+                f"This will leave you with {user_points[user_id] - total_cost} points.\n"
+                f"React with ✅ to confirm within 30 seconds."
+            )
+            await confirm_msg.add_reaction('✅')
+        
+            def check(reaction, user):
+                return user == ctx.author and str(reaction.emoji) == '✅' and reaction.message.id == confirm_msg.id
         
-        def check(reaction, user):
-            return user == ctx.author and str(reaction.emoji) == '✅' and reaction.message.id == confirm_msg.id
+            try:
+                await bot.wait_for('reaction_add', timeout=30.0, check=check)
+            except asyncio.TimeoutError:
+                await confirm_msg.edit(content="❌ Purchase cancelled (timeout)")
+                return
         
+        # Process purchase; the balance is re-checked here since other
+        # commands may have spent points while we waited for the reaction
+        if guild_state().drawing:
+            return await ctx.send("⏳ A draw is in progress, try again in a moment")
         try:
-            await bot.wait_for('reaction_add', timeout=30.0, check=check)
-        except asyncio.TimeoutError:
-            await confirm_msg.edit(content="❌ Purchase cancelled (timeout)")
-            return
-    
-    # Process purchase
-    user_points[user_id] -= total_cost
-    global lottery_pot
-    lottery_pot += total_cost
-    
-    # Generate tickets
-    tickets = []
-    for _ in range(amount):
-        main_numbers = sorted(random.sample(MAIN_NUMBER_RANGE, 5))
-        powerball = random.choice(list(POWERBALL_RANGE))
-        tickets.append((main_numbers, powerball))
-        lottery_history.append({
-            'user': user_id,
-            'numbers': main_numbers,
-            'powerball': powerball,
-            'time': datetime.now().isoformat()
-        })
-    
-    asyncio.create_task(save_data_async())
-    
-    # Send purchase confirmation
-    await ctx.send(
+            await ledger.debit_async(user_id, total_cost)
+        except InsufficientFunds as e:
+            return await ctx.send(
+                f"❌ You need {total_cost} points for {amount} tickets "
+                f"(You have: {e.balance})"
+            )
+        except SharedStateBusy:
+            return await ctx.send(SHARED_BUSY_MESSAGE)
+        if guild_state().drawing:
+            await refund(user_id, total_cost)
+            return await ctx.send("⏳ A draw started while buying, your points were returned")
+        guild_state().lottery_pot += total_cost
+        
+        # Generate tickets in bulk: one append and one WAL record for the batch
+        masks, pbs = random_tickets(amount, MAIN_NUMBER_RANGE, POWERBALL_RANGE)
+        offsets = lottery_history.extend(user_id, masks, pbs, epoch_time())
+        log_append('lottery_history', lottery_history.packed(offsets.start, offsets.stop))
+        log_value('lottery_pot')
+        save_scheduler.request()
+    
+    summary = (
         f"🎰 **{amount} TICKETS PURCHASED!**\n"
         f"**Cost:** {total_cost} points\n"
         f"**New Balance:** {user_points[user_id]} points\n"
-        f"**Pot Increased:** {lottery_pot} points (+{total_cost})\n"
+        f"**Pot Increased:** {guild_state().lottery_pot} points (+{total_cost})\n"
         f"────────────────────"
     )
     
-    # Format and send all tickets as regular messages
-    formatted_tickets = []
-    for i, (nums, pb) in enumerate(tickets, 1):
-        formatted_numbers = [f"{n:2d}" for n in nums]
-        formatted_tickets.append(
-            f"**#{i:04d}:** `{', '.join(formatted_numbers)}` + `PB: {pb:2d}`"
+    # Big batches: confirmation and every ticket in a single API call
+    if amount > TICKET_ATTACHMENT_THRESHOLD:
+        return await ctx.send(
+            f"{summary}\n📎 Your tickets are attached. "
+            f"Use `$mytickets` to view your ticket collection.",
+            file=tickets_file(masks, pbs, f"tickets_{user_id}.csv")
         )
     
-    # Split into chunks of 15 tickets per message (safe under 2000 chars)
-    chunks = [formatted_tickets[i:i+15] for i in range(0, len(formatted_tickets), 15)]
+    # Send purchase confirmation
+    await ctx.send(summary)
+    
+    # Send tickets in chunks of 15 per message (safe under 2000 chars),
+    # formatting each chunk only when it is sent
+    def format_ticket(n):
+        formatted_numbers = [f"{x:2d}" for x in mask_to_numbers(masks[n])]
+        return f"**#{n + 1:04d}:** `{', '.join(formatted_numbers)}` + `PB: {pbs[n]:2d}`"
     
-    for i, chunk in enumerate(chunks, 1):
-        chunk_text = "\n".join(chunk)
+    for i, start in enumerate(range(0, amount, 15), 1):
+        chunk_text = "\n".join(format_ticket(n) for n in range(start, min(start + 15, amount)))
         if i == 1:
             await ctx.send(f"**YOUR TICKETS:**\n{chunk_text}")
         else:
@@ -1092,32 +1823,35 @@ async def quick_pick(ctx, amount: int = 1):
 )
 async def buy_lottery_ticket(ctx, n1: int, n2: int, n3: int, n4: int, n5: int, pb: int):
     user_id = str(ctx.author.id)
-    ensure_user(user_id)
     
     # Validate numbers
     main_numbers = {n1, n2, n3, n4, n5}
     if len(main_numbers) != 5 or any(n not in MAIN_NUMBER_RANGE for n in main_numbers):
-        await ctx.send("❌ Pick 5 unique numbers between 1-18")
+        return await ctx.send(f"❌ Pick 5 unique numbers between {number_span(MAIN_NUMBER_RANGE)}")
     if pb not in POWERBALL_RANGE:
-        return await ctx.send("❌ Powerball must be 1-10")
+        return await ctx.send(f"❌ Powerball must be {number_span(POWERBALL_RANGE)}")
+    if guild_state().drawing:
+        return await ctx.send("⏳ A draw is in progress, try again in a moment")
     
     # Charge points
-    if user_points[user_id] < LOTTERY_COST:
-        return await ctx.send(f"❌ You need {LOTTERY_COST} points (You have: {user_points[user_id]})")
-    
-    user_points[user_id] -= LOTTERY_COST
-    global lottery_pot
-    lottery_pot += LOTTERY_COST
+    try:
+        await ensure_user(user_id)
+        await ledger.debit_async(user_id, LOTTERY_COST)
+    except InsufficientFunds as e:
+        return await ctx.send(f"❌ You need {LOTTERY_COST} points (You have: {e.balance})")
+    except SharedStateBusy:
+        return await ctx.send(SHARED_BUSY_MESSAGE)
+    if guild_state().drawing:
+        await refund(user_id, LOTTERY_COST)
+        return await ctx.send("⏳ A draw started while buying, your points were returned")
+    
+    guild_state().lottery_pot += LOTTERY_COST
     
     # Store ticket
-    ticket = {
-        'user': user_id,
-        'numbers': sorted(main_numbers),
-        'powerball': pb,
-        'time': datetime.now().isoformat()
-    }
-    lottery_history.append(ticket)
-    asyncio.create_task(save_data_async())
+    ticket = lottery_history.add(user_id, sorted(main_numbers), pb, datetime.now().timestamp())
+    log_append('lottery_history', ticket.to_row())
+    log_value('lottery_pot')
+    save_scheduler.request()
     
     # Create bingo display
     def create_bingo_card(numbers, pb):
@@ -1150,7 +1884,7 @@ async def buy_lottery_ticket(ctx, n1: int, n2: int, n3: int, n4: int, n5: int, p
             f"- {LOTTERY_COST} points\n"
             f"= Balance: {user_points[user_id]} points\n"
             f"```"
-            f"🏦 Pot: {lottery_pot} points"
+            f"🏦 Pot: {guild_state().lottery_pot} points"
         ),
         inline=False
     )
@@ -1164,13 +1898,13 @@ async def buy_lottery_ticket(ctx, n1: int, n2: int, n3: int, n4: int, n5: int, p
 )
 async def view_my_tickets(ctx):
     user_id = str(ctx.author.id)
-    user_tickets = sorted(
-        [t for t in lottery_history if t['user'] == user_id],
-        key=lambda x: x['time'],
-        reverse=True
-    )
+    tickets = guild_state().lottery_history
+    generation = tickets.generation
+    # Offsets are in purchase order; pages walk them backwards (newest first)
+    offsets = tickets.offsets_for(user_id)
+    total = len(offsets)
     
-    if not user_tickets:
+    if not total:
         return await ctx.send("You haven't purchased any tickets yet!")
 
     def create_bingo_card(numbers, pb, index=None, purchase_time=None):
@@ -1194,39 +1928,40 @@ async def view_my_tickets(ctx):
         
         return "\n".join(card)
 
-    # Create pages with 3 tickets each
+    # Pages of 3 tickets, built only when the user navigates to them
     tickets_per_page = 3
-    pages = []
+    page_count = (total - 1) // tickets_per_page + 1
     
-    for i in range(0, len(user_tickets), tickets_per_page):
+    def build_page(page):
+        i = page * tickets_per_page
         embed = discord.Embed(
-            title=f"🎟 Your Lottery Tickets ({len(user_tickets)} total)",
+            title=f"🎟 Your Lottery Tickets ({total} total)",
             color=discord.Color.gold()
         )
         
-        page_tickets = user_tickets[i:i+tickets_per_page]
         visual_display = []
         
-        for j, ticket in enumerate(page_tickets, 1):
-            purchase_time = datetime.fromisoformat(ticket['time']).strftime('%m/%d %I:%M %p')
+        for j in range(1, min(tickets_per_page, total - i) + 1):
+            ticket = tickets[offsets[total - i - j]]
+            purchase_time = ticket.purchased.strftime('%m/%d %I:%M %p')
             visual_display.append(
                 create_bingo_card(
-                    ticket['numbers'],
-                    ticket['powerball'],
+                    ticket.numbers,
+                    ticket.powerball,
                     index=i+j-1,
                     purchase_time=purchase_time
                 )
             )
         
         embed.description = "\n".join(visual_display)
-        embed.set_footer(text=f"Page {i//tickets_per_page + 1}/{(len(user_tickets)-1)//tickets_per_page + 1}")
-        pages.append(embed)
+        embed.set_footer(text=f"Page {page + 1}/{page_count}")
+        return embed
     
     # Send first page with pagination controls
-    if len(pages) == 1:
-        return await ctx.send(embed=pages[0])
+    if page_count == 1:
+        return await ctx.send(embed=build_page(0))
     
-    message = await ctx.send(embed=pages[0])
+    message = await ctx.send(embed=build_page(0))
     
     # Add reactions for navigation
     for emoji in ["⬅️", "➡️", "❌"]:
@@ -1242,12 +1977,17 @@ async def view_my_tickets(ctx):
         try:
             reaction, user = await bot.wait_for("reaction_add", timeout=60.0, check=check)
             
-            if str(reaction.emoji) == "➡️" and current_page < len(pages) - 1:
+            # A draw cleared the tickets these offsets point at
+            if tickets.generation != generation:
+                await message.edit(content="🎰 A draw has taken place, these tickets are no longer active.", embed=None)
+                return
+            
+            if str(reaction.emoji) == "➡️" and current_page < page_count - 1:
                 current_page += 1
-                await message.edit(embed=pages[current_page])
+                await message.edit(embed=build_page(current_page))
             elif str(reaction.emoji) == "⬅️" and current_page > 0:
                 current_page -= 1
-                await message.edit(embed=pages[current_page])
+                await message.edit(embed=build_page(current_page))
             elif str(reaction.emoji) == "❌":
                 await message.delete()
                 return
@@ -1272,23 +2012,18 @@ async def lottery_stats(ctx):
     if not lottery_winners:
         return await ctx.send("No draws yet!")
     
-    # Calculate frequency
-    main_counts = defaultdict(int)
-    pb_counts = defaultdict(int)
-    
-    for draw in lottery_winners:
-        for num in draw['main']:
-            main_counts[num] += 1
-        pb_counts[draw['powerball']] += 1
+    # Count draws and this round's picks (in the process pool for big rounds)
+    _, masks, pbs = lottery_history.draw_columns()
+    draws = [(draw['main'], draw['powerball']) for draw in lottery_winners]
+    counts = await run_cpu(lottery_frequencies, draws, masks, pbs, MAIN_NUMBER_RANGE, POWERBALL_RANGE,
+                           size=len(masks))
     
     # Top hot numbers
-    hot_main = sorted(main_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-    hot_pb = sorted(pb_counts.items(), key=lambda x: x[1], reverse=True)[:3]
+    hot_main = sorted(((n, c) for n, c in counts['main_drawn'].items() if c), key=lambda x: x[1], reverse=True)[:5]
+    hot_pb = sorted(((n, c) for n, c in counts['pb_drawn'].items() if c), key=lambda x: x[1], reverse=True)[:3]
     
-    # Cold numbers (never or rarely drawn)
-    all_main = set(MAIN_NUMBER_RANGE)
-    drawn_main = set(main_counts.keys())
-    cold_main = sorted(all_main - drawn_main) or ["None"]
+    # Cold numbers (never drawn)
+    cold_main = [n for n, c in counts['main_drawn'].items() if not c] or ["None"]
     
     embed = discord.Embed(
         title="📊 Lottery Statistics",
@@ -1310,6 +2045,15 @@ async def lottery_stats(ctx):
         value="\n".join(f"{num}: {count}x" for num, count in hot_pb),
         inline=False
     )
+    if len(masks):
+        picked = sorted(counts['main_picked'].items(), key=lambda x: x[1], reverse=True)[:5]
+        picked_pb = max(counts['pb_picked'].items(), key=lambda x: x[1])
+        embed.add_field(
+            name="🎟 Most Picked This Round",
+            value="\n".join(f"{num}: {count:,} tickets" for num, count in picked)
+                  + f"\nPowerball {picked_pb[0]}: {picked_pb[1]:,} tickets",
+            inline=False
+        )
     await ctx.send(embed=embed)
 
 # Owner Commands
@@ -1329,9 +2073,12 @@ async def give_points(ctx, user: discord.Member, amount: int):
         if amount > 10000:
             raise commands.BadArgument("Cannot give more than 10,000 points at once!")
         
-        ensure_user(user.id)
-        user_points[str(user.id)] += amount
-        await save_data_async()  
+        try:
+            await ensure_user(user.id)
+            await ledger.credit_async(str(user.id), amount)
+        except SharedStateBusy:
+            return await ctx.send(SHARED_BUSY_MESSAGE)
+        save_scheduler.request()
         
         embed = discord.Embed(
             title="✅ Points Added",
@@ -1361,13 +2108,21 @@ async def reset_points(ctx, amount: int = 100):
         original_user_count = len(user_points)
         
         # Reset all users to specified amount
+        # Bulk reset bypasses the ledger: one WAL value record and one index rebuild
+        await refresh_shared_balances()
         for user_id in list(user_points.keys()):
             user_points[user_id] = amount
+        ledger.mark_bulk_change()
+        if ledger.shared is not None:
+            await run_shared(ledger.shared.assign_many, dict(user_points))
+        rankings.rebuild(user_points)
         
         # Also reset voice points
         voice_channel_points.clear()
+        log_value('user_points')
+        log_value('voice_channel_points')
         
-        await save_data_async()
+        save_scheduler.request()
         
         embed = discord.Embed(
             title="✅ All Points Reset",
@@ -1389,11 +2144,16 @@ async def reset_points(ctx, amount: int = 100):
 
 @owner_required()
 async def reset_lottery(ctx):
-    global lottery_pot, lottery_history, lottery_winners
-    lottery_pot = INITIAL_POT
-    lottery_history = []
-    lottery_winners = []
-    await save_data_async()
+    state = guild_state()
+    if state.drawing:
+        return await ctx.send("⏳ A draw is in progress, try again in a moment")
+    state.lottery_pot = INITIAL_POT
+    state.lottery_history = TicketStore()
+    state.lottery_winners = []
+    log_value('lottery_pot')
+    log_value('lottery_history')
+    log_value('lottery_winners')
+    save_scheduler.request()
     await ctx.send("✅ Lottery data reset (pot, history, winners cleared).")
 
 @bot.command(
@@ -1447,12 +2207,82 @@ async def debug_voice(ctx):
 async def voice_debug(ctx):
     """Check voice system status"""
     status = {
-        "Running": bot.voice_points_update.is_running(),
-        "Next Check": bot.voice_points_update.next_iteration,
-        "Active Users": len(voice_start_times)
+        "Running": voice_payouts.is_running(),
+        "Next Payout": datetime.fromtimestamp(voice_payouts.next_due(), EASTERN) if voice_payouts.next_due() else None,
+        "Scheduled Payouts": len(voice_payouts),
+        "Payouts Fired": voice_payouts.fired,
+        "Active Users": len(voice_start_times),
+        "Saves": save_scheduler.stats(),
+        "Name Cache": names.stats(),
+        "Partitions": len(partitions),
+        "Shards": bot.shard_count if SHARDED else None,
+        "Shared Balances": STATE_SERVICE
     }
     await ctx.send(f"```json\n{json.dumps(status, indent=2, default=str)}\n```")
         
+@bot.command(
+    name='perf',
+    help='🛡️ [OWNER] Show command latency, event loop lag and save timings',
+    usage=""
+)
+@owner_required()
+async def show_perf(ctx):
+    def ms(seconds):
+        return f"{seconds * 1000:.1f}ms"
+    
+    def size(n):
+        return f"{n / 1024:.1f}KB" if n >= 1024 else f"{n:.0f}B"
+    
+    embed = discord.Embed(title="📈 Performance", color=discord.Color.blurple())
+    
+    # Busiest commands first
+    rows = [(name, command_seconds.summary(name)) for name in command_seconds.labels()]
+    rows.sort(key=lambda row: row[1]['count'], reverse=True)
+    lines = [f"{'Command':<16}{'n':>6}{'p50':>9}{'p99':>9}{'max':>9}"]
+    for name, s in rows[:15]:
+        lines.append(f"{name[:16]:<16}{s['count']:>6}{ms(s['p50']):>9}{ms(s['p99']):>9}{ms(s['max']):>9}")
+    embed.add_field(name="Commands", value="```\n" + "\n".join(lines) + "\n```", inline=False)
+    
+    lag = loop_lag_seconds.summary()
+    depth = executor_queue_depth.summary()
+    embed.add_field(
+        name="Event Loop",
+        value=(
+            (f"Lag p50 {ms(lag['p50'])} • p99 {ms(lag['p99'])} • max {ms(lag['max'])}\n" if lag else "No samples yet\n")
+            + f"Executor backlog: {executor_backlog()} now"
+            + (f", p99 {depth['p99']:.0f}, max {depth['max']:.0f}" if depth else "")
+        ),
+        inline=False
+    )
+    
+    saves = []
+    for kind in save_seconds.labels():
+        s = save_seconds.summary(kind)
+        written = save_bytes.summary(kind)
+        saves.append(
+            f"{kind}: {s['count']}x • p50 {ms(s['p50'])} • p99 {ms(s['p99'])}"
+            + (f" • p50 {size(written['p50'])}, max {size(written['max'])}" if written else "")
+        )
+    embed.add_field(name="Saves", value="\n".join(saves) or "No saves yet", inline=False)
+    
+    if watchdog.is_running():
+        stalls = [
+            f"{label[:24]}: {count}x • {total * 1000:.0f}ms total • worst {worst * 1000:.0f}ms"
+            for label, count, total, worst in watchdog.report(5)
+        ]
+        embed.add_field(name="Loop Stalls", value="\n".join(stalls) or "None detected", inline=False)
+    
+    voice = voice_check_seconds.summary()
+    embed.add_field(
+        name="Voice Check",
+        value=f"{voice['count']}x • p50 {ms(voice['p50'])} • max {ms(voice['max'])}" if voice else "Not run yet",
+        inline=False
+    )
+    
+    port = f" • /metrics on {METRICS_HOST}:{METRICS_PORT}" if METRICS_PORT else ""
+    embed.set_footer(text=f"Saves requested {save_scheduler.requested}, performed {save_scheduler.performed}{port}")
+    await ctx.send(embed=embed)
+
 # Admin Commands
 @bot.command(
     name='resetpot',
@@ -1461,9 +2291,9 @@ async def voice_debug(ctx):
 )
 @admin_required()
 async def reset_pot(ctx):
-    global lottery_pot
-    lottery_pot = INITIAL_POT
-    asyncio.create_task(save_data_async())
+    guild_state().lottery_pot = INITIAL_POT
+    log_value('lottery_pot')
+    save_scheduler.request()
     await ctx.send(f"✅ Pot reset to initial amount of {INITIAL_POT} points")
 
 @bot.command(
@@ -1473,90 +2303,114 @@ async def reset_pot(ctx):
 )
 @admin_required()
 async def draw_lottery(ctx):
-    global lottery_pot, lottery_history, lottery_winners
+    state = guild_state()
     
     if len(lottery_history) < 3:
         return await ctx.send("❌ Need at least 3 tickets to draw")
+    if state.drawing:
+        return await ctx.send("⏳ A draw is already in progress")
     
-    # Generate winning numbers
-    winning_main = sorted(random.sample(MAIN_NUMBER_RANGE, 5))
-    winning_pb = random.choice(list(POWERBALL_RANGE))
-    
-    # Record draw
-    lottery_winners.append({
-        'main': winning_main,
-        'powerball': winning_pb,
-        'time': datetime.now().isoformat()
-    })
-    
-    # Check winners
-    jackpot_winners = [
-        t for t in lottery_history 
-        if set(t['numbers']) == set(winning_main) and t['powerball'] == winning_pb
-    ]
-    match5_winners = [
-        t for t in lottery_history 
-        if set(t['numbers']) == set(winning_main) and t['powerball'] != winning_pb
-    ]
-    match4_winners = [
-        t for t in lottery_history 
-        if len(set(t['numbers']) & set(winning_main)) == 4
-    ]
-    powerball_winners = [t for t in lottery_history if t['powerball'] == winning_pb]
-    
-    # Calculate payouts
-    powerball_cost = len(powerball_winners) * POWERBALL_BONUS
-    remaining_pot = max(0, lottery_pot - powerball_cost)
-    
-    # Build result message
-    result_msg = []
-    
-    # Pay Powerball winners first
-    for ticket in powerball_winners:
-        user_points[ticket['user']] += POWERBALL_BONUS
-        result_msg.append(f"🎯 Powerball: <@{ticket['user']}> +{POWERBALL_BONUS} points")
-    
-    # Pay jackpot winners (60%)
-    if jackpot_winners:
-        jackpot_prize = int(remaining_pot * JACKPOT_PERCENT / len(jackpot_winners))
-        for ticket in jackpot_winners:
-            user_points[ticket['user']] += jackpot_prize
-            result_msg.append(f"🏆 **JACKPOT**: <@{ticket['user']}> won {jackpot_prize} points!")
-        remaining_pot -= jackpot_prize * len(jackpot_winners)
-    
-    # Pay match5 winners (30%)
-    if match5_winners:
-        match5_prize = int(remaining_pot * MATCH5_PERCENT / len(match5_winners))
-        for ticket in match5_winners:
-            user_points[ticket['user']] += match5_prize
-            result_msg.append(f"💰 Match 5: <@{ticket['user']}> +{match5_prize} points")
-        remaining_pot -= match5_prize * len(match5_winners)
-    
-    # Pay match4 winners (10%)
-    if match4_winners:
-        match4_prize = int(remaining_pot * MATCH4_PERCENT / len(match4_winners))
-        for ticket in match4_winners:
-            user_points[ticket['user']] += match4_prize
-            result_msg.append(f"🎫 Match 4: <@{ticket['user']}> +{match4_prize} points")
-        remaining_pot -= match4_prize * len(match4_winners)
-    
-    # Determine new pot
-    new_pot = remaining_pot if not jackpot_winners else 0
-    
-    # Update and save
-    lottery_pot = new_pot
-    lottery_history.clear()
-    asyncio.create_task(save_data_async())
+    # Ticket sales pause while the draw is settled off the event loop
+    state.drawing = True
+    try:
+        # Generate winning numbers
+        winning_main = sorted(random.sample(MAIN_NUMBER_RANGE, 5))
+        winning_pb = random.choice(list(POWERBALL_RANGE))
+        
+        # Match every ticket and aggregate winners per user (in the process pool for big draws);
+        # nothing is recorded until this succeeds, so a failed draw leaves the round as it was
+        columns = lottery_history.draw_columns()
+        try:
+            winners = await run_cpu(settle_draw, *columns, winning_main, winning_pb, size=len(lottery_history))
+        except Exception as e:
+            logger.error(f"Lottery draw settlement failed: {e}")
+            return await ctx.send("❌ The draw failed and no tickets were used, please try again")
+        jackpot_winners = winners['jackpot']
+        match5_winners = winners['match5']
+        match4_winners = winners['match4']
+        powerball_winners = winners['powerball']
+        jackpot_tickets = sum(count for _, count in jackpot_winners)
+        match5_tickets = sum(count for _, count in match5_winners)
+        match4_tickets = sum(count for _, count in match4_winners)
+        powerball_tickets = sum(count for _, count in powerball_winners)
+        
+        def ticket_note(count):
+            return f" ({count} tickets)" if count > 1 else ""
+        
+        # Calculate payouts
+        powerball_cost = powerball_tickets * POWERBALL_BONUS
+        remaining_pot = max(0, state.lottery_pot - powerball_cost)
+        
+        # Build result message; payouts are credited in one batch below
+        result_msg = []
+        payouts = []
+        
+        # Pay Powerball winners first
+        for user_id, count in powerball_winners:
+            payouts.append((str(user_id), POWERBALL_BONUS * count))
+            result_msg.append(f"🎯 Powerball: <@{user_id}> +{POWERBALL_BONUS * count} points{ticket_note(count)}")
+        
+        # Pay jackpot winners (60%)
+        if jackpot_winners:
+            jackpot_prize = int(remaining_pot * JACKPOT_PERCENT / jackpot_tickets)
+            for user_id, count in jackpot_winners:
+                payouts.append((str(user_id), jackpot_prize * count))
+                result_msg.append(f"🏆 **JACKPOT**: <@{user_id}> won {jackpot_prize * count} points!{ticket_note(count)}")
+            remaining_pot -= jackpot_prize * jackpot_tickets
+        
+        # Pay match5 winners (30%)
+        if match5_winners:
+            match5_prize = int(remaining_pot * MATCH5_PERCENT / match5_tickets)
+            for user_id, count in match5_winners:
+                payouts.append((str(user_id), match5_prize * count))
+                result_msg.append(f"💰 Match 5: <@{user_id}> +{match5_prize * count} points{ticket_note(count)}")
+            remaining_pot -= match5_prize * match5_tickets
+        
+        # Pay match4 winners (10%)
+        if match4_winners:
+            match4_prize = int(remaining_pot * MATCH4_PERCENT / match4_tickets)
+            for user_id, count in match4_winners:
+                payouts.append((str(user_id), match4_prize * count))
+                result_msg.append(f"🎫 Match 4: <@{user_id}> +{match4_prize * count} points{ticket_note(count)}")
+            remaining_pot -= match4_prize * match4_tickets
+        
+        # Determine new pot
+        new_pot = remaining_pot if not jackpot_winners else 0
+        
+        # Pay out first (one batch); if it fails the round is left as it was
+        try:
+            await ledger.credit_many_async(payouts)
+        except Exception as e:
+            logger.error(f"Lottery draw payout failed: {e}")
+            return await ctx.send("❌ The draw failed and no tickets were used, please try again")
+        
+        # Record draw
+        draw = {
+            'main': winning_main,
+            'powerball': winning_pb,
+            'time': datetime.now().isoformat()
+        }
+        lottery_winners.append(draw)
+        log_append('lottery_winners', draw)
+        
+        # Update and save
+        state.lottery_pot = new_pot
+        lottery_history.clear()
+        log_value('lottery_pot')
+        log_value('lottery_history')
+        save_scheduler.request()
+    finally:
+        state.drawing = False
     
     # Send results with chunked payout messages
     embed = discord.Embed(
-        title=f"🎰 Lottery Draw (Pot: {lottery_pot} points)",
+        title=f"🎰 Lottery Draw (Pot: {state.lottery_pot} points)",
         description=(
             f"Winning Numbers: **{', '.join(map(str, winning_main))}** + **{winning_pb}**\n"
-            f"```{len(jackpot_winners)} Jackpot Winner(s)\n"
-            f"{len(match5_winners)} Match-5 Winner(s)\n"
-            f"{len(match4_winners)} Match-4 Winner(s)\n"
-            f"{len(powerball_winners)} Powerball Winner(s)```"
+            f"```{jackpot_tickets} Jackpot Winner(s)\n"
+            f"{match5_tickets} Match-5 Winner(s)\n"
+            f"{match4_tickets} Match-4 Winner(s)\n"
+            f"{powerball_tickets} Powerball Winner(s)```"
         ),
         color=0xFFD700
     )
@@ -1609,14 +2463,14 @@ async def resolve_bet(ctx, bet_id: str, winning_option_number: int):
     if bet['resolved']:
         return await ctx.send("❌ This bet has already been resolved.")
     
-    if winning_option_number not in [1, 2]:
-        return await ctx.send("❌ Please choose winning option 1 or 2.")
+    if not 1 <= winning_option_number <= len(bet['options']):
+        return await ctx.send(f"❌ Please choose a winning option from 1 to {len(bet['options'])}.")
     
     winning_option = bet['options'][winning_option_number - 1]
-    losing_option = bet['options'][0] if winning_option_number == 2 else bet['options'][1]
     
-    total_winning = sum(bet['bets'][winning_option].values())
-    total_losing = sum(bet['bets'][losing_option].values())
+    total_pot = sum(bet['totals'].values())
+    total_winning = bet['totals'][winning_option]
+    total_losing = total_pot - total_winning
     
     embed = discord.Embed(
         title=f"🏆 Bet Resolved: {bet['name']}",
@@ -1624,29 +2478,43 @@ async def resolve_bet(ctx, bet_id: str, winning_option_number: int):
         color=discord.Color.gold()
     )
     
+    # Marked resolved before the payout is awaited so a second resolve or a cancel can't pay again
+    bet['resolved'] = True
     if total_winning == 0:
-        for option in bet['options']:
-            for user_id, amount in bet['bets'][option].items():
-                user_points[user_id] += amount
+        try:
+            await ledger.credit_many_async(
+                (user_id, amount)
+                for option in bet['options']
+                for user_id, amount in bet['bets'][option].items()
+            )
+        except SharedStateBusy:
+            bet['resolved'] = False
+            return await ctx.send(SHARED_BUSY_MESSAGE)
+        
+        await archive_bet(bet_id, 'refunded')
         
         embed.description = "No winners - all bets returned"
         await ctx.send(embed=embed)
     else:
-        winners = []
-        for user_id, amount in bet['bets'][winning_option].items():
-            winnings = amount + (amount / total_winning) * total_losing
-            user_points[user_id] += int(winnings)
-            winners.append((user_id, amount, int(winnings)))
+        # Whole pot split by stake, rounded so the payouts sum to it exactly
+        winners = parimutuel_payouts(bet['bets'][winning_option].items(), total_pot)
+        try:
+            await ledger.credit_many_async((user_id, winnings) for user_id, _, winnings in winners)
+        except SharedStateBusy:
+            bet['resolved'] = False
+            return await ctx.send(SHARED_BUSY_MESSAGE)
         
-        bet['resolved'] = True
-        asyncio.create_task(save_data_async())
+        bet['winner'] = winning_option
+        await archive_bet(bet_id, 'resolved')
         
         winner_text = []
-        for user_id, bet_amount, winnings in sorted(winners, key=lambda x: x[1], reverse=True)[:5]:
-            try:
-                user = await bot.fetch_user(int(user_id))
+        top_winners = heapq.nlargest(5, winners, key=lambda x: x[1])
+        users = await names.resolve_many(user_id for user_id, _, _ in top_winners)
+        for user_id, bet_amount, winnings in top_winners:
+            user = users[int(user_id)]
+            if user is not None:
                 winner_text.append(f"{user.name}: +{winnings - bet_amount} (total {winnings})")
-            except:
+            else:
                 winner_text.append(f"Unknown User: +{winnings - bet_amount} (total {winnings})")
         
         embed.add_field(
@@ -1656,7 +2524,7 @@ async def resolve_bet(ctx, bet_id: str, winning_option_number: int):
         )
         embed.add_field(
             name="Payout Details",
-            value=f"Total pot: {total_winning + total_losing}\nWinners share: {total_losing}",
+            value=f"Total pot: {total_pot}\nWinners share: {total_losing}",
             inline=False
         )
         await ctx.send(embed=embed)
@@ -1676,19 +2544,26 @@ async def cancel_bet(ctx, bet_id: str):
     if bet['resolved']:
         return await ctx.send("❌ This bet was already resolved.")
     
-    if datetime.fromisoformat(bet['end_time']) < datetime.now():
+    if not bet_is_open(bet_id):
         return await ctx.send("❌ This bet has already ended (use `$resolvebet` instead).")
 
     # Refund all bets
-    refunds = 0
-    for option in bet['options']:
-        for user_id, amount in bet['bets'][option].items():
-            user_points[user_id] += amount
-            refunds += amount
-    
-    # Mark as resolved and save
+    refund_list = [
+        (user_id, amount)
+        for option in bet['options']
+        for user_id, amount in bet['bets'][option].items()
+    ]
+    # Marked resolved before the refunds are awaited so nothing else can pay out this bet
     bet['resolved'] = True
-    asyncio.create_task(save_data_async())
+    try:
+        await ledger.credit_many_async(refund_list)
+    except SharedStateBusy:
+        bet['resolved'] = False
+        return await ctx.send(SHARED_BUSY_MESSAGE)
+    refunds = sum(bet['totals'].values())
+    
+    # Archive
+    await archive_bet(bet_id, 'cancelled')
     
     embed = discord.Embed(
         title="❌ Bet Cancelled",
@@ -1696,7 +2571,56 @@ async def cancel_bet(ctx, bet_id: str):
         color=discord.Color.orange()
     )
     embed.add_field(name="Bet Name", value=bet['name'])
-    embed.add_field(name="Options", value=f"1) {bet['options'][0]}\n2) {bet['options'][1]}")
+    embed.add_field(name="Options", value="\n".join(f"{i}) {option}" for i, option in enumerate(bet['options'], 1)))
+    await ctx.send(embed=embed)
+
+@bot.command(
+    name='betarchive',
+    help='🎲 Show recently finished bets, or one archived bet by ID',
+    usage="[bet_id]"
+)
+async def show_bet_archive(ctx, bet_id: str = None):
+    loop = asyncio.get_event_loop()
+    executor = archive.executor or _executor
+    
+    if bet_id is None:
+        entries = await loop.run_in_executor(executor, archive.recent, 10)
+        if not entries:
+            return await ctx.send("No finished bets yet.")
+        
+        embed = discord.Embed(
+            title="📜 Finished Bets",
+            color=discord.Color.dark_grey()
+        )
+        for entry in entries:
+            outcome = f"Winner: {entry['winner']}" if entry.get('winner') else entry.get('status', 'resolved').title()
+            embed.add_field(
+                name=f"ID: {entry['bet_id']} - {entry['name']}",
+                value=f"{outcome} • Pot: {sum(entry.get('totals', {}).values())} points",
+                inline=False
+            )
+        embed.set_footer(text=f"Details: {ctx.prefix}betarchive <bet_id>")
+        return await ctx.send(embed=embed)
+    
+    entry = await loop.run_in_executor(executor, archive.get, bet_id)
+    if entry is None:
+        return await ctx.send("❌ No archived bet with that ID.")
+    
+    embed = discord.Embed(
+        title=f"📜 {entry['name']}",
+        description=f"Bet ID: `{bet_id}` • {entry.get('status', 'resolved').title()}",
+        color=discord.Color.dark_grey()
+    )
+    embed.add_field(name="Creator", value=f"<@{entry['creator']}>", inline=True)
+    if entry.get('winner'):
+        embed.add_field(name="Winner", value=entry['winner'], inline=True)
+    if entry.get('closed_at'):
+        embed.add_field(name="Closed", value=to_eastern(entry['closed_at']).strftime('%Y-%m-%d %H:%M %Z'), inline=True)
+    embed.add_field(
+        name="Pool",
+        value="\n".join(format_pool(entry, option) for option in entry['options']),
+        inline=False
+    )
     await ctx.send(embed=embed)
 
 if __name__ == "__main__":
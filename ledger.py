@@ -0,0 +1,248 @@
+"""Balance ledger: the one place point balances are changed
+
+Every operation is synchronous and checks-then-mutates without awaiting, so
+on the event loop each call is atomic. Flows that must await between a
+balance check and the charge (e.g. a reaction confirmation) hold the
+per-user lock from locked() across the whole flow and still debit through
+the ledger, which re-checks the balance at the moment of the charge.
+
+With a shared balance service (see shared_state.py) the check-and-write
+happens atomically in the service instead, so it also holds across bot
+processes; the local mapping is then a cache of the service's balances.
+Code on the event loop uses the *_async methods: with a service they run
+its (blocking, possibly lock-waiting) call through run() in an executor and
+back off with asyncio.sleep while another process holds the database, and
+without one they are the plain synchronous operations. Because the shared
+path awaits, callers must not rely on state checked before the call still
+holding after it.
+"""
+import asyncio
+import weakref
+from collections import defaultdict
+
+
+class InsufficientFunds(Exception):
+    """Raised by debit/transfer when a balance can't cover the amount"""
+
+    def __init__(self, user_id, balance, amount):
+        super().__init__(f"user {user_id} has {balance} points, needs {amount}")
+        self.user_id = user_id
+        self.balance = balance
+        self.amount = amount
+
+
+class SharedStateBusy(Exception):
+    """The shared balance database stayed locked by another process for too long"""
+
+
+class Ledger:
+    """Atomic debit/credit/transfer over a {user_id: points} mapping
+
+    accounts is a zero-argument callable returning the current mapping, so
+    the owner may rebind it (e.g. on reload). on_change(user_id, balance) is
+    called after every mutation to keep indexes and the WAL in step. shared,
+    if given, is the balance service that owns the real balances; run(fn,
+    *args) is the coroutine the *_async methods use to call it off the loop.
+    """
+
+    def __init__(self, accounts, on_change=None, shared=None, run=None, busy_wait=5.0):
+        self._accounts = accounts
+        self._on_change = on_change
+        self.shared = shared
+        self._run = run
+        self.busy_wait = busy_wait
+        self._locks = weakref.WeakValueDictionary()
+        self.operations = 0
+        # operations count at each user's last local change, and at the last bulk change
+        self._stamps = {}
+        self._bulk_stamp = 0
+
+    def balance(self, user_id):
+        return self._accounts().get(user_id, 0)
+
+    def _apply(self, user_id, balance):
+        self._accounts()[user_id] = balance
+        self.operations += 1
+        self._stamps[user_id] = self.operations
+        if self._on_change is not None:
+            self._on_change(user_id, balance)
+        return balance
+
+    @staticmethod
+    def _check_amount(amount):
+        if amount < 0:
+            raise ValueError(f"amount must not be negative (got {amount})")
+
+    def set_balance(self, user_id, balance):
+        """Set a balance outright (admin resets)"""
+        if self.shared is not None:
+            self.shared.set_balance(user_id, balance)
+        return self._apply(user_id, balance)
+
+    def open_account(self, user_id, balance):
+        """Create an account with a starting balance unless it already exists"""
+        if self.shared is not None:
+            return self._apply(user_id, self.shared.open_account(user_id, balance))
+        if user_id in self._accounts():
+            return self.balance(user_id)
+        return self._apply(user_id, balance)
+
+    def credit(self, user_id, amount):
+        """Add points, returns the new balance"""
+        self._check_amount(amount)
+        if self.shared is not None:
+            return self._apply(user_id, self.shared.add(user_id, amount))
+        return self._apply(user_id, self.balance(user_id) + amount)
+
+    def debit(self, user_id, amount):
+        """Remove points or raise InsufficientFunds, returns the new balance"""
+        self._check_amount(amount)
+        if self.shared is not None:
+            return self._apply(user_id, self.shared.add(user_id, -amount, check=True))
+        balance = self.balance(user_id)
+        if balance < amount:
+            raise InsufficientFunds(user_id, balance, amount)
+        return self._apply(user_id, balance - amount)
+
+    async def _shared_call(self, fn, *args):
+        """Run a service call off the loop, retrying while the database is busy"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.busy_wait
+        delay = 0.05
+        while True:
+            try:
+                if self._run is None:
+                    return fn(*args)
+                return await self._run(fn, *args)
+            except SharedStateBusy:
+                if loop.time() + delay > deadline:
+                    raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    async def open_account_async(self, user_id, balance):
+        if self.shared is None:
+            return self.open_account(user_id, balance)
+        return self._apply(user_id, await self._shared_call(self.shared.open_account, user_id, balance))
+
+    async def credit_async(self, user_id, amount):
+        self._check_amount(amount)
+        if self.shared is None:
+            return self.credit(user_id, amount)
+        return self._apply(user_id, await self._shared_call(self.shared.add, user_id, amount))
+
+    async def debit_async(self, user_id, amount):
+        self._check_amount(amount)
+        if self.shared is None:
+            return self.debit(user_id, amount)
+        return self._apply(user_id, await self._shared_call(self.shared.add, user_id, -amount, True))
+
+    async def credit_many_async(self, payouts):
+        totals = defaultdict(int)
+        for user_id, amount in payouts:
+            self._check_amount(amount)
+            totals[user_id] += amount
+        if self.shared is None:
+            return self.credit_many(totals.items())
+        balances = await self._shared_call(self.shared.add_many, dict(totals))
+        return {user_id: self._apply(user_id, balance) for user_id, balance in balances.items()}
+
+    def transfer(self, from_user, to_user, amount):
+        """Move points between users; nothing changes if the debit fails"""
+        self.debit(from_user, amount)
+        self.credit(to_user, amount)
+
+    def credit_many(self, payouts):
+        """Credit an iterable of (user_id, amount) pairs in one batch
+
+        Amounts for the same user are summed first, so each account is
+        written (and logged) once. Returns {user_id: new balance}.
+        """
+        totals = defaultdict(int)
+        for user_id, amount in payouts:
+            self._check_amount(amount)
+            totals[user_id] += amount
+        if self.shared is not None:
+            return {user_id: self._apply(user_id, balance)
+                    for user_id, balance in self.shared.add_many(totals).items()}
+        return {user_id: self._apply(user_id, self.balance(user_id) + amount)
+                for user_id, amount in totals.items()}
+
+    def mark_bulk_change(self):
+        """Record a change made to the mapping directly (e.g. a reset of every balance)"""
+        self.operations += 1
+        self._bulk_stamp = self.operations
+
+    def refresh(self):
+        """Pull balances changed by other processes into the local mapping
+
+        Returns how many accounts changed (always 0 without a shared service).
+        """
+        if self.shared is None:
+            return 0
+        return self._refresh(self.shared.load(), self.operations)
+
+    async def refresh_async(self):
+        """refresh() with the load run off the loop
+
+        The loaded snapshot can be older than changes made locally while it
+        was fetched, so accounts changed since the fetch started keep their
+        local balance (the next refresh picks them up).
+        """
+        if self.shared is None:
+            return 0
+        started = self.operations
+        balances = await self._shared_call(self.shared.load)
+        if self._bulk_stamp > started:
+            return 0
+        return self._refresh(balances, started)
+
+    def _refresh(self, balances, started):
+        accounts = self._accounts()
+        changed = 0
+        for user_id, balance in balances.items():
+            if self._stamps.get(user_id, 0) > started:
+                continue
+            if accounts.get(user_id) != balance:
+                self._apply(user_id, balance)
+                changed += 1
+        return changed
+
+    def lock(self, user_id):
+        """The asyncio.Lock for one user (kept only while someone holds it)"""
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    def locked(self, *user_ids):
+        """Async context manager holding the locks of several users
+
+        Locks are taken in sorted order so two multi-user flows can't
+        deadlock against each other.
+        """
+        return _MultiLock([self.lock(u) for u in sorted(set(user_ids))])
+
+
+class _MultiLock:
+    def __init__(self, locks):
+        self._locks = locks
+        self._held = []
+
+    async def __aenter__(self):
+        try:
+            for lock in self._locks:
+                await lock.acquire()
+                self._held.append(lock)
+        except BaseException:
+            self._release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self._release()
+
+    def _release(self):
+        while self._held:
+            self._held.pop().release()
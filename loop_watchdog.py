@@ -0,0 +1,151 @@
+"""Event loop blocking detector
+
+A heartbeat task on the loop stamps the time every interval; a daemon
+thread watches the stamp. When it goes stale by more than threshold the
+loop is stuck in some synchronous code, so the thread samples the loop
+thread's Python stack (sys._current_frames) until the heartbeat resumes.
+Each stall is then attributed to whatever was running: the command name
+registered with label() for that task, otherwise the task's own name.
+
+Stalls are aggregated per label (count, total and worst duration, and the
+most frequently sampled stack), and on_stall is called for each one from
+the watchdog thread. The aggregates are written on that thread, so they are
+only read under the stats lock (report() returns a snapshot).
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import Counter
+
+STACK_DEPTH = 12  # Innermost frames kept per sample
+
+
+def format_loop_stack(frame):
+    """Format a stack sampled on the loop thread, starting at the task's own code"""
+    entries = traceback.extract_stack(frame)
+    # Everything up to the loop running the callback (asyncio/events.py) is the same every time
+    for index in range(len(entries) - 1, -1, -1):
+        if entries[index].filename.endswith(('asyncio/events.py', 'asyncio\\events.py')):
+            entries = entries[index + 1:]
+            break
+    return "".join(traceback.format_list(entries[-STACK_DEPTH:]))
+
+
+class Stall:
+    """One period during which the loop didn't run the heartbeat"""
+
+    __slots__ = ('label', 'duration', 'stack', 'new')
+
+    def __init__(self, label, duration, stack, new):
+        self.label = label
+        self.duration = duration
+        self.stack = stack   # Most sampled stack, formatted
+        self.new = new       # First time this label blocked at this stack
+
+
+class LoopWatchdog:
+    """Detects event loop stalls and attributes them (see module docstring)"""
+
+    def __init__(self, threshold=0.25, interval=0.05, max_samples=50, on_stall=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_samples = max_samples
+        self.on_stall = on_stall
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._labels = weakref.WeakKeyDictionary()
+        self._labels_lock = threading.Lock()
+        self._seen = set()
+        self._stop = None
+        self._thread = None
+        self._heartbeat = None
+        self._beat = time.monotonic()
+
+    def start(self, loop=None):
+        """Start watching; must be called from the loop's own thread"""
+        if self.is_running():
+            return
+        self._loop = loop or asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._heartbeat = self._loop.create_task(self._pulse())
+        # Each watcher thread gets its own stop event, so one still winding down
+        # after stop() can't be revived by a quick restart
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, args=(self._stop,), name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def label(self, task, name):
+        """Attribute stalls while task runs to name (e.g. the command)"""
+        if task is not None:
+            with self._labels_lock:
+                self._labels[task] = name
+
+    def unlabel(self, task):
+        with self._labels_lock:
+            self._labels.pop(task, None)
+
+    def report(self, limit=10):
+        """(label, stalls, total seconds, worst seconds), worst offenders first"""
+        with self._stats_lock:
+            rows = [(label, s['count'], s['total'], s['max']) for label, s in self.stats.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:limit]
+
+    async def _pulse(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _current_label(self):
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            return 'loop callback'
+        with self._labels_lock:
+            name = self._labels.get(task)
+        return name or task.get_name()
+
+    def _watch(self, stop):
+        stall_beat = None
+        label = None
+        samples = Counter()
+        while not stop.wait(self.interval / 2):
+            beat = self._beat
+            if time.monotonic() - beat > self.threshold:
+                if stall_beat != beat:
+                    stall_beat, label, samples = beat, self._current_label(), Counter()
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None and sum(samples.values()) < self.max_samples:
+                    samples[format_loop_stack(frame)] += 1
+            elif stall_beat is not None:
+                # The heartbeat is back; its sleep accounts for one interval of the gap
+                self._record(label, max(0.0, beat - stall_beat - self.interval), samples)
+                stall_beat = None
+
+    def _record(self, label, duration, samples):
+        stack = samples.most_common(1)[0][0] if samples else ""
+        with self._stats_lock:
+            stats = self.stats.setdefault(label, {'count': 0, 'total': 0.0, 'max': 0.0, 'stacks': Counter()})
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['max'] = max(stats['max'], duration)
+            stats['stacks'].update(samples)
+        key = (label, stack)
+        new = key not in self._seen
+        self._seen.add(key)
+        if self.on_stall is not None:
+            self.on_stall(Stall(label, duration, stack, new))
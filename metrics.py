@@ -0,0 +1,212 @@
+"""In-process performance metrics
+
+A small registry of fixed-bucket histograms, cheap enough to observe on
+every command. Owners read it with $perf; with METRICS_PORT set the same
+numbers are served in the Prometheus text format at /metrics.
+
+Quantiles are estimated from the buckets (linear interpolation inside the
+bucket holding the rank), so memory per series is constant no matter how
+many values are observed.
+"""
+import asyncio
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = tuple(256 * 4 ** n for n in range(10))  # 256 B .. 64 MiB
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class _Series:
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram:
+    """Fixed-bucket histogram, optionally split by one label
+
+    observe() may be called from executor threads as well as the loop.
+    """
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, label=None):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = _Series(len(self.bounds) + 1)
+            series.counts[bisect.bisect_left(self.bounds, value)] += 1
+            series.count += 1
+            series.sum += value
+            if value > series.max:
+                series.max = value
+
+    @contextlib.contextmanager
+    def time(self, label_value=None):
+        """Observe the wall time of a with block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label_value)
+
+    def labels(self):
+        return list(self._series)
+
+    def quantile(self, q, label_value=None):
+        series = self._series.get(label_value)
+        if series is None or not series.count:
+            return None
+        rank = q * series.count
+        seen = 0
+        for index, count in enumerate(series.counts):
+            if count and seen + count >= rank:
+                if index == len(self.bounds):
+                    return series.max
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = min(self.bounds[index], series.max)
+                return lower + (upper - lower) * max(0.0, rank - seen) / count
+            seen += count
+        return series.max
+
+    def summary(self, label_value=None):
+        """count, mean, p50, p99 and max for one series (None if never observed)"""
+        series = self._series.get(label_value)
+        if series is None or not series.count:
+            return None
+        return {
+            'count': series.count,
+            'mean': series.sum / series.count,
+            'p50': self.quantile(0.5, label_value),
+            'p99': self.quantile(0.99, label_value),
+            'max': series.max
+        }
+
+    def render(self, prefix):
+        name = f"{prefix}_{self.name}"
+        lines = [f"# HELP {name} {self.help}", f"# TYPE {name} histogram"]
+        with self._lock:
+            series_items = [(label_value, list(s.counts), s.count, s.sum) for label_value, s in self._series.items()]
+        for label_value, counts, count, total in sorted(series_items, key=lambda item: str(item[0])):
+            labels = f'{self.label}="{_escape(label_value)}",' if self.label else ""
+            cumulative = 0
+            for bound, bucket in zip(self.bounds + (float('inf'),), counts):
+                cumulative += bucket
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{{labels}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {total}")
+            lines.append(f"{name}_count{suffix} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """Named histograms plus callable gauges, rendered together"""
+
+    def __init__(self, prefix='betbot'):
+        self.prefix = prefix
+        self._histograms = {}
+        self._gauges = {}
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, label=None):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram(name, help, buckets, label)
+        return histogram
+
+    def gauge(self, name, help, fn):
+        """Register fn() as a gauge read at render time"""
+        self._gauges[name] = (help, fn)
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for histogram in self._histograms.values():
+            lines.extend(histogram.render(self.prefix))
+        for name, (help, fn) in self._gauges.items():
+            try:
+                value = fn()
+            except Exception as e:
+                logger.debug(f"Gauge {name} failed: {e}")
+                continue
+            full_name = f"{self.prefix}_{name}"
+            lines.extend([f"# HELP {full_name} {help}", f"# TYPE {full_name} gauge", f"{full_name} {value}"])
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagProbe:
+    """Measures how late the event loop wakes a sleeping task
+
+    Every interval it sleeps and records the overshoot; a blocked loop
+    shows up as lag. on_tick(), if given, runs on each wakeup (e.g. to
+    sample queue depths).
+    """
+
+    def __init__(self, histogram, interval=0.5, on_tick=None):
+        self.histogram = histogram
+        self.interval = interval
+        self.on_tick = on_tick
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.histogram.observe(max(0.0, loop.time() - expected))
+            if self.on_tick is not None:
+                try:
+                    self.on_tick()
+                except Exception as e:
+                    logger.error(f"Loop probe tick failed: {e}")
+
+
+async def serve_prometheus(registry, host='127.0.0.1', port=9108):
+    """Serve registry at http://host:port/metrics, returns the aiohttp runner to clean up"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(
+            body=registry.render_prometheus().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"📈 Metrics served at http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,95 @@
+"""User-name resolution without a REST round trip per lookup
+
+Lookup order:
+    1. the gateway cache (bot.get_user, populated by the members intent)
+    2. a TTL/LRU cache of earlier REST results
+    3. bot.fetch_user, with concurrent lookups of the same id sharing one
+       in-flight request and batches issued together via asyncio.gather
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class NameResolver:
+    """Resolves user ids to discord.User objects (or None if unknown)"""
+
+    def __init__(self, bot, ttl=3600, max_size=5000, negative_ttl=300):
+        self.bot = bot
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._cache = OrderedDict()  # user_id -> (expires_at, user or None)
+        self._inflight = {}
+        self.gateway_hits = 0
+        self.cache_hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def cached(self, user_id):
+        """Gateway or TTL cache lookup only; never touches the REST API"""
+        user_id = int(user_id)
+        user = self.bot.get_user(user_id)
+        if user is not None:
+            self.gateway_hits += 1
+            return user
+
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            expires_at, user = entry
+            if expires_at > time.monotonic():
+                self._cache.move_to_end(user_id)
+                self.cache_hits += 1
+                return user
+            del self._cache[user_id]
+        return None
+
+    def _remember(self, user_id, user):
+        ttl = self.ttl if user is not None else self.negative_ttl
+        self._cache[user_id] = (time.monotonic() + ttl, user)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, user_id):
+        self.misses += 1
+        try:
+            user = await self.bot.fetch_user(user_id)
+        except Exception as e:
+            self.failures += 1
+            logger.debug(f"fetch_user({user_id}) failed: {e}")
+            user = None
+        self._remember(user_id, user)
+        return user
+
+    async def resolve(self, user_id):
+        """Return the user for an id, fetching over REST only on a cache miss"""
+        user_id = int(user_id)
+        user = self.cached(user_id)
+        if user is not None or user_id in self._cache:
+            return user
+
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def resolve_many(self, user_ids):
+        """Resolve several ids concurrently, returns {user_id: user or None}"""
+        unique = list(dict.fromkeys(int(u) for u in user_ids))
+        users = await asyncio.gather(*(self.resolve(u) for u in unique))
+        return dict(zip(unique, users))
+
+    def stats(self):
+        return {
+            'gateway_hits': self.gateway_hits,
+            'cache_hits': self.cache_hits,
+            'misses': self.misses,
+            'failures': self.failures,
+            'cached': len(self._cache)
+        }
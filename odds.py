@@ -0,0 +1,77 @@
+"""Exact lottery odds and expected value
+
+Every probability here is counted exactly (math.comb over the configured
+ranges, kept as Fractions), so the rules shown to users stay correct
+whatever MAIN_NUMBER_RANGE, POWERBALL_RANGE or the pick count are set to.
+The odds only depend on those settings, so they are computed once per
+configuration and cached on it (ranges are hashable); a new range simply
+misses the cache. The expected value depends on the pot as well and is
+cheap to derive from the cached outcome table on every call.
+
+Tiers are the ones tickets.evaluate_draw settles:
+    jackpot   - every main number and the powerball
+    match5    - every main number, not the powerball
+    match4    - exactly one main number short, with or without the powerball
+    powerball - the powerball, whatever the main numbers (a jackpot wins it too)
+"""
+import functools
+from fractions import Fraction
+from math import comb
+
+TIERS = ('jackpot', 'match5', 'match4', 'powerball')
+
+
+@functools.lru_cache(maxsize=None)
+def outcome_odds(numbers, powerballs, picks=5):
+    """Probability of each (main numbers matched, powerball hit) outcome for one ticket"""
+    total = comb(len(numbers), picks)
+    pb_hit = Fraction(1, len(powerballs))
+    odds = {}
+    for matched in range(picks + 1):
+        main = Fraction(comb(picks, matched) * comb(len(numbers) - picks, picks - matched), total)
+        odds[(matched, True)] = main * pb_hit
+        odds[(matched, False)] = main * (1 - pb_hit)
+    return odds
+
+
+@functools.lru_cache(maxsize=None)
+def tier_odds(numbers, powerballs, picks=5):
+    """Chance of one ticket winning each tier, as Fractions"""
+    outcomes = outcome_odds(numbers, powerballs, picks)
+    return {
+        'jackpot': outcomes[(picks, True)],
+        'match5': outcomes[(picks, False)],
+        'match4': outcomes[(picks - 1, True)] + outcomes[(picks - 1, False)],
+        'powerball': Fraction(1, len(powerballs))
+    }
+
+
+def format_odds(probability):
+    """'1 in 85,680' for long odds, '1 in 9.5' for short ones"""
+    if not probability:
+        return "never"
+    ratio = 1 / probability
+    if ratio >= 100:
+        return f"1 in {round(ratio):,}"
+    return f"1 in {float(ratio):,.1f}".removesuffix('.0')
+
+
+def ticket_value(pot, numbers, powerballs, bonus, jackpot_share, match5_share, match4_share, picks=5):
+    """Expected points one ticket wins if the draw were held against pot
+
+    Pays each outcome the way draw_lottery settles it (powerball bonus
+    first, then the shares of what is left, truncated to whole points) for
+    a ticket that is the only winner in its tiers. Other winners split the
+    shares, so this is the most a ticket can be worth at this pot.
+    """
+    after_bonus = max(0, pot - bonus)
+    payouts = {
+        (picks, True): bonus + int(after_bonus * jackpot_share),
+        (picks, False): int(pot * match5_share),
+        (picks - 1, True): bonus + int(after_bonus * match4_share),
+        (picks - 1, False): int(pot * match4_share)
+    }
+    value = Fraction(0)
+    for (matched, pb_hit), probability in outcome_odds(numbers, powerballs, picks).items():
+        value += probability * payouts.get((matched, pb_hit), bonus if pb_hit else 0)
+    return float(value)
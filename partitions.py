@@ -0,0 +1,142 @@
+"""Per-guild state partitions
+
+With partitioning enabled every guild gets its own copy of the bot state
+(balances, bets, voice tracking, lottery) backed by its own store files, so
+nothing leaks between servers and a shard only loads and persists the
+guilds it actually serves.
+
+The bot keeps using its module-level names (user_points, active_bets, ...).
+Each one is a StateProxy that forwards to the same-named attribute of the
+*current* partition, which is tracked in a ContextVar. discord.py runs every
+event handler in its own task and tasks copy the context, so selecting the
+guild at the top of a handler scopes everything it does - across awaits -
+to that guild. Without partitioning there is a single partition (key None)
+and the bot behaves exactly as before.
+
+Turning partitioning on for an existing bot: the old top-level data files
+belong to no guild, so the bot refuses to start until LEGACY_GUILD_ID names
+the guild that inherits them; they are then moved into that guild's folder
+once. DMs (key None) use guilds/direct/ while partitioned.
+"""
+import contextlib
+from contextvars import ContextVar
+
+_current_key = ContextVar('partition_key', default=None)
+
+
+class Partition:
+    """One guild's state; the loader sets the attributes"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def __repr__(self):
+        return f"<Partition {self.key if self.key is not None else 'global'}>"
+
+
+class PartitionManager:
+    """Loads partitions on first use and tracks which one is current
+
+    loader(partition) is called with the new partition already current, so
+    it can use the proxies while it fills the partition in.
+    """
+
+    def __init__(self, enabled=False, loader=None):
+        self.enabled = enabled
+        self.loader = loader
+        self._partitions = {}
+
+    def key_for(self, guild_id):
+        """Partition key for a guild id (None is the unpartitioned state)"""
+        if not self.enabled or guild_id is None:
+            return None
+        return int(guild_id)
+
+    def get(self, key):
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = Partition(key)
+            # Registered up front so proxies used by the loader resolve to it
+            self._partitions[key] = partition
+            token = _current_key.set(key)
+            try:
+                self.loader(partition)
+            except BaseException:
+                del self._partitions[key]
+                raise
+            finally:
+                _current_key.reset(token)
+        return partition
+
+    def current_key(self):
+        return _current_key.get()
+
+    def current(self):
+        return self.get(_current_key.get())
+
+    def activate(self, guild_id):
+        """Select a guild's partition for the rest of the running task"""
+        key = self.key_for(guild_id)
+        _current_key.set(key)
+        return self.get(key)
+
+    @contextlib.contextmanager
+    def use(self, key):
+        """Select a partition by key for the duration of a with block"""
+        token = _current_key.set(key)
+        try:
+            yield self.get(key)
+        finally:
+            _current_key.reset(token)
+
+    def loaded(self):
+        return list(self._partitions.values())
+
+    def clear(self):
+        self._partitions.clear()
+
+    def proxy(self, name):
+        return StateProxy(self, name)
+
+    def __len__(self):
+        return len(self._partitions)
+
+
+class StateProxy:
+    """Stand-in for a module global that resolves to the current partition's attribute"""
+
+    __slots__ = ('_manager', '_name')
+
+    def __init__(self, manager, name):
+        object.__setattr__(self, '_manager', manager)
+        object.__setattr__(self, '_name', name)
+
+    def _target(self):
+        return getattr(self._manager.current(), self._name)
+
+    def __getattr__(self, attr):
+        return getattr(self._target(), attr)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __contains__(self, key):
+        return key in self._target()
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def __bool__(self):
+        return bool(self._target())
+
+    def __repr__(self):
+        return f"<StateProxy {self._name}: {self._target()!r}>"
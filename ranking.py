@@ -0,0 +1,105 @@
+"""Incremental leaderboard index
+
+Keeps every user ordered by (-points, user_id) so top-N, "my rank" and
+paged leaderboard queries never sort the whole balance table. The index is
+updated on each balance change instead of being rebuilt per query.
+
+Uses sortedcontainers.SortedList when it is installed (O(log n) updates and
+rank lookups); otherwise falls back to a plain list kept sorted with bisect,
+where lookups are still O(log n) and updates cost one memmove.
+"""
+from bisect import bisect_left, insort
+
+try:
+    from sortedcontainers import SortedList
+except ImportError:  # sortedcontainers is optional; see _BisectList
+    SortedList = None
+
+
+class _BisectList:
+    """Minimal SortedList stand-in backed by a sorted Python list"""
+
+    def __init__(self, iterable=()):
+        self._items = sorted(iterable)
+
+    def add(self, item):
+        insort(self._items, item)
+
+    def remove(self, item):
+        index = bisect_left(self._items, item)
+        if index == len(self._items) or self._items[index] != item:
+            raise ValueError(f"{item!r} not in list")
+        del self._items[index]
+
+    def index(self, item):
+        index = bisect_left(self._items, item)
+        if index == len(self._items) or self._items[index] != item:
+            raise ValueError(f"{item!r} not in list")
+        return index
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RankIndex:
+    """Users ordered by points (highest first), ties broken by user id"""
+
+    def __init__(self, points=None):
+        self._points = {}
+        self._sorted = (SortedList or _BisectList)()
+        if points:
+            self.rebuild(points)
+
+    @staticmethod
+    def _key(user_id, points):
+        return (-points, int(user_id))
+
+    def rebuild(self, points):
+        """Replace the index with the contents of a {user_id: points} mapping"""
+        self._points = dict(points)
+        self._sorted = (SortedList or _BisectList)(
+            self._key(user_id, value) for user_id, value in self._points.items()
+        )
+
+    def update(self, user_id, points):
+        """Move a user to their new balance"""
+        old = self._points.get(user_id)
+        if old == points:
+            return
+        if old is not None:
+            self._sorted.remove(self._key(user_id, old))
+        self._points[user_id] = points
+        self._sorted.add(self._key(user_id, points))
+
+    def remove(self, user_id):
+        old = self._points.pop(user_id, None)
+        if old is not None:
+            self._sorted.remove(self._key(user_id, old))
+
+    def rank(self, user_id):
+        """1-based rank of a user, or None if they have no balance"""
+        points = self._points.get(user_id)
+        if points is None:
+            return None
+        return self._sorted.index(self._key(user_id, points)) + 1
+
+    def top(self, count, start=0):
+        """(user_id, points) pairs for ranks start+1 .. start+count"""
+        return [(str(user_id), -neg_points)
+                for neg_points, user_id in self._sorted[start:start + count]]
+
+    def page(self, page, per_page=10):
+        """One leaderboard page (1-based) as (user_id, points) pairs"""
+        return self.top(per_page, (page - 1) * per_page)
+
+    def pages(self, per_page=10):
+        return max(1, -(-len(self) // per_page))
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, user_id):
+        return user_id in self._points
@@ -0,0 +1,106 @@
+"""Heap-based deadline scheduler
+
+Fires an async callback for each key once its deadline (epoch seconds)
+passes. A single task sleeps until the earliest deadline, so the cost per
+event is O(log n) with no periodic sweep over every key.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """Heap of (deadline, key) entries with lazy cancellation
+
+    Rescheduling or cancelling a key only updates the deadlines dict; stale
+    heap entries are skipped when they reach the top.
+    """
+
+    def __init__(self, callback, name='scheduler'):
+        self._callback = callback
+        self.name = name
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self.fired = 0
+
+    def schedule(self, key, when):
+        """Set (or move) the deadline for key"""
+        self._deadlines[key] = when
+        heapq.heappush(self._heap, (when, next(self._counter), key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._rebuild()
+        # Only a new earliest deadline needs the sleeping task to recompute
+        if self._wakeup is not None and self._heap[0][2] == key:
+            self._wakeup.set()
+
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+
+    def clear(self):
+        self._deadlines.clear()
+        self._heap = []
+
+    def deadline(self, key):
+        return self._deadlines.get(key)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def _rebuild(self):
+        self._heap = [(when, next(self._counter), key) for key, when in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def _drop_stale(self):
+        while self._heap:
+            when, _, key = self._heap[0]
+            if self._deadlines.get(key) == when:
+                return
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        """Earliest pending deadline, or None"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def start(self):
+        if not self.is_running():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+        return self._task
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def stop(self):
+        if self.is_running():
+            self._task.cancel()
+
+    async def _run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            due = self.next_due()
+            delay = None if due is None else due - time.time()
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            self.fired += 1
+            try:
+                await self._callback(key)
+            except Exception as e:
+                logger.error(f"{self.name} callback for {key!r} failed: {e}")
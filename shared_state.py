@@ -0,0 +1,235 @@
+"""Shared balance service for running several bot processes
+
+By default each process owns its state files outright. To spread the bot
+over several processes (e.g. one per shard range), point them all at one
+SharedBalances database: every balance change becomes a single atomic
+read-check-write transaction in that database, so two processes can never
+spend the same points. Each process keeps its local user_points as a cache
+of the shared values (refreshed periodically) for leaderboards and display.
+
+SqliteBalances needs no daemon: SQLite serializes writers across processes
+with BEGIN IMMEDIATE and the WAL journal lets readers run alongside. Every
+call blocks, so the bot runs them in an executor (see the ledger's *_async
+methods). Waiting for another process's write lock is still bounded: a
+short busy timeout, retried with backoff for at most max_wait seconds,
+after which SharedStateBusy is raised and the ledger retries later.
+LocalBalances implements the same interface in memory for tests and
+single-process runs.
+
+Balances are namespaced by scope() - the bot passes the current partition
+key, so per-guild economies stay separate in the shared database too.
+"""
+import contextlib
+import sqlite3
+import threading
+import time
+
+from ledger import InsufficientFunds, SharedStateBusy
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS balances (
+    scope TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (scope, user_id)
+) WITHOUT ROWID;
+"""
+
+
+def _scope_name(key):
+    return '' if key is None else str(key)
+
+
+class LocalBalances:
+    """In-process stand-in for a shared balance service"""
+
+    def __init__(self, scope=None):
+        self._scope = scope or (lambda: None)
+        self._lock = threading.Lock()
+        self._balances = {}
+
+    def _table(self):
+        return self._balances.setdefault(_scope_name(self._scope()), {})
+
+    def balance(self, user_id):
+        with self._lock:
+            return self._table().get(user_id, 0)
+
+    def open_account(self, user_id, balance):
+        """Create the account unless it exists; returns the actual balance"""
+        with self._lock:
+            return self._table().setdefault(user_id, balance)
+
+    def set_balance(self, user_id, balance):
+        with self._lock:
+            self._table()[user_id] = balance
+        return balance
+
+    def add(self, user_id, delta, check=False):
+        """Add delta atomically; with check, refuse to go below zero"""
+        with self._lock:
+            table = self._table()
+            balance = table.get(user_id, 0)
+            if check and balance + delta < 0:
+                raise InsufficientFunds(user_id, balance, -delta)
+            table[user_id] = balance + delta
+            return balance + delta
+
+    def add_many(self, deltas):
+        """Apply {user_id: delta} in one step, returns {user_id: new balance}"""
+        with self._lock:
+            table = self._table()
+            for user_id, delta in deltas.items():
+                table[user_id] = table.get(user_id, 0) + delta
+            return {user_id: table[user_id] for user_id in deltas}
+
+    def assign_many(self, balances):
+        with self._lock:
+            self._table().update(balances)
+
+    def seed(self, balances):
+        """Copy in accounts the service doesn't know yet (first start migration)"""
+        with self._lock:
+            table = self._table()
+            missing = {u: b for u, b in balances.items() if u not in table}
+            table.update(missing)
+            return len(missing)
+
+    def load(self):
+        """All balances in the current scope"""
+        with self._lock:
+            return dict(self._table())
+
+    def close(self):
+        pass
+
+
+class SqliteBalances:
+    """Balances in a SQLite file shared by every bot process on the host"""
+
+    def __init__(self, path='shared.db', scope=None, busy_timeout=0.02, max_wait=0.5):
+        self.path = path
+        self._scope = scope or (lambda: None)
+        self._lock = threading.Lock()
+        self.max_wait = max_wait
+        # Autocommit mode; transactions are opened explicitly below
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SHARED_SCHEMA)
+
+    def _begin(self):
+        """Take the cross-process write lock, backing off while another process holds it"""
+        deadline = time.monotonic() + self.max_wait
+        delay = 0.002
+        while True:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                if time.monotonic() + delay > deadline:
+                    raise SharedStateBusy(f"{self.path} stayed locked for {self.max_wait}s") from e
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Write transaction; BEGIN IMMEDIATE takes the cross-process write lock up front"""
+        with self._lock:
+            self._begin()
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _get(self, conn, scope, user_id):
+        row = conn.execute("SELECT points FROM balances WHERE scope = ? AND user_id = ?",
+                           (scope, user_id)).fetchone()
+        return None if row is None else row[0]
+
+    def _put(self, conn, scope, user_id, balance):
+        conn.execute(
+            "INSERT INTO balances (scope, user_id, points) VALUES (?, ?, ?) "
+            "ON CONFLICT (scope, user_id) DO UPDATE SET points = excluded.points",
+            (scope, user_id, balance)
+        )
+
+    def balance(self, user_id):
+        with self._lock:
+            return self._get(self._conn, _scope_name(self._scope()), user_id) or 0
+
+    def open_account(self, user_id, balance):
+        """Create the account unless it exists; returns the actual balance"""
+        scope = _scope_name(self._scope())
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO balances (scope, user_id, points) VALUES (?, ?, ?)",
+                         (scope, user_id, balance))
+            return self._get(conn, scope, user_id)
+
+    def set_balance(self, user_id, balance):
+        with self._transaction() as conn:
+            self._put(conn, _scope_name(self._scope()), user_id, balance)
+        return balance
+
+    def add(self, user_id, delta, check=False):
+        """Add delta atomically; with check, refuse to go below zero"""
+        scope = _scope_name(self._scope())
+        with self._transaction() as conn:
+            balance = self._get(conn, scope, user_id) or 0
+            if check and balance + delta < 0:
+                raise InsufficientFunds(user_id, balance, -delta)
+            self._put(conn, scope, user_id, balance + delta)
+            return balance + delta
+
+    def add_many(self, deltas):
+        """Apply {user_id: delta} in one transaction, returns {user_id: new balance}"""
+        scope = _scope_name(self._scope())
+        result = {}
+        with self._transaction() as conn:
+            for user_id, delta in deltas.items():
+                result[user_id] = (self._get(conn, scope, user_id) or 0) + delta
+                self._put(conn, scope, user_id, result[user_id])
+        return result
+
+    def assign_many(self, balances):
+        scope = _scope_name(self._scope())
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO balances (scope, user_id, points) VALUES (?, ?, ?) "
+                "ON CONFLICT (scope, user_id) DO UPDATE SET points = excluded.points",
+                [(scope, user_id, balance) for user_id, balance in balances.items()]
+            )
+
+    def seed(self, balances):
+        """Copy in accounts the service doesn't know yet (first start migration)"""
+        scope = _scope_name(self._scope())
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO balances (scope, user_id, points) VALUES (?, ?, ?)",
+                             [(scope, user_id, balance) for user_id, balance in balances.items()])
+            return conn.total_changes - before
+
+    def load(self):
+        """All balances in the current scope"""
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, points FROM balances WHERE scope = ?",
+                                      (_scope_name(self._scope()),)).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_shared_balances(target, scope=None):
+    """SharedBalances for a STATE_SERVICE setting: None, 'local', or a SQLite path"""
+    if not target:
+        return None
+    if target == 'local':
+        return LocalBalances(scope)
+    return SqliteBalances(target, scope)
@@ -0,0 +1,848 @@
+"""Persistence engine for BetBot
+
+Every mutation is appended to a write-ahead log (WAL) as a compact JSON line.
+A background compaction folds the log into a full snapshot, so the cost of a
+save grows with the size of the change instead of the size of the state.
+The same records can instead be applied to a SQLite database (SqliteStore);
+open_store picks the backend. Finished bets are kept out of the state
+altogether, in a cold archive (open_archive).
+
+The WAL keeps every record newer than the *oldest* retained snapshot
+generation, so falling back to data.json.1 (or older) after corruption still
+replays everything that happened since; load() refuses to continue if the
+log doesn't reach back to the snapshot it had to use.
+
+WAL record format: [seq, op, name, key, value]
+    's' - set name[key] = value
+    'd' - delete name[key]
+    'v' - replace the whole value of name
+    'a' - append value to the list name
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tickets import TicketStore
+
+logger = logging.getLogger(__name__)
+
+COMPACT_SEPARATORS = (',', ':')
+
+
+class WalGapError(Exception):
+    """The WAL no longer covers the changes since the snapshot being loaded"""
+
+
+def _json_default(obj):
+    """Serialize state containers that know their own JSON form"""
+    if hasattr(obj, 'to_json'):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _fsync_dir(path):
+    """Persist a rename by syncing its directory (no-op where unsupported)"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, text):
+    """Write text to path via temp file, fsync and rename
+
+    Readers see either the old file or the complete new one, never a
+    truncated mix. Returns the number of bytes written.
+    """
+    tmp_path = f"{path}.tmp"
+    data = text.encode('utf-8')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+    return len(data)
+
+
+def apply_record(data, record):
+    """Apply a single WAL record to a loaded state dict"""
+    _, op, name, key, value = record
+    if op == 's':
+        data.setdefault(name, {})[key] = value
+    elif op == 'd':
+        data.get(name, {}).pop(key, None)
+    elif op == 'v':
+        data[name] = value
+    elif op == 'a':
+        data.setdefault(name, []).append(value)
+    else:
+        logger.warning(f"Skipping unknown WAL op {op!r}")
+
+
+def migrate_voice_tracking(legacy, last_payout):
+    """Convert legacy float voice totals into {'total_time', 'last_payout'} records
+
+    Returns (tracking, migrated_count).
+    """
+    tracking = {}
+    migrated = 0
+    for user_id, time_data in legacy.items():
+        if isinstance(time_data, dict):
+            tracking[user_id] = time_data
+        else:
+            tracking[user_id] = {
+                'total_time': float(time_data),
+                'last_payout': last_payout
+            }
+            migrated += 1
+    return tracking, migrated
+
+
+class RecordingStore:
+    """Common mutation-recording interface shared by all storage backends
+
+    Mutations are queued in memory by the record_* methods (cheap, called on
+    the event loop) and written out by flush(), which may run in a thread.
+    """
+
+    # Executor the backend wants its blocking work on (None = caller's choice)
+    executor = None
+
+    def __init__(self, compact_threshold=5000):
+        self.compact_threshold = compact_threshold
+        self.seq = 0
+        self.wal_records = 0
+        self.bytes_written = 0  # File bytes written so far (backends that can tell)
+        self._pending = []
+        self._pending_lock = threading.Lock()
+
+    # Recording (called from the event loop)
+    def _record(self, op, name, key=None, value=None):
+        with self._pending_lock:
+            self.seq += 1
+            self._pending.append([self.seq, op, name, key, value])
+
+    def record_set(self, name, key, value):
+        self._record('s', name, key, value)
+
+    def record_delete(self, name, key):
+        self._record('d', name, key)
+
+    def record_value(self, name, value):
+        self._record('v', name, value=value)
+
+    def record_append(self, name, value):
+        self._record('a', name, value=value)
+
+    @property
+    def pending(self):
+        """Number of recorded mutations not yet flushed"""
+        return len(self._pending)
+
+    @property
+    def needs_compaction(self):
+        return self.wal_records + len(self._pending) >= self.compact_threshold
+
+    def begin_snapshot(self):
+        """Sequence number the current in-memory state corresponds to"""
+        with self._pending_lock:
+            return self.seq
+
+    def _take_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+
+class WalStore(RecordingStore):
+    """Snapshot file plus an append-only log of the changes made since"""
+
+    def __init__(self, snapshot_path='data.json', wal_path='data.wal', compact_threshold=5000,
+                 generations=3, fsync=True):
+        super().__init__(compact_threshold)
+        self.snapshot_path = snapshot_path
+        self.wal_path = wal_path
+        self.generations = generations
+        self.fsync = fsync
+        self._file_lock = threading.Lock()
+
+    # File operations (safe to run in an executor thread)
+    def _write_pending(self):
+        pending = self._take_pending()
+        if not pending:
+            return 0
+        lines = "".join(json.dumps(r, separators=COMPACT_SEPARATORS, default=_json_default) + "\n" for r in pending)
+        with open(self.wal_path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        # Records are ASCII JSON, so characters == bytes
+        self.bytes_written += len(lines)
+        self.wal_records += len(pending)
+        return len(pending)
+
+    def flush(self):
+        """Append all pending records to the WAL, returns the number written"""
+        with self._file_lock:
+            return self._write_pending()
+
+    def compact(self, state, snapshot_seq):
+        """Write state as the new snapshot and drop WAL records no snapshot needs
+
+        state must be captured on the event loop at the same moment as
+        snapshot_seq (see begin_snapshot) so it reflects exactly the records
+        up to and including snapshot_seq. Records newer than the oldest
+        retained generation are kept, so any generation can still be
+        brought up to date.
+        """
+        with self._file_lock:
+            self._write_pending()
+            text = json.dumps(dict(state, wal_seq=snapshot_seq), separators=COMPACT_SEPARATORS,
+                              default=_json_default)
+            self._rotate_generations()
+            written = atomic_write(self.snapshot_path, text)
+            # The WAL may only shrink once the snapshot covering it is durable
+            floor = self._oldest_generation_seq(snapshot_seq)
+            records = self._read_wal()
+            tail = [r for r in records if r[0] > floor]
+            if len(tail) < len(records):
+                written += atomic_write(self.wal_path, "".join(
+                    json.dumps(r, separators=COMPACT_SEPARATORS, default=_json_default) + "\n" for r in tail
+                ))
+            self.bytes_written += written
+            self.wal_records = sum(1 for r in tail if r[0] > snapshot_seq)
+            return written
+
+    def _generation_path(self, n):
+        return self.snapshot_path if n == 0 else f"{self.snapshot_path}.{n}"
+
+    def _rotate_generations(self):
+        """Shift data.json -> data.json.1 -> ... keeping the last N snapshots
+
+        The current snapshot is linked (not moved) into .1 so a complete
+        snapshot file exists at every instant of the rotation.
+        """
+        if self.generations <= 0 or not os.path.exists(self.snapshot_path):
+            return
+        for n in range(self.generations, 1, -1):
+            older = self._generation_path(n - 1)
+            if os.path.exists(older):
+                os.replace(older, self._generation_path(n))
+        first = self._generation_path(1)
+        try:
+            if os.path.exists(first):
+                os.remove(first)
+            os.link(self.snapshot_path, first)
+        except OSError:
+            shutil.copy2(self.snapshot_path, first)
+
+    def _snapshot_seq(self, path):
+        """wal_seq of a snapshot file without parsing it (it is the last key written)"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 64))
+                tail = f.read().decode('ascii', 'replace')
+        except OSError:
+            return None
+        marker = tail.rfind('"wal_seq":')
+        if marker < 0 or not tail.endswith('}'):
+            return None
+        try:
+            return int(tail[marker + len('"wal_seq":'):-1])
+        except ValueError:
+            return None
+
+    def _oldest_generation_seq(self, newest_seq):
+        """Lowest wal_seq among the retained snapshots the WAL must still cover"""
+        floor = newest_seq
+        for n in range(1, self.generations + 1):
+            seq = self._snapshot_seq(self._generation_path(n))
+            if seq is not None:
+                floor = min(floor, seq)
+        return floor
+
+    def _read_wal(self):
+        records = []
+        try:
+            with open(self.wal_path, 'r', encoding='utf-8') as f:
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A torn final line is expected after a crash mid-append
+                        logger.warning(f"Skipping unreadable WAL line {line_no}")
+        except FileNotFoundError:
+            pass
+        return records
+
+    def _load_snapshot(self):
+        """Newest readable snapshot generation, falling back on corruption"""
+        found_any = False
+        last_error = None
+        for n in range(self.generations + 1):
+            path = self._generation_path(n)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                continue
+            except json.JSONDecodeError as e:
+                found_any = True
+                last_error = e
+                logger.error(f"Snapshot {path} is corrupt ({e}), trying an older generation")
+                continue
+            if n > 0:
+                logger.warning(f"Recovered state from older snapshot {path}")
+            return data, n
+
+        if last_error is not None:
+            raise last_error
+        if not found_any and not os.path.exists(self.wal_path):
+            raise FileNotFoundError(self.snapshot_path)
+        return {}, 0
+
+    def load(self):
+        """Return the snapshot with the WAL tail replayed on top
+
+        Raises FileNotFoundError when there is neither a snapshot nor a WAL,
+        json.JSONDecodeError when every snapshot generation is corrupt, and
+        WalGapError when the WAL no longer reaches back to the snapshot that
+        could be read (the changes in between would be silently lost).
+        """
+        with self._file_lock:
+            data, generation = self._load_snapshot()
+            snapshot_seq = data.pop('wal_seq', 0)
+            records = self._read_wal()
+            if records and records[0][0] > snapshot_seq + 1:
+                raise WalGapError(
+                    f"{self._generation_path(generation)} is at seq {snapshot_seq} but {self.wal_path} "
+                    f"starts at {records[0][0]}; restore a newer snapshot instead of losing those changes"
+                )
+            replayed = 0
+            for record in records:
+                if record[0] > snapshot_seq:
+                    apply_record(data, record)
+                    replayed += 1
+
+            self.seq = max([snapshot_seq] + [r[0] for r in records])
+            self.wal_records = replayed
+            if replayed:
+                logger.info(f"Replayed {replayed} WAL records on top of snapshot")
+            return data
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    points INTEGER,
+    voice_points INTEGER,
+    last_daily TEXT,
+    last_message_time TEXT,
+    next_voice_payout TEXT,
+    voice_tracking TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_points ON users(points DESC);
+CREATE TABLE IF NOT EXISTS bets (
+    bet_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    options TEXT NOT NULL,
+    end_time TEXT,
+    creator INTEGER,
+    resolved INTEGER NOT NULL DEFAULT 0,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bets_resolved ON bets(resolved, end_time);
+CREATE TABLE IF NOT EXISTS bet_stakes (
+    bet_id TEXT NOT NULL REFERENCES bets(bet_id) ON DELETE CASCADE,
+    option TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (bet_id, option, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_bet_stakes_user ON bet_stakes(user_id);
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    mask INTEGER NOT NULL,
+    powerball INTEGER NOT NULL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets(user_id);
+CREATE TABLE IF NOT EXISTS draws (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    main TEXT NOT NULL,
+    powerball INTEGER NOT NULL,
+    time TEXT
+);
+"""
+
+# Per-user dicts stored as columns of the users table; JSON-encoded unless integer
+USER_COLUMNS = {
+    'user_points': 'points',
+    'voice_channel_points': 'voice_points',
+    'last_daily': 'last_daily',
+    'last_message_time': 'last_message_time',
+    'next_voice_payout': 'next_voice_payout',
+    'voice_time_tracking': 'voice_tracking',
+}
+INTEGER_COLUMNS = {'points', 'voice_points'}
+BET_COLUMNS = ('name', 'options', 'bets', 'end_time', 'creator', 'resolved')
+
+
+class SqliteStore(RecordingStore):
+    """SQLite backend: indexed tables for users, bets, stakes, tickets and draws
+
+    Uses the same record_* interface as WalStore; flush() applies the queued
+    records in a single transaction. The connection runs in WAL journal mode
+    and all blocking work is meant to go through the store's own
+    single-thread executor (see run_async), keeping the event loop free.
+    """
+
+    def __init__(self, db_path='data.db', compact_threshold=5000):
+        super().__init__(compact_threshold)
+        self.db_path = db_path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    async def run_async(self, fn, *args):
+        """Run a blocking store call on the store's own thread"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def query(self, sql, params=()):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def query_async(self, sql, params=()):
+        return await self.run_async(self.query, sql, params)
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+        self.executor.shutdown(wait=True)
+
+    # Writing
+    def _apply(self, cur, record):
+        _, op, name, key, value = record
+        if name in USER_COLUMNS:
+            column = USER_COLUMNS[name]
+            if op == 's':
+                self._set_user_column(cur, column, key, value)
+            elif op == 'd':
+                cur.execute(f"UPDATE users SET {column} = NULL WHERE user_id = ?", (key,))
+            elif op == 'v':
+                cur.execute(f"UPDATE users SET {column} = NULL")
+                for user_id, item in value.items():
+                    self._set_user_column(cur, column, user_id, item)
+        elif name == 'active_bets':
+            if op == 's':
+                self._write_bet(cur, key, value)
+            elif op == 'd':
+                cur.execute("DELETE FROM bets WHERE bet_id = ?", (key,))
+            elif op == 'v':
+                cur.execute("DELETE FROM bets")
+                for bet_id, bet in value.items():
+                    self._write_bet(cur, bet_id, bet)
+        elif name == 'lottery_history':
+            if op == 'v':
+                if not isinstance(value, TicketStore):
+                    value = TicketStore.from_json(value)
+                cur.execute("DELETE FROM tickets")
+                cur.executemany(
+                    "INSERT INTO tickets (user_id, mask, powerball, time) VALUES (?, ?, ?, ?)",
+                    value.rows()
+                )
+            elif op == 'a':
+                # A row, or a packed block for a batch of tickets
+                rows = TicketStore.from_json([value]).rows() if isinstance(value, str) else [value]
+                cur.executemany(
+                    "INSERT INTO tickets (user_id, mask, powerball, time) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+        elif name == 'lottery_winners':
+            if op == 'v':
+                cur.execute("DELETE FROM draws")
+                cur.executemany(
+                    "INSERT INTO draws (main, powerball, time) VALUES (?, ?, ?)",
+                    [self._draw_row(d) for d in value]
+                )
+            elif op == 'a':
+                cur.execute("INSERT INTO draws (main, powerball, time) VALUES (?, ?, ?)", self._draw_row(value))
+        elif op == 'v':
+            cur.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (name, json.dumps(value))
+            )
+        else:
+            logger.warning(f"SQLite backend cannot apply {op!r} to {name!r}")
+
+    @staticmethod
+    def _set_user_column(cur, column, user_id, value):
+        if column not in INTEGER_COLUMNS:
+            value = json.dumps(value)
+        cur.execute(
+            f"INSERT INTO users (user_id, {column}) VALUES (?, ?) "
+            f"ON CONFLICT(user_id) DO UPDATE SET {column} = excluded.{column}",
+            (user_id, value)
+        )
+
+    @staticmethod
+    def _write_bet(cur, bet_id, bet):
+        extra = {k: v for k, v in bet.items() if k not in BET_COLUMNS}
+        cur.execute(
+            "INSERT OR REPLACE INTO bets (bet_id, name, options, end_time, creator, resolved, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (bet_id, bet['name'], json.dumps(bet['options']), bet.get('end_time'),
+             bet.get('creator'), int(bool(bet.get('resolved'))), json.dumps(extra))
+        )
+        cur.execute("DELETE FROM bet_stakes WHERE bet_id = ?", (bet_id,))
+        cur.executemany(
+            "INSERT INTO bet_stakes (bet_id, option, user_id, amount) VALUES (?, ?, ?, ?)",
+            [(bet_id, option, user_id, amount)
+             for option, stakes in bet.get('bets', {}).items()
+             for user_id, amount in stakes.items()]
+        )
+
+    @staticmethod
+    def _draw_row(draw):
+        return (json.dumps(draw['main']), draw['powerball'], draw.get('time'))
+
+    def _apply_all(self, records):
+        with self._db_lock, self._conn:
+            cur = self._conn.cursor()
+            for record in records:
+                self._apply(cur, record)
+            cur.execute(
+                "INSERT INTO meta (key, value) VALUES ('initialized', '1') "
+                "ON CONFLICT(key) DO NOTHING"
+            )
+
+    def flush(self):
+        """Apply all pending records in one transaction, returns the number applied"""
+        pending = self._take_pending()
+        if pending:
+            self._apply_all(pending)
+            self.wal_records += len(pending)
+        return len(pending)
+
+    def compact(self, state, snapshot_seq):
+        """Flush and checkpoint the SQLite WAL back into the main database file
+
+        SQLite keeps the tables current on every flush, so state is not
+        rewritten here.
+        """
+        self.flush()
+        with self._db_lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.wal_records = 0
+        return 0
+
+    def import_state(self, data):
+        """Replace every table with the contents of a loaded state dict"""
+        records = [[0, 'v', name, None, value] for name, value in data.items()]
+        self._apply_all(records)
+
+    # Reading
+    def load(self):
+        """Rebuild the in-memory state dicts from the tables
+
+        Raises FileNotFoundError when the database has never been written.
+        """
+        with self._db_lock:
+            conn = self._conn
+            if not conn.execute("SELECT 1 FROM meta WHERE key = 'initialized'").fetchone():
+                raise FileNotFoundError(self.db_path)
+
+            data = {name: {} for name in USER_COLUMNS}
+            columns = ", ".join(USER_COLUMNS.values())
+            for row in conn.execute(f"SELECT user_id, {columns} FROM users"):
+                user_id = row[0]
+                for (name, column), value in zip(USER_COLUMNS.items(), row[1:]):
+                    if value is None:
+                        continue
+                    data[name][user_id] = value if column in INTEGER_COLUMNS else json.loads(value)
+
+            bets = {}
+            for bet_id, name, options, end_time, creator, resolved, extra in conn.execute(
+                "SELECT bet_id, name, options, end_time, creator, resolved, extra FROM bets"
+            ):
+                options = json.loads(options)
+                bets[bet_id] = {
+                    'name': name,
+                    'options': options,
+                    'bets': {option: {} for option in options},
+                    'end_time': end_time,
+                    'creator': creator,
+                    'resolved': bool(resolved),
+                    **json.loads(extra or '{}')
+                }
+            for bet_id, option, user_id, amount in conn.execute(
+                "SELECT bet_id, option, user_id, amount FROM bet_stakes"
+            ):
+                bets[bet_id]['bets'].setdefault(option, {})[user_id] = amount
+            data['active_bets'] = bets
+
+            data['lottery_history'] = [
+                list(row) for row in conn.execute(
+                    "SELECT user_id, mask, powerball, time FROM tickets ORDER BY id"
+                )
+            ]
+            data['lottery_winners'] = [
+                {'main': json.loads(main), 'powerball': pb, 'time': t}
+                for main, pb, t in conn.execute("SELECT main, powerball, time FROM draws ORDER BY id")
+            ]
+            for key, value in conn.execute("SELECT key, value FROM meta WHERE key != 'initialized'"):
+                data[key] = json.loads(value)
+            return data
+
+
+def bet_participants(bet):
+    """Ids of everyone who staked on a bet"""
+    return {user_id for stakes in bet.get('bets', {}).values() for user_id in stakes}
+
+
+class BetArchive:
+    """Cold, append-only archive of finished bets as JSON lines
+
+    Resolved and cancelled bets are moved here out of active_bets so the hot
+    state only holds live bets. Appends are cheap; queries scan the file,
+    which is fine for an occasional history lookup. If the same bet_id is
+    archived twice (e.g. re-resolved after a crash) the last line wins.
+    """
+
+    executor = None
+
+    def __init__(self, path='bet_archive.jsonl', fsync=True):
+        self.path = path
+        self.fsync = fsync
+
+    def append(self, bet_id, bet):
+        line = json.dumps({'bet_id': bet_id, **bet}, separators=COMPACT_SEPARATORS)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _scan(self):
+        entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn final line from a crash mid-append
+                    entries.pop(entry['bet_id'], None)
+                    entries[entry['bet_id']] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def get(self, bet_id):
+        """Archived bet by id, or None"""
+        return self._scan().get(bet_id)
+
+    def recent(self, limit=10, user_id=None):
+        """Most recently archived bets first, optionally only ones user_id created or joined"""
+        entries = list(self._scan().values())
+        if user_id is not None:
+            entries = [e for e in entries
+                       if str(e.get('creator')) == str(user_id) or str(user_id) in bet_participants(e)]
+        return entries[::-1][:limit]
+
+    def __len__(self):
+        return len(self._scan())
+
+
+SQLITE_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bet_archive (
+    bet_id TEXT PRIMARY KEY,
+    archived_at REAL NOT NULL,
+    creator INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bet_archive_time ON bet_archive(archived_at);
+CREATE TABLE IF NOT EXISTS bet_archive_users (
+    bet_id TEXT NOT NULL REFERENCES bet_archive(bet_id) ON DELETE CASCADE,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (bet_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_bet_archive_users ON bet_archive_users(user_id);
+"""
+
+
+class SqliteBetArchive:
+    """BetArchive backed by tables in the SqliteStore database"""
+
+    def __init__(self, store):
+        self.store = store
+        self.executor = store.executor
+        with store._db_lock:
+            store._conn.executescript(SQLITE_ARCHIVE_SCHEMA)
+
+    def append(self, bet_id, bet):
+        with self.store._db_lock, self.store._conn as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO bet_archive (bet_id, archived_at, creator, data) VALUES (?, ?, ?, ?)",
+                (bet_id, time.time(), bet.get('creator'), json.dumps(bet))
+            )
+            conn.execute("DELETE FROM bet_archive_users WHERE bet_id = ?", (bet_id,))
+            conn.executemany(
+                "INSERT INTO bet_archive_users (bet_id, user_id) VALUES (?, ?)",
+                [(bet_id, user_id) for user_id in bet_participants(bet)]
+            )
+
+    @staticmethod
+    def _entry(bet_id, data):
+        return {'bet_id': bet_id, **json.loads(data)}
+
+    def get(self, bet_id):
+        rows = self.store.query("SELECT bet_id, data FROM bet_archive WHERE bet_id = ?", (bet_id,))
+        return self._entry(*rows[0]) if rows else None
+
+    def recent(self, limit=10, user_id=None):
+        if user_id is None:
+            rows = self.store.query(
+                "SELECT bet_id, data FROM bet_archive ORDER BY archived_at DESC LIMIT ?", (limit,)
+            )
+        else:
+            rows = self.store.query(
+                "SELECT bet_id, data FROM bet_archive WHERE creator = ? OR bet_id IN "
+                "(SELECT bet_id FROM bet_archive_users WHERE user_id = ?) "
+                "ORDER BY archived_at DESC LIMIT ?",
+                (int(user_id), str(user_id), limit)
+            )
+        return [self._entry(*row) for row in rows]
+
+    def __len__(self):
+        return self.store.query("SELECT COUNT(*) FROM bet_archive")[0][0]
+
+
+def open_archive(store, path='bet_archive.jsonl'):
+    """Bet archive matching the store backend (a table for SQLite, a file otherwise)"""
+    if isinstance(store, SqliteStore):
+        return SqliteBetArchive(store)
+    return BetArchive(path)
+
+
+def open_store(backend='json', **kwargs):
+    """Create the storage backend selected by name ('json' or 'sqlite')"""
+    if backend == 'json':
+        return WalStore(**kwargs)
+    if backend == 'sqlite':
+        return SqliteStore(**kwargs)
+    raise ValueError(f"Unknown storage backend {backend!r}")
+
+
+def migrate_json_to_sqlite(json_path='data.json', db_path='data.db', wal_path='data.wal'):
+    """One-shot import of a data.json (+ WAL tail) into a SQLite database"""
+    data = WalStore(json_path, wal_path).load()
+    data['voice_time_tracking'], migrated = migrate_voice_tracking(
+        data.get('voice_time_tracking', {}),
+        time.time()
+    )
+    # Live voice sessions hold datetimes and are rebuilt from gateway events
+    data.pop('voice_start_times', None)
+    sqlite_store = SqliteStore(db_path)
+    try:
+        sqlite_store.import_state(data)
+    finally:
+        sqlite_store.close()
+    logger.info(
+        f"Migrated {len(data.get('user_points', {}))} users, {len(data.get('active_bets', {}))} bets "
+        f"and {len(TicketStore.from_json(data.get('lottery_history', [])))} tickets into {db_path} "
+        f"({migrated} legacy voice records converted)"
+    )
+    return data
+
+
+class SaveScheduler:
+    """Coalesces save requests so the WAL is flushed at most once per window
+
+    request() only marks the state dirty; the first request in a quiet period
+    arms a timer and every request made before it fires rides along with the
+    same flush.
+    """
+
+    def __init__(self, flush, window=2.0):
+        self._flush = flush
+        self.window = window
+        self.requested = 0
+        self.performed = 0
+        self._dirty = False
+        self._task = None
+        self._sleeping = False
+        self._lock = asyncio.Lock()
+
+    def request(self):
+        """Mark state dirty and make sure a flush is scheduled"""
+        self.requested += 1
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._dirty:
+            self._sleeping = True
+            try:
+                await asyncio.sleep(self.window)
+            finally:
+                self._sleeping = False
+            await self._flush_locked()
+
+    async def _flush_locked(self):
+        async with self._lock:
+            self._dirty = False
+            await self._flush()
+            self.performed += 1
+
+    async def flush_now(self):
+        """Flush immediately (used on shutdown)
+
+        Only a timer still waiting out its window is cancelled; a flush that
+        is already running finishes first (the lock serialises the two).
+        """
+        if self._sleeping:
+            self._task.cancel()
+        await self._flush_locked()
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'performed': self.performed,
+            'pending': self._dirty
+        }
+
+
+if __name__ == '__main__':
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        sys.exit("usage: python storage.py migrate [data.json] [data.db]")
+    migrate_json_to_sqlite(*sys.argv[2:4])
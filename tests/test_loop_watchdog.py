@@ -0,0 +1,55 @@
+import asyncio
+import sys
+import threading
+import time
+
+from loop_watchdog import LoopWatchdog
+
+
+def test_report_is_safe_while_stalls_are_recorded():
+    watchdog = LoopWatchdog()
+
+    def record():
+        for n in range(2000):
+            watchdog._record(f"label{n}", 0.3, {})
+
+    writer = threading.Thread(target=record)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Switch threads often enough to interleave with report()
+    try:
+        writer.start()
+        while writer.is_alive():
+            watchdog.report(5)
+        writer.join()
+    finally:
+        sys.setswitchinterval(interval)
+    rows = watchdog.report(limit=None)
+    assert len(rows) == 2000
+    assert all(count == 1 for _, count, _, _ in rows)
+
+
+def test_quick_restart_leaves_one_watcher_thread():
+    reporting = threading.Event()
+    release = threading.Event()
+
+    def on_stall(stall):
+        reporting.set()
+        release.wait(5)
+
+    async def main():
+        watchdog = LoopWatchdog(threshold=0.05, interval=0.01, on_stall=on_stall)
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)  # Stall the loop
+        while not reporting.is_set():
+            await asyncio.sleep(0.01)
+        # Restart while the first watcher is busy reporting, outside its wait
+        watchdog.stop()
+        watchdog.start()
+        release.set()
+        await asyncio.sleep(0.1)
+        watchers = [t for t in threading.enumerate() if t.name == 'loop-watchdog']
+        watchdog.stop()
+        return watchers
+
+    assert len(asyncio.run(main())) == 1
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+import payouts
+from payouts import parimutuel_payouts
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def engine(request, monkeypatch):
+    if request.param == 'numpy':
+        if payouts.np is None:
+            pytest.skip("NumPy not installed")
+    else:
+        monkeypatch.setattr(payouts, 'np', None)
+    return request.param
+
+
+def test_payouts_sum_to_pool(engine):
+    rng = random.Random(7)
+    for _ in range(500):
+        stakes = [(str(n), rng.randint(0, 1000)) for n in range(rng.randint(1, 40))]
+        if not any(amount for _, amount in stakes):
+            continue
+        pool = sum(amount for _, amount in stakes) + rng.randint(0, 5000)
+        result = parimutuel_payouts(stakes, pool)
+        assert [(user_id, amount) for user_id, amount, _ in result] == stakes
+        assert sum(payout for _, _, payout in result) == pool
+        for _, amount, payout in result:
+            exact = amount * pool / sum(a for _, a in stakes)
+            assert exact - 1 < payout < exact + 1
+
+
+def test_numpy_and_python_agree(monkeypatch):
+    if payouts.np is None:
+        pytest.skip("NumPy not installed")
+    rng = random.Random(11)
+    cases = []
+    for _ in range(300):
+        stakes = [(str(n), rng.randint(1, 500)) for n in range(rng.randint(2, 30))]
+        cases.append((stakes, sum(a for _, a in stakes) + rng.randint(0, 999)))
+    with_numpy = [parimutuel_payouts(stakes, pool) for stakes, pool in cases]
+    monkeypatch.setattr(payouts, 'np', None)
+    assert [parimutuel_payouts(stakes, pool) for stakes, pool in cases] == with_numpy
+
+
+def test_equal_remainders_go_to_earlier_stakes(engine):
+    # 10 points over three equal stakes: 3 each, and the spare point to the first bettor
+    result = parimutuel_payouts([('a', 5), ('b', 5), ('c', 5)], 10)
+    assert [payout for _, _, payout in result] == [4, 3, 3]
+    result = parimutuel_payouts([('a', 1), ('b', 1), ('c', 1), ('d', 1)], 6)
+    assert [payout for _, _, payout in result] == [2, 2, 1, 1]
+
+
+def test_huge_stakes_fall_back_to_exact_integers(engine):
+    stakes = [('a', 3 * 10 ** 12), ('b', 10 ** 12), ('c', 1)]
+    pool = 7 * 10 ** 12 + 3
+    assert stakes[0][1] * pool >= payouts._INT64_SAFE
+    result = parimutuel_payouts(stakes, pool)
+    total = sum(amount for _, amount in stakes)
+    assert sum(payout for _, _, payout in result) == pool
+    for (_, amount), (_, _, payout) in zip(stakes, result):
+        assert amount * pool // total <= payout <= amount * pool // total + 1
+
+
+def test_all_zero_stakes_pay_nothing(engine):
+    assert parimutuel_payouts([('a', 0), ('b', 0)], 100) == [('a', 0, 0), ('b', 0, 0)]
+    assert parimutuel_payouts([], 100) == []
@@ -0,0 +1,181 @@
+import asyncio
+import multiprocessing
+import sqlite3
+import time
+
+import pytest
+
+from ledger import InsufficientFunds, Ledger
+from shared_state import LocalBalances, SqliteBalances, SharedStateBusy
+
+
+def spend(path, attempts, results):
+    balances = SqliteBalances(path, max_wait=30.0)
+    spent = 0
+    for _ in range(attempts):
+        try:
+            balances.add('u', -1, check=True)
+            spent += 1
+        except InsufficientFunds:
+            pass
+    balances.close()
+    results.put(spent)
+
+
+@pytest.fixture(params=['local', 'sqlite'])
+def balances(request, tmp_path):
+    if request.param == 'local':
+        service = LocalBalances()
+    else:
+        service = SqliteBalances(str(tmp_path / 'shared.db'))
+    yield service
+    service.close()
+
+
+def test_checked_add_refuses_to_overdraw(balances):
+    balances.open_account('u', 10)
+    assert balances.add('u', -4, check=True) == 6
+    with pytest.raises(InsufficientFunds) as error:
+        balances.add('u', -7, check=True)
+    assert (error.value.balance, error.value.amount) == (6, 7)
+    assert balances.balance('u') == 6
+    # Unchecked adds (credits) may take any value
+    assert balances.add('u', -7) == -1
+
+
+def test_scopes_are_separate(tmp_path):
+    scope = ['a']
+    balances = SqliteBalances(str(tmp_path / 'shared.db'), scope=lambda: scope[0])
+    balances.set_balance('u', 5)
+    scope[0] = 'b'
+    assert balances.balance('u') == 0
+    assert balances.open_account('u', 3) == 3
+    scope[0] = 'a'
+    assert balances.load() == {'u': 5}
+    balances.close()
+
+
+def test_processes_never_spend_the_same_points(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    seed = SqliteBalances(path)
+    seed.set_balance('u', 500)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    workers = [context.Process(target=spend, args=(path, 200, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    spent = sum(results.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join(timeout=60)
+    assert spent == 500
+    assert seed.balance('u') == 0
+    seed.close()
+
+
+def test_locked_database_fails_fast_instead_of_blocking(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    balances = SqliteBalances(path, max_wait=0.2)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        start = time.monotonic()
+        with pytest.raises(SharedStateBusy):
+            balances.add('u', 1)
+        assert time.monotonic() - start < 1.0
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    assert balances.add('u', 1) == 1
+    balances.close()
+
+
+def test_ledger_writes_off_the_loop_and_retries_while_busy(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    accounts = {}
+    other = sqlite3.connect(path, isolation_level=None)
+
+    async def run(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def main():
+        ledger = Ledger(lambda: accounts, shared=SqliteBalances(path, max_wait=0.05), run=run)
+        await ledger.open_account_async('u', 10)
+        other.execute("BEGIN IMMEDIATE")
+        credit = asyncio.create_task(ledger.credit_async('u', 5))
+        ticks = 0
+        while not credit.done():
+            ticks += 1
+            if ticks == 5:
+                other.execute("ROLLBACK")
+            await asyncio.sleep(0.05)
+        await credit
+        ledger.shared.close()
+        return ticks
+
+    # The loop kept running while the write waited for the lock
+    assert asyncio.run(main()) >= 5
+    assert accounts == {'u': 15}
+    other.close()
+
+
+def test_ledger_gives_up_after_busy_wait(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    accounts = {}
+    other = sqlite3.connect(path, isolation_level=None)
+
+    async def main():
+        ledger = Ledger(lambda: accounts, shared=SqliteBalances(path, max_wait=0.02), busy_wait=0.2)
+        await ledger.open_account_async('u', 10)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            with pytest.raises(SharedStateBusy):
+                await ledger.debit_async('u', 5)
+        finally:
+            other.execute("ROLLBACK")
+        ledger.shared.close()
+
+    asyncio.run(main())
+    assert accounts == {'u': 10}
+    other.close()
+
+
+def test_refresh_keeps_local_changes_made_during_the_fetch():
+    accounts = {}
+    shared = LocalBalances()
+    gate = asyncio.Event()
+
+    async def run(fn, *args):
+        result = fn(*args)
+        await gate.wait()
+        return result
+
+    async def main():
+        ledger = Ledger(lambda: accounts, shared=shared, run=run)
+        for user_id in ('u', 'v'):
+            ledger.open_account(user_id, 10)
+        shared.add('v', 7)  # another process
+        refresh = asyncio.create_task(ledger.refresh_async())
+        await asyncio.sleep(0)
+        ledger.credit('u', 5)  # after the snapshot was taken
+        gate.set()
+        assert await refresh == 1
+
+    asyncio.run(main())
+    assert accounts == {'u': 15, 'v': 17}
+
+
+def test_refresh_skips_a_snapshot_older_than_a_bulk_change():
+    accounts = {}
+    shared = LocalBalances()
+
+    async def run(fn, *args):
+        result = fn(*args)
+        accounts['u'] = 0
+        ledger.mark_bulk_change()
+        return result
+
+    ledger = Ledger(lambda: accounts, shared=shared, run=run)
+    ledger.open_account('u', 10)
+    shared.add('u', 7)
+    assert asyncio.run(ledger.refresh_async()) == 0
+    assert accounts == {'u': 0}
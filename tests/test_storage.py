@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import pytest
+
+from storage import SaveScheduler, WalStore, WalGapError
+from tickets import TicketStore, random_tickets
+
+
+def make_store(tmp_path, **kwargs):
+    return WalStore(snapshot_path=str(tmp_path / 'data.json'), wal_path=str(tmp_path / 'data.wal'),
+                    fsync=False, **kwargs)
+
+
+def set_points(store, state, user_id, points):
+    state['user_points'][user_id] = points
+    store.record_set('user_points', user_id, points)
+
+
+def test_fallback_generation_replays_changes_since_it(tmp_path):
+    store = make_store(tmp_path)
+    state = {'user_points': {}}
+    for n in range(10):
+        set_points(store, state, str(n), n * 10)
+    store.compact(json.loads(json.dumps(state)), store.begin_snapshot())
+    for n in range(10):
+        set_points(store, state, str(n), n * 100)
+    set_points(store, state, 'late', 7)
+    store.compact(json.loads(json.dumps(state)), store.begin_snapshot())
+    set_points(store, state, '0', 12345)
+    store.flush()
+
+    (tmp_path / 'data.json').write_text('{"user_points": {"0": ')
+
+    recovered = make_store(tmp_path).load()
+    assert recovered == state
+
+
+def test_compaction_keeps_only_records_a_generation_needs(tmp_path):
+    store = make_store(tmp_path, generations=1)
+    state = {'user_points': {}}
+    for round_number in range(3):
+        set_points(store, state, 'u', round_number)
+        store.compact(json.loads(json.dumps(state)), store.begin_snapshot())
+    seqs = [json.loads(line)[0] for line in (tmp_path / 'data.wal').read_text().splitlines()]
+    # data.json.1 is at seq 2, so only the record made after it is still needed
+    assert seqs == [3]
+    assert store.wal_records == 0
+
+
+def test_load_refuses_wal_that_skips_past_the_snapshot(tmp_path):
+    (tmp_path / 'data.json').write_text('{"user_points":{"u":1},"wal_seq":5}')
+    (tmp_path / 'data.wal').write_text('[9,"s","user_points","u",4]\n')
+    with pytest.raises(WalGapError):
+        make_store(tmp_path).load()
+
+
+def test_crash_recovery_replays_flushed_records_and_skips_torn_line(tmp_path):
+    store = make_store(tmp_path)
+    state = {'user_points': {}}
+    set_points(store, state, 'a', 1)
+    store.compact(json.loads(json.dumps(state)), store.begin_snapshot())
+
+    history = TicketStore()
+    set_points(store, state, 'b', 2)
+    masks, pbs = random_tickets(30, range(1, 19), range(1, 11))
+    batch = history.extend(5, masks, pbs, 1700000000.0)
+    store.record_append('lottery_history', history.packed(batch.start, batch.stop))
+    ticket = history.add(6, [1, 2, 3, 4, 5], 9, 1700000001.0)
+    store.record_append('lottery_history', ticket.to_row())
+    store.record_delete('user_points', 'a')
+    del state['user_points']['a']
+    store.flush()
+    # Killed mid-append: a torn last line, and a change that was never flushed
+    with open(tmp_path / 'data.wal', 'a', encoding='utf-8') as f:
+        f.write('[99,"s","user_points","c",')
+    store.record_set('user_points', 'lost', 1)
+
+    recovered = make_store(tmp_path)
+    data = recovered.load()
+    assert data['user_points'] == state['user_points']
+    assert list(TicketStore.from_json(data['lottery_history']).rows()) == list(history.rows())
+    # New records continue after the last one that made it to disk
+    assert recovered.seq == store.seq - 1
+
+
+def test_flush_now_lets_a_running_flush_finish():
+    finished = []
+
+    async def main():
+        started = asyncio.Event()
+
+        async def flush():
+            started.set()
+            await asyncio.sleep(0.05)
+            finished.append(True)
+
+        scheduler = SaveScheduler(flush, window=0)
+        scheduler.request()
+        await started.wait()
+        await scheduler.flush_now()
+        assert scheduler._task.done() and not scheduler._task.cancelled()
+
+    asyncio.run(main())
+    assert finished == [True, True]
+
+
+def test_flush_now_cancels_a_waiting_timer():
+    flushes = []
+
+    async def main():
+        async def flush():
+            flushes.append(True)
+
+        scheduler = SaveScheduler(flush, window=60)
+        scheduler.request()
+        await asyncio.sleep(0)
+        await scheduler.flush_now()
+        await asyncio.sleep(0)
+        assert scheduler._task.cancelled()
+
+    asyncio.run(main())
+    assert flushes == [True]
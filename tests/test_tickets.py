@@ -0,0 +1,119 @@
+import random
+from datetime import datetime
+
+import pytest
+
+import tickets
+from tickets import (TicketStore, evaluate_draw, settle_draw, lottery_frequencies, random_tickets,
+                     numbers_to_mask, mask_to_numbers)
+
+NUMBERS = range(1, 19)
+POWERBALLS = range(1, 11)
+
+
+def make_store(count, users=20, seed=3):
+    rng = random.Random(seed)
+    store = TicketStore()
+    for _ in range(count // 50):
+        masks, pbs = random_tickets(50, NUMBERS, POWERBALLS, rng=rng)
+        store.extend(rng.randint(1, users), masks, pbs, 1700000000.5)
+    return store
+
+
+@pytest.fixture
+def without_numpy(monkeypatch):
+    monkeypatch.setattr(tickets, 'np', None)
+
+
+def test_masks_round_trip():
+    for numbers in ([1, 2, 3, 4, 5], [14, 15, 16, 17, 18], [2, 7, 9, 11, 18]):
+        assert mask_to_numbers(numbers_to_mask(numbers)) == numbers
+
+
+def test_json_round_trip_of_every_persisted_form():
+    store = make_store(500)
+    items = store.to_json() + [
+        [42, numbers_to_mask([1, 2, 3, 4, 5]), 7, 1700000001.0],
+        {'user': '43', 'numbers': [6, 7, 8, 9, 10], 'powerball': 2, 'time': '2024-01-02T03:04:05'},
+    ]
+    loaded = TicketStore.from_json(items)
+    assert len(loaded) == 502
+    assert list(loaded.rows())[:500] == list(store.rows())
+    assert loaded[500].to_row() == [42, numbers_to_mask([1, 2, 3, 4, 5]), 7, 1700000001.0]
+    legacy = loaded[501]
+    assert (legacy.user, legacy.numbers, legacy.powerball) == ('43', [6, 7, 8, 9, 10], 2)
+    assert legacy.timestamp == datetime(2024, 1, 2, 3, 4, 5).timestamp()
+
+    again = TicketStore.from_json(loaded.to_json())
+    assert list(again.rows()) == list(loaded.rows())
+    assert TicketStore.from_json(TicketStore().to_json()).to_json() == []
+
+
+def test_packed_batches_append_like_their_source():
+    store = make_store(300)
+    rebuilt = TicketStore()
+    for start in range(0, 300, 70):
+        rebuilt = TicketStore.from_json(rebuilt.to_json() + [store.packed(start, min(start + 70, 300))])
+    assert list(rebuilt.rows()) == list(store.rows())
+
+
+def reference_tiers(store, winning_main, winning_pb):
+    winning = set(winning_main)
+    tiers = {'jackpot': [], 'match5': [], 'match4': [], 'powerball': []}
+    for index, ticket in enumerate(store):
+        matched = len(winning & set(ticket.numbers))
+        if matched == 5:
+            tiers['jackpot' if ticket.powerball == winning_pb else 'match5'].append(index)
+        elif matched == 4:
+            tiers['match4'].append(index)
+        if ticket.powerball == winning_pb:
+            tiers['powerball'].append(index)
+    return tiers
+
+
+def draws(count, seed=5):
+    rng = random.Random(seed)
+    return [(sorted(rng.sample(NUMBERS, 5)), rng.choice(POWERBALLS)) for _ in range(count)]
+
+
+def test_evaluate_draw_matches_reference_with_and_without_numpy(monkeypatch):
+    store = make_store(5000)
+    # A jackpot and a match-5 ticket so every tier is exercised
+    store.add(99, [1, 2, 3, 4, 5], 6, 0.0)
+    store.add(98, [1, 2, 3, 4, 5], 7, 0.0)
+    cases = draws(20) + [([1, 2, 3, 4, 5], 6)]
+    expected = [reference_tiers(store, main, pb) for main, pb in cases]
+    if tickets.np is not None:
+        assert [evaluate_draw(store, main, pb) for main, pb in cases] == expected
+    monkeypatch.setattr(tickets, 'np', None)
+    assert [evaluate_draw(store, main, pb) for main, pb in cases] == expected
+
+
+def test_settle_draw_aggregates_per_user_in_first_win_order(monkeypatch):
+    store = make_store(5000)
+    columns = store.draw_columns()
+    for main, pb in draws(10):
+        tiers = reference_tiers(store, main, pb)
+        expected = {}
+        for tier, indices in tiers.items():
+            counts = {}
+            for index in indices:
+                counts[store.users[index]] = counts.get(store.users[index], 0) + 1
+            expected[tier] = list(counts.items())
+        if tickets.np is not None:
+            assert settle_draw(*columns, main, pb) == expected
+        with monkeypatch.context() as patch:
+            patch.setattr(tickets, 'np', None)
+            assert settle_draw(*columns, main, pb) == expected
+
+
+def test_lottery_frequencies_agree_with_and_without_numpy(monkeypatch):
+    store = make_store(2000)
+    _, masks, pbs = store.draw_columns()
+    history = draws(8)
+    result = lottery_frequencies(history, masks, pbs, NUMBERS, POWERBALLS)
+    assert sum(result['main_drawn'].values()) == 5 * len(history)
+    assert sum(result['main_picked'].values()) == 5 * len(store)
+    assert sum(result['pb_picked'].values()) == len(store)
+    monkeypatch.setattr(tickets, 'np', None)
+    assert lottery_frequencies(history, masks, pbs, NUMBERS, POWERBALLS) == result
@@ -0,0 +1,353 @@
+"""Columnar lottery ticket store
+
+Tickets are kept as parallel packed arrays instead of a list of dicts:
+    users  - int64 Discord user id
+    masks  - uint32 bitmask of the 5 main numbers (bit n-1 set for number n)
+    pbs    - uint8 powerball
+    times  - float64 purchase time (epoch seconds)
+
+With the default 1-18 range the main-number mask fits in 18 bits. A draw is
+evaluated for every tier in one vectorized popcount pass when NumPy is
+installed, and in a single plain-Python pass otherwise. Quick picks are
+drawn in bulk by indexing into the precomputed list of every possible mask
+(8,568 for 5 of 18) and appended to the store in one step.
+
+settle_draw and lottery_frequencies are module-level functions over plain
+column arrays (see TicketStore.draw_columns), so the bot can run them in a
+process pool: arrays pickle as raw bytes, about 13 bytes per ticket.
+
+Persisted form (to_json / from_json) is a list whose items may be:
+    str  - base64 packed block of whole columns (what snapshots write)
+    list - one compact row [user_id, mask, powerball, timestamp] (WAL appends)
+    dict - a legacy {'user', 'numbers', 'powerball', 'time'} ticket
+"""
+import base64
+import functools
+import itertools
+import random
+import struct
+import sys
+from array import array
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; evaluate_draw falls back to pure Python
+    np = None
+
+
+def numbers_to_mask(numbers):
+    """Pack main numbers (1-32) into a bitmask"""
+    mask = 0
+    for n in numbers:
+        mask |= 1 << (n - 1)
+    return mask
+
+
+def mask_to_numbers(mask):
+    """Unpack a bitmask into the sorted list of main numbers"""
+    numbers = []
+    n = 1
+    while mask:
+        if mask & 1:
+            numbers.append(n)
+        mask >>= 1
+        n += 1
+    return numbers
+
+
+@functools.lru_cache(maxsize=None)
+def combination_masks(numbers, picks=5):
+    """Mask of every picks-of-numbers combination (numbers is a range, so it caches)"""
+    return array('I', (numbers_to_mask(c) for c in itertools.combinations(numbers, picks)))
+
+
+def random_tickets(count, numbers, powerballs, picks=5, rng=random):
+    """Draw count random tickets at once, returns (masks, powerballs) arrays
+
+    A uniform pick from all combinations is the same distribution as
+    sorted(random.sample(numbers, picks)), at one index draw per ticket.
+    """
+    masks = array('I', rng.choices(combination_masks(numbers, picks), k=count))
+    pbs = array('B', rng.choices(powerballs, k=count))
+    return masks, pbs
+
+
+def _to_epoch(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+class Ticket:
+    """A single ticket: int user id, main-number mask, powerball, epoch time"""
+
+    __slots__ = ('user_id', 'mask', 'powerball', 'timestamp')
+
+    def __init__(self, user_id, mask, powerball, timestamp):
+        self.user_id = user_id
+        self.mask = mask
+        self.powerball = powerball
+        self.timestamp = timestamp
+
+    @property
+    def user(self):
+        """User id as the string key used by user_points"""
+        return str(self.user_id)
+
+    @property
+    def numbers(self):
+        return mask_to_numbers(self.mask)
+
+    @property
+    def purchased(self):
+        return datetime.fromtimestamp(self.timestamp)
+
+    def to_row(self):
+        return [self.user_id, self.mask, self.powerball, self.timestamp]
+
+
+_BLOCK_HEADER = struct.Struct('<I')
+
+
+class TicketStore:
+    """Append-only columnar storage for lottery tickets
+
+    Indexing and iteration build Ticket records on demand; the draw path
+    reads the columns directly. A per-user index of ticket offsets is built
+    on first use and then kept current on every append. generation changes
+    whenever the store is cleared, so holders of old offsets can tell.
+    """
+
+    def __init__(self):
+        self.users = array('q')
+        self.masks = array('I')
+        self.pbs = array('B')
+        self.times = array('d')
+        self.generation = 0
+        self._by_user = None
+
+    @classmethod
+    def from_json(cls, items):
+        """Build a store from its persisted form (see module docstring)"""
+        store = cls()
+        for item in items:
+            if isinstance(item, str):
+                store._extend_packed(item)
+            elif isinstance(item, dict):
+                store.add(item['user'], item['numbers'], item['powerball'], _to_epoch(item['time']))
+            else:
+                store.append_row(item)
+        return store
+
+    def add(self, user_id, numbers, powerball, timestamp):
+        """Append one ticket from its raw fields, returns the new Ticket"""
+        return self.append_row((int(user_id), numbers_to_mask(numbers), powerball, timestamp))
+
+    def append_row(self, row):
+        """Append a compact [user_id, mask, powerball, timestamp] row"""
+        user_id, mask, powerball, timestamp = row
+        if self._by_user is not None:
+            self._by_user.setdefault(user_id, array('I')).append(len(self.users))
+        self.users.append(user_id)
+        self.masks.append(mask)
+        self.pbs.append(powerball)
+        self.times.append(timestamp)
+        return Ticket(user_id, mask, powerball, timestamp)
+
+    def extend(self, user_id, masks, pbs, timestamp):
+        """Append a batch of one user's tickets, returns the range of new offsets"""
+        user_id = int(user_id)
+        start = len(self.users)
+        count = len(masks)
+        self.users.extend(array('q', [user_id]) * count)
+        self.masks.extend(masks)
+        self.pbs.extend(pbs)
+        self.times.extend(array('d', [timestamp]) * count)
+        if self._by_user is not None:
+            self._by_user.setdefault(user_id, array('I')).extend(range(start, start + count))
+        return range(start, start + count)
+
+    def offsets_for(self, user_id):
+        """Offsets of a user's tickets in purchase order"""
+        if self._by_user is None:
+            index = {}
+            for offset, owner in enumerate(self.users):
+                index.setdefault(owner, array('I')).append(offset)
+            self._by_user = index
+        return self._by_user.get(int(user_id), array('I'))
+
+    def rows(self):
+        return zip(self.users, self.masks, self.pbs, self.times)
+
+    def clear(self):
+        for column in self._columns():
+            del column[:]
+        self._by_user = None
+        self.generation += 1
+
+    def __len__(self):
+        return len(self.users)
+
+    def __getitem__(self, index):
+        return Ticket(self.users[index], self.masks[index], self.pbs[index], self.times[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __copy__(self):
+        clone = TicketStore()
+        clone.users = array('q', self.users)
+        clone.masks = array('I', self.masks)
+        clone.pbs = array('B', self.pbs)
+        clone.times = array('d', self.times)
+        return clone
+
+    copy = __copy__
+
+    def _columns(self):
+        return (self.users, self.masks, self.pbs, self.times)
+
+    def draw_columns(self):
+        """Copies of the user, mask and powerball columns for settle_draw/lottery_frequencies"""
+        return array('q', self.users), array('I', self.masks), array('B', self.pbs)
+
+    def to_json(self):
+        """Pack all columns into one base64 block (about 21 bytes per ticket)"""
+        if not len(self):
+            return []
+        return [self.packed(0, len(self))]
+
+    def packed(self, start, stop):
+        """Base64 block of the tickets in [start, stop), e.g. a batch for one WAL record"""
+        parts = [_BLOCK_HEADER.pack(stop - start)]
+        for column in self._columns():
+            column = column[start:stop]
+            if sys.byteorder == 'big':
+                column.byteswap()
+            parts.append(column.tobytes())
+        return base64.b64encode(b"".join(parts)).decode('ascii')
+
+    def _extend_packed(self, block):
+        self._by_user = None
+        raw = base64.b64decode(block)
+        count, = _BLOCK_HEADER.unpack_from(raw)
+        offset = _BLOCK_HEADER.size
+        for column in self._columns():
+            chunk = array(column.typecode)
+            size = count * chunk.itemsize
+            chunk.frombytes(raw[offset:offset + size])
+            if sys.byteorder == 'big':
+                chunk.byteswap()
+            column.extend(chunk)
+            offset += size
+
+
+_POPCOUNT_BYTES = None
+
+
+def _popcount(values):
+    """Vectorized popcount for a uint32 NumPy array"""
+    global _POPCOUNT_BYTES
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    if _POPCOUNT_BYTES is None:
+        _POPCOUNT_BYTES = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return _POPCOUNT_BYTES[values.view(np.uint8)].reshape(-1, 4).sum(axis=1)
+
+
+def evaluate_draw(store, winning_main, winning_pb):
+    """Classify every ticket against a draw in a single pass
+
+    Returns a dict of ascending ticket indices per tier:
+        'jackpot'   - all 5 main numbers and the powerball
+        'match5'    - all 5 main numbers, wrong powerball
+        'match4'    - exactly 4 main numbers (regardless of powerball)
+        'powerball' - powerball matched (regardless of main numbers)
+    """
+    return _evaluate_columns(store.masks, store.pbs, numbers_to_mask(winning_main), winning_pb)
+
+
+def _evaluate_columns(mask_column, pb_column, winning_mask, winning_pb):
+    if np is not None and len(mask_column):
+        masks = np.frombuffer(mask_column, dtype=np.uint32)
+        pbs = np.frombuffer(pb_column, dtype=np.uint8)
+        all_main = masks == winning_mask
+        pb_hit = pbs == winning_pb
+        matches = _popcount(masks & np.uint32(winning_mask))
+        return {
+            'jackpot': np.flatnonzero(all_main & pb_hit).tolist(),
+            'match5': np.flatnonzero(all_main & ~pb_hit).tolist(),
+            'match4': np.flatnonzero(matches == 4).tolist(),
+            'powerball': np.flatnonzero(pb_hit).tolist()
+        }
+
+    tiers = {'jackpot': [], 'match5': [], 'match4': [], 'powerball': []}
+    for index, (mask, pb) in enumerate(zip(mask_column, pb_column)):
+        if mask == winning_mask:
+            tiers['jackpot' if pb == winning_pb else 'match5'].append(index)
+        elif (mask & winning_mask).bit_count() == 4:
+            tiers['match4'].append(index)
+        if pb == winning_pb:
+            tiers['powerball'].append(index)
+    return tiers
+
+
+def settle_draw(users, masks, pbs, winning_main, winning_pb):
+    """Classify every ticket and aggregate the winners per user
+
+    Takes the columns from TicketStore.draw_columns. Returns a dict of
+    [(user_id, winning_tickets), ...] per tier (see evaluate_draw), users in
+    the order of their first winning ticket.
+    """
+    tiers = _evaluate_columns(masks, pbs, numbers_to_mask(winning_main), winning_pb)
+    settled = {}
+    if np is not None and len(users):
+        user_array = np.frombuffer(users, dtype=np.int64)
+        for tier, indices in tiers.items():
+            owners, first, counts = np.unique(user_array[indices], return_index=True, return_counts=True)
+            order = np.argsort(first, kind='stable')
+            settled[tier] = list(zip(owners[order].tolist(), counts[order].tolist()))
+        return settled
+    for tier, indices in tiers.items():
+        counts = {}
+        for index in indices:
+            user_id = users[index]
+            counts[user_id] = counts.get(user_id, 0) + 1
+        settled[tier] = list(counts.items())
+    return settled
+
+
+def lottery_frequencies(draws, masks, pbs, numbers, powerballs):
+    """How often each number was drawn and how often it was picked this round
+
+    draws is a list of (main_numbers, powerball) from past draws; masks/pbs
+    are ticket columns. Returns {'main_drawn', 'pb_drawn', 'main_picked',
+    'pb_picked'}, each a {number: count} dict.
+    """
+    main_drawn = dict.fromkeys(numbers, 0)
+    pb_drawn = dict.fromkeys(powerballs, 0)
+    for main, pb in draws:
+        for n in main:
+            main_drawn[n] = main_drawn.get(n, 0) + 1
+        pb_drawn[pb] = pb_drawn.get(pb, 0) + 1
+
+    if np is not None and len(masks):
+        mask_array = np.frombuffer(masks, dtype=np.uint32)
+        main_picked = {n: int(np.count_nonzero(mask_array & np.uint32(1 << (n - 1)))) for n in numbers}
+        pb_counts = np.bincount(np.frombuffer(pbs, dtype=np.uint8), minlength=max(powerballs) + 1)
+        pb_picked = {pb: int(pb_counts[pb]) for pb in powerballs}
+    else:
+        # At most 8,568 distinct masks, so expand bits per distinct mask only
+        mask_counts = {}
+        for mask in masks:
+            mask_counts[mask] = mask_counts.get(mask, 0) + 1
+        main_picked = dict.fromkeys(numbers, 0)
+        for mask, count in mask_counts.items():
+            for n in mask_to_numbers(mask):
+                main_picked[n] = main_picked.get(n, 0) + count
+        pb_picked = dict.fromkeys(powerballs, 0)
+        for pb in pbs:
+            pb_picked[pb] = pb_picked.get(pb, 0) + 1
+    return {'main_drawn': main_drawn, 'pb_drawn': pb_drawn, 'main_picked': main_picked, 'pb_picked': pb_picked}